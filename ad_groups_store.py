@@ -0,0 +1,131 @@
+"""
+ad_groups_store.py
+Compressed storage of ad-group analyses in the `pageAdGroups` side table.
+
+Each row holds the complete GET /api/pages/{page_id}/ad-groups response body
+('{"status":"done","groups":...}') gzip-compressed in a VARBINARY(MAX), plus the SHA-256 of the
+uncompressed body used as ETag. Clients that accept gzip get the stored bytes as they are.
+pages.AdGroupsJson (NVARCHAR, UTF-16) is only read as a fallback for rows analysed before this table
+existed; saving an analysis moves the page to the new table and clears the old column.
+"""
+
+import gzip
+import hashlib
+import os
+from typing import Optional, Union
+
+import pyodbc
+
+from fast_json import loads as json_loads
+
+AD_GROUPS_GZIP_LEVEL = int(os.environ.get("AD_GROUPS_GZIP_LEVEL", "6"))
+
+GZIP = "gzip"
+
+CREATE_TABLE = """
+    IF OBJECT_ID('dbo.pageAdGroups', 'U') IS NULL
+    BEGIN
+        CREATE TABLE pageAdGroups (
+            Page_id NVARCHAR(450) NOT NULL,
+            Encoding VARCHAR(16) NOT NULL,
+            ContentHash BINARY(32) NOT NULL,
+            RawSize INT NOT NULL,
+            Body VARBINARY(MAX) NOT NULL,
+            UpdatedAt DATETIME2 NOT NULL CONSTRAINT DF_pageAdGroups_UpdatedAt DEFAULT SYSUTCDATETIME(),
+            CONSTRAINT PK_pageAdGroups PRIMARY KEY (Page_id)
+        )
+    END
+"""
+
+UPSERT = """
+    MERGE pageAdGroups WITH (HOLDLOCK) AS t
+    USING (SELECT ? AS Page_id) AS s ON t.Page_id = s.Page_id
+    WHEN MATCHED THEN
+        UPDATE SET Encoding = ?, ContentHash = ?, RawSize = ?, Body = ?, UpdatedAt = SYSUTCDATETIME()
+    WHEN NOT MATCHED THEN
+        INSERT (Page_id, Encoding, ContentHash, RawSize, Body) VALUES (s.Page_id, ?, ?, ?, ?);
+"""
+
+
+def create_page_ad_groups_if_not_exists(db: pyodbc.Connection):
+    """Creates the pageAdGroups side table."""
+    cursor = db.cursor()
+    cursor.execute(CREATE_TABLE)
+    db.commit()
+
+
+def response_body(groups_json: Union[str, bytes]) -> bytes:
+    """Body of a 'done' ad-groups response around an already serialised analysis."""
+    if isinstance(groups_json, str):
+        groups_json = groups_json.encode("utf-8")
+    return b'{"status":"done","groups":' + groups_json + b'}'
+
+
+def encode_analysis(groups_json: Union[str, bytes]) -> tuple[bytes, bytes, int]:
+    """Returns (gzip body, SHA-256 of the uncompressed body, uncompressed size)."""
+    body = response_body(groups_json)
+    # mtime=0 keeps the bytes stable for the same analysis
+    compressed = gzip.compress(body, compresslevel=AD_GROUPS_GZIP_LEVEL, mtime=0)
+    return compressed, hashlib.sha256(body).digest(), len(body)
+
+
+def decode_body(encoding: str, body: bytes) -> bytes:
+    """Uncompressed response body of a stored row."""
+    if encoding == GZIP:
+        return gzip.decompress(body)
+    return body
+
+
+def save_analysis(db: pyodbc.Connection, page_id: str, groups_json: Union[str, bytes]):
+    """Stores the analysis compressed and clears the legacy pages.AdGroupsJson value. Commits."""
+    compressed, content_hash, raw_size = encode_analysis(groups_json)
+    cursor = db.cursor()
+    cursor.execute(
+        UPSERT,
+        (page_id,
+         GZIP, pyodbc.Binary(content_hash), raw_size, pyodbc.Binary(compressed),
+         GZIP, pyodbc.Binary(content_hash), raw_size, pyodbc.Binary(compressed))
+    )
+    cursor.execute(
+        "UPDATE pages SET AdGroupsJson = NULL WHERE Page_id = ? AND AdGroupsJson IS NOT NULL",
+        (page_id,)
+    )
+    db.commit()
+
+
+def load_analysis(db: pyodbc.Connection, page_id: str) -> Optional[dict]:
+    """Stored analysis of the page (the 'groups' object), from the side table or the legacy column."""
+    cursor = db.cursor()
+    cursor.execute(
+        """
+        SELECT g.Encoding, g.Body, CASE WHEN g.Page_id IS NULL THEN p.AdGroupsJson END
+        FROM pages p
+        LEFT JOIN pageAdGroups g ON g.Page_id = p.Page_id
+        WHERE p.Page_id = ?
+        """,
+        (page_id,)
+    )
+    row = cursor.fetchone()
+    if not row:
+        return None
+    encoding, body, legacy_json = row[0], row[1], row[2]
+    try:
+        if body is not None:
+            return json_loads(decode_body(encoding, bytes(body)))["groups"]
+        if legacy_json and legacy_json != "__ANALYZING__":
+            return json_loads(legacy_json)
+    except (ValueError, KeyError, OSError):
+        pass
+    return None
+
+
+def clear_analysis(db: pyodbc.Connection, page_id: Optional[str] = None):
+    """Deletes the stored analysis of one page, or of every page when page_id is None. Commits."""
+    cursor = db.cursor()
+    if page_id is None:
+        cursor.execute("DELETE FROM pageAdGroups")
+        cursor.execute("UPDATE pages SET AdGroupsJson = NULL WHERE AdGroupsJson IS NOT NULL")
+    else:
+        cursor.execute("DELETE FROM pageAdGroups WHERE Page_id = ?", (page_id,))
+        cursor.execute("UPDATE pages SET AdGroupsJson = NULL WHERE Page_id = ?", (page_id,))
+    db.commit()
@@ -9,15 +9,23 @@ from passlib.context import CryptContext
 from pydantic import BaseModel
 import pyodbc
 
-from database import get_auth_db
+from cache import TTLCache
+from database import auth_pool, pooled_connection, run_db
 
 # Security Settings
 SECRET_KEY = os.environ.get("JWT_SECRET_KEY", "your-super-secret-key-change-in-prod")
 ALGORITHM = "HS256"
 ACCESS_TOKEN_EXPIRE_MINUTES = 60 * 24 # 24 hours
 
+# Resolved principals are cached per worker so authenticated calls skip the auth DB.
+# Users are disabled directly in the auth DB, so revocation is bounded by the TTL: a disabled
+# (or deleted) user keeps being accepted for up to USER_CACHE_TTL seconds on every worker.
+USER_CACHE_TTL = float(os.environ.get("USER_CACHE_TTL", "60"))
+USER_CACHE_MAX_SIZE = int(os.environ.get("USER_CACHE_MAX_SIZE", "1024"))
+
 pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="/api/login")
+user_cache = TTLCache(max_size=USER_CACHE_MAX_SIZE, ttl=USER_CACHE_TTL)
 
 class Token(BaseModel):
     access_token: str
@@ -98,7 +106,15 @@ def get_user(db: pyodbc.Connection, username: str) -> Optional[UserInDB]:
         )
     return None
 
-async def get_current_user(token: str = Depends(oauth2_scheme), db: pyodbc.Connection = Depends(get_auth_db)):
+def load_user(username: str) -> Optional[UserInDB]:
+    """Loads the user from the auth DB into the cache (blocking; called after a cache miss)."""
+    with pooled_connection(auth_pool) as db:
+        user = get_user(db, username)
+    if user is not None:
+        user_cache.set(username, user)
+    return user
+
+async def get_current_user(token: str = Depends(oauth2_scheme)):
     credentials_exception = HTTPException(
         status_code=status.HTTP_401_UNAUTHORIZED,
         detail="Could not validate credentials",
@@ -113,7 +129,10 @@ async def get_current_user(token: str = Depends(oauth2_scheme), db: pyodbc.Conne
     except jwt.PyJWTError:
         raise credentials_exception
         
-    user = get_user(db, username=token_data.username)
+    user = user_cache.get(token_data.username)
+    if user is None:
+        # Cache miss: the auth DB lookup blocks, so keep it off the event loop
+        user = await run_db(load_user, token_data.username)
     if user is None:
         raise credentials_exception
     return user
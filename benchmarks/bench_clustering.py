@@ -0,0 +1,115 @@
+"""
+bench_clustering.py
+Near-duplicate body clustering (clustering.py) on a synthetic page: base texts with variants that
+differ by emojis, prices, punctuation, spacing and one swapped word. Reports groups before/after, cluster purity
+against the known base text, and time of the LSH merge vs a naive pairwise comparison.
+
+    python benchmarks/bench_clustering.py [--ads 100000] [--bases 400] [--threshold 0.8]
+"""
+
+import argparse
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import clustering  # noqa: E402
+from meta_service import AdGroupAggregator  # noqa: E402
+
+WORDS = ("oferta envío gratis descuento hoy solo nuevo colección verano crema piel natural "
+         "compra ahora stock limitado regalo clientes calidad premium garantía devolución "
+         "tienda online zapatillas vestido reloj perfume cachorro entrenamiento").split()
+EMOJIS = ["🔥", "✅", "👉", "💥", "⭐", "🎁", ""]
+
+
+def make_bases(count: int, rnd: random.Random) -> list:
+    return [" ".join(rnd.choice(WORDS) for _ in range(rnd.randint(12, 30))) for _ in range(count)]
+
+
+def variant(base: str, rnd: random.Random) -> str:
+    text = base
+    if rnd.random() < 0.5:
+        # One word swapped: survives normalisation, so only LSH can merge it
+        words = text.split(" ")
+        words[rnd.randrange(len(words))] = rnd.choice(WORDS)
+        text = " ".join(words)
+    if rnd.random() < 0.6:
+        text = f"{rnd.choice(EMOJIS)} {text} {rnd.choice(EMOJIS)}"
+    if rnd.random() < 0.6:
+        text += f" solo {rnd.randint(9, 99)},{rnd.randint(0, 99):02d}€"
+    if rnd.random() < 0.4:
+        text = text.replace(" ", "  ", 1)
+    if rnd.random() < 0.4:
+        text = text.upper() if rnd.random() < 0.3 else text + "!!"
+    return text
+
+
+def make_page(ads: int, bases: int, seed: int = 1) -> tuple[list, dict]:
+    """Returns (ads, body -> base index)."""
+    rnd = random.Random(seed)
+    base_texts = make_bases(bases, rnd)
+    origin = {}
+    out = []
+    for i in range(ads):
+        b = rnd.randrange(bases)
+        body = variant(base_texts[b], rnd)
+        origin.setdefault(body.strip(), b)
+        out.append({
+            "ad_snapshot_url": f"https://www.facebook.com/ads/archive/render_ad/?id={i}",
+            "eu_total_reach": rnd.randint(0, 100_000),
+            "ad_creative_bodies": [body],
+            "ad_delivery_start_time": "2025-05-01",
+            "ad_delivery_stop_time": None,
+            "target_locations": [],
+        })
+    return out, origin
+
+
+def naive_pairwise(bodies: list, threshold: float) -> int:
+    sets = [clustering.shingles(clustering.normalize_body(b)) for b in bodies]
+    matches = 0
+    for i in range(len(sets)):
+        for j in range(i + 1, len(sets)):
+            if clustering.jaccard(sets[i], sets[j]) >= threshold:
+                matches += 1
+    return matches
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--ads", type=int, default=100_000)
+    parser.add_argument("--bases", type=int, default=400)
+    parser.add_argument("--threshold", type=float, default=clustering.AD_GROUP_CLUSTER_THRESHOLD)
+    parser.add_argument("--naive-sample", type=int, default=1500, help="bodies compared pairwise for the baseline")
+    args = parser.parse_args()
+
+    ads, origin = make_page(args.ads, args.bases)
+    aggregator = AdGroupAggregator()
+    aggregator.add_ads(ads)
+    groups, _ = aggregator.result()
+    exact_count = len(groups)
+
+    started = time.perf_counter()
+    merged = clustering.cluster_groups(groups, args.threshold)
+    lsh_s = time.perf_counter() - started
+
+    pure = sum(1 for g in merged if len({origin[b] for b in [g["body"]] + g.get("variants", [])}) == 1)
+    print(f"ads: {len(ads)}  exact groups: {exact_count}  clustered groups: {len(merged)}  "
+          f"(base texts: {args.bases})")
+    print(f"pure clusters: {pure}/{len(merged)}  threshold: {args.threshold}  "
+          f"bands x rows: {clustering.lsh_bands(args.threshold)}  numpy: {clustering.np is not None}")
+    print(f"LSH merge: {lsh_s * 1000:.1f} ms for {exact_count} bodies")
+
+    sample = [g["body"] for g in groups[:args.naive_sample]]
+    started = time.perf_counter()
+    naive_pairwise(sample, args.threshold)
+    naive_s = time.perf_counter() - started
+    projected = naive_s * (exact_count / max(len(sample), 1)) ** 2
+    print(f"naive pairwise: {naive_s * 1000:.1f} ms for {len(sample)} bodies "
+          f"(~{projected:.1f} s projected for {exact_count})")
+
+
+if __name__ == "__main__":
+    main()
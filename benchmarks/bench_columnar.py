@@ -0,0 +1,64 @@
+"""
+bench_columnar.py
+group_ads_by_body / build_activity_graph on one large batch: per-ad Python loop vs the NumPy
+engine in columnar.py. Checks first that both produce the same output.
+
+    python benchmarks/bench_columnar.py [--ads 100000] [--repeat 3]
+"""
+
+import argparse
+import os
+import sys
+import time
+from datetime import date
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import columnar  # noqa: E402
+import fast_json  # noqa: E402
+from meta_service import PageAnalysisAggregator  # noqa: E402
+from benchmarks.generators import make_ads  # noqa: E402
+
+def analyse(ads: list, threshold: int) -> dict:
+    columnar.COLUMNAR_THRESHOLD = threshold
+    aggregator = PageAnalysisAggregator()
+    aggregator.groups.now_date = date(2026, 1, 1)
+    aggregator.add_ads(ads)
+    return aggregator.result()
+
+
+def best_of(fn, repeat: int) -> float:
+    best = float("inf")
+    for _ in range(repeat):
+        columnar.parse_meta_date.cache_clear()
+        columnar.iso_week_key.cache_clear()
+        started = time.perf_counter()
+        fn()
+        best = min(best, time.perf_counter() - started)
+    return best
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--ads", type=int, default=100_000)
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    if columnar.np is None:
+        sys.exit("numpy is not installed: only the Python path is available")
+
+    ads = make_ads(args.ads)
+    python_out = fast_json.dumps(analyse(ads, 0))
+    columnar_out = fast_json.dumps(analyse(ads, 1))
+    if python_out != columnar_out:
+        sys.exit("columnar output differs from the Python loop")
+    print(f"parity OK on {len(ads)} ads ({len(python_out) / 1e6:.1f} MB of output)")
+
+    python_s = best_of(lambda: analyse(ads, 0), args.repeat)
+    columnar_s = best_of(lambda: analyse(ads, 1), args.repeat)
+    print(f"python loop:     {python_s * 1000:9.1f} ms")
+    print(f"columnar engine: {columnar_s * 1000:9.1f} ms  ({python_s / columnar_s:.1f}x)")
+
+
+if __name__ == "__main__":
+    main()
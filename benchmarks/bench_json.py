@@ -0,0 +1,138 @@
+"""
+bench_json.py
+Stdlib json vs the fast_json backend on the payloads that dominate our profiles:
+a 500-row /api/pages response, a multi-megabyte ad-groups analysis and a Graph API
+ads_archive page (decode).
+
+    python benchmarks/bench_json.py [--repeat 20]
+"""
+
+import argparse
+import json
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import fast_json  # noqa: E402
+
+
+def pages_payload(rows: int = 500, seed: int = 1) -> list:
+    rnd = random.Random(seed)
+    return [
+        {
+            "Id": i,
+            "ProductId": i,
+            "Page_id": str(100000000000 + i),
+            "Name": f"Página de prueba {i} ✓",
+            "eu_total_reach": rnd.randint(0, 5_000_000),
+            "active_eu_total_reach": rnd.randint(0, 1_000_000),
+            "active_ads_count": rnd.randint(0, 400),
+            "category": rnd.choice(["Shopping & Retail", "Health & Beauty", "Apparel"]),
+            "TagName": rnd.choice([None, "Dropshipping", "Brand"]),
+            "TagId": rnd.choice([None, 1, 2]),
+            "status": rnd.choice([0, 7, 11, 13]),
+            "status_updated_at": "2025-06-01T10:00:00",
+            "beneficiary": None,
+            "page_notes": None,
+            "nicheName": rnd.choice([None, "Pets", "Fitness"]),
+            "top_creative": {
+                "creativeUrl": f"https://cdn.example.com/creatives/{i}.jpg",
+                "creative_type": rnd.choice([1, 2]),
+                "AdSnapshotUrl": f"https://www.facebook.com/ads/archive/render_ad/?id={i}",
+            },
+        }
+        for i in range(rows)
+    ]
+
+
+def ad_groups_payload(groups: int = 400, links_per_group: int = 40, seed: int = 2) -> dict:
+    rnd = random.Random(seed)
+    countries = ["Spain", "France", "Italy", "Germany", "Portugal", "Lithuania"]
+    out = []
+    for g in range(groups):
+        links = [
+            {
+                "url": f"https://www.facebook.com/ads/library/?id={g * 1000 + l}",
+                "is_active": rnd.random() < 0.3,
+                "reach": rnd.randint(0, 200_000),
+                "start_time": f"2025-{rnd.randint(1, 12):02d}-{rnd.randint(1, 28):02d}",
+                "stop_time": None,
+                "countries": rnd.sample(countries, rnd.randint(1, 3)),
+            }
+            for l in range(links_per_group)
+        ]
+        out.append({"body": f"Texto creativo {g} — oferta limitada", "reach": sum(x["reach"] for x in links),
+                    "is_active": any(x["is_active"] for x in links), "links": links})
+    return {
+        "groups": out,
+        "activity_graph": [{"week": f"2025-W{w:02d}", "active_count": rnd.randint(0, 300)} for w in range(1, 53)],
+        "total_scraped_reach": sum(g["reach"] for g in out),
+        "country_stats": {c: rnd.randint(1, 10_000) for c in countries},
+    }
+
+
+def graph_page_payload(ads: int = 500, seed: int = 3) -> bytes:
+    rnd = random.Random(seed)
+    data = [
+        {
+            "ad_snapshot_url": f"https://www.facebook.com/ads/archive/render_ad/?id={i}&access_token=x",
+            "eu_total_reach": rnd.randint(0, 100_000),
+            "ad_creative_bodies": [f"Cuerpo {rnd.randint(0, 50)}"],
+            "ad_delivery_start_time": "2025-03-04",
+            "ad_delivery_stop_time": rnd.choice([None, "2025-04-01"]),
+            "target_locations": [{"name": "Spain", "type": "countries", "excluded": False}],
+        }
+        for i in range(ads)
+    ]
+    return json.dumps({"data": data, "paging": {"next": "https://graph.facebook.com/v24.0/ads_archive?after=x"}}).encode()
+
+
+def stdlib_dumps(obj) -> bytes:
+    # What starlette's JSONResponse.render does
+    return json.dumps(obj, ensure_ascii=False, allow_nan=False, indent=None, separators=(",", ":")).encode("utf-8")
+
+
+def best_of(fn, arg, repeat: int) -> float:
+    best = float("inf")
+    for _ in range(repeat):
+        started = time.perf_counter()
+        fn(arg)
+        best = min(best, time.perf_counter() - started)
+    return best
+
+
+def run(repeat: int) -> list:
+    pages = pages_payload()
+    groups = ad_groups_payload()
+    groups_bytes = stdlib_dumps(groups)
+    graph_page = graph_page_payload()
+    cases = [
+        ("dumps /api/pages x500", stdlib_dumps, fast_json.dumps, pages),
+        (f"dumps ad-groups {len(groups_bytes) / 1e6:.1f} MB", stdlib_dumps, fast_json.dumps, groups),
+        (f"loads ad-groups {len(groups_bytes) / 1e6:.1f} MB", json.loads, fast_json.loads, groups_bytes),
+        ("loads ads_archive page x500", json.loads, fast_json.loads, graph_page),
+    ]
+    results = []
+    for name, baseline, fast, arg in cases:
+        base_s = best_of(baseline, arg, repeat)
+        fast_s = best_of(fast, arg, repeat)
+        results.append({"case": name, "stdlib_ms": base_s * 1000, "fast_ms": fast_s * 1000, "speedup": base_s / fast_s})
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--repeat", type=int, default=20)
+    args = parser.parse_args()
+
+    print(f"fast_json backend: {fast_json.BACKEND}")
+    print(f"{'case':34} {'stdlib ms':>10} {'fast ms':>10} {'speedup':>8}")
+    for r in run(args.repeat):
+        print(f"{r['case']:34} {r['stdlib_ms']:10.2f} {r['fast_ms']:10.2f} {r['speedup']:7.1f}x")
+
+
+if __name__ == "__main__":
+    main()
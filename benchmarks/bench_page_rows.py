@@ -0,0 +1,98 @@
+"""
+bench_page_rows.py
+/api/pages row mapping: the previous per-row TopCreative/PageData construction plus FastAPI's
+response_model pass, against page_rows_to_dicts. Checks first that both produce the same JSON.
+
+    python benchmarks/bench_page_rows.py [--rows 500] [--repeat 20]
+"""
+
+import argparse
+import os
+import sys
+import time
+from typing import List
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from fastapi.encoders import jsonable_encoder  # noqa: E402
+from pydantic import TypeAdapter  # noqa: E402
+
+import fast_json  # noqa: E402
+from main import (  # noqa: E402
+    CREATIVE_TYPE_MAP, STATUS_MAP_TO_UI, PageData, TopCreative, page_rows_to_dicts,
+)
+from benchmarks.generators import make_page_rows  # noqa: E402
+
+def legacy_rows_to_models(rows) -> List[PageData]:
+    """The loop query_pages used before page_rows_to_dicts."""
+    results = []
+    for row in rows:
+        top_creative = None
+        if row.creativeUrl or row.AdSnapshotUrl:
+            c_type_str = CREATIVE_TYPE_MAP.get(row.creative_type, "image") if row.creative_type else "image"
+            top_creative = TopCreative(
+                media_url=row.creativeUrl or "",
+                media_type=c_type_str,
+                snapshot_url=row.AdSnapshotUrl or ""
+            )
+        ui_status = STATUS_MAP_TO_UI.get(row.status, "unprocessed")
+        results.append(PageData(
+            page_id=row.Page_id,
+            name=row.Name or "Unknown",
+            country="",
+            total_eu_reach=row.eu_total_reach or 0,
+            active_eu_total_reach=row.active_eu_total_reach,
+            active_ads_count=row.active_ads_count,
+            manual_status="unprocessed" if row.status in (0, 7) else ui_status,
+            beneficiary=row.pp_beneficiary or "",
+            notes=row.pp_page_notes or "",
+            tag=row.TagName,
+            tagId=row.TagId,
+            top_creative=top_creative,
+            is_queued_for_scrape=(row.status == 7)
+        ))
+    return results
+
+
+_response_adapter = TypeAdapter(List[PageData])
+
+
+def legacy_response(rows) -> bytes:
+    # Model per row, then FastAPI's response_model validation + jsonable_encoder + render
+    models = legacy_rows_to_models(rows)
+    validated = _response_adapter.validate_python(models, from_attributes=True)
+    return fast_json.dumps(jsonable_encoder(validated))
+
+
+def fast_response(rows) -> bytes:
+    return fast_json.dumps(page_rows_to_dicts(rows))
+
+
+def best_of(fn, arg, repeat: int) -> float:
+    best = float("inf")
+    for _ in range(repeat):
+        started = time.perf_counter()
+        fn(arg)
+        best = min(best, time.perf_counter() - started)
+    return best
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rows", type=int, default=500)
+    parser.add_argument("--repeat", type=int, default=20)
+    args = parser.parse_args()
+
+    rows = make_page_rows(args.rows)
+    if legacy_response(rows) != fast_response(rows):
+        sys.exit("page_rows_to_dicts output differs from the PageData model output")
+    print(f"parity OK on {len(rows)} rows")
+
+    legacy_s = best_of(legacy_response, rows, args.repeat)
+    fast_s = best_of(fast_response, rows, args.repeat)
+    print(f"models + response_model: {legacy_s * 1000:8.2f} ms")
+    print(f"page_rows_to_dicts:      {fast_s * 1000:8.2f} ms  ({legacy_s / fast_s:.1f}x)")
+
+
+if __name__ == "__main__":
+    main()
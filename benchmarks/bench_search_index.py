@@ -0,0 +1,104 @@
+"""
+bench_search_index.py
+Page name trigram index (search_index.py) on synthetic names: build time, memory, lookup time vs
+a full scan of the folded names (what `Name LIKE '%term%'` has to do), and a parity check that
+every name containing the term is among the candidates.
+
+    python benchmarks/bench_search_index.py [--pages 200000] [--queries 2000]
+"""
+
+import argparse
+import os
+import random
+import sys
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from search_index import PageSearchIndex, fold  # noqa: E402
+
+WORDS = ("shop tienda moda beauty belleza store zapatos shoes fitness pets mascotas home hogar "
+         "natural organic premium outlet boutique style jewelry joyería kids niños sport deportes "
+         "straße café crème ÆON öko ūkis parduotuvė").split()
+SYLLABLES = "ka lo mi ra zen tor vi sa lu ne bri go mar tel ix ón ša ar el que".split()
+
+
+def brand(rnd: random.Random) -> str:
+    # Invented brand names keep the trigram vocabulary realistic (not just the common words)
+    return "".join(rnd.choice(SYLLABLES) for _ in range(rnd.randint(2, 4)))
+
+
+def make_names(count: int, seed: int = 1) -> list:
+    rnd = random.Random(seed)
+    names = []
+    for i in range(count):
+        words = [brand(rnd)] + [rnd.choice(WORDS) for _ in range(rnd.randint(0, 3))]
+        if rnd.random() < 0.5:
+            words = [w.capitalize() for w in words]
+        if rnd.random() < 0.3:
+            words.append(str(rnd.randint(1, 999)))
+        names.append((i + 1, " ".join(words) if rnd.random() < 0.99 else None))
+    return names
+
+
+def make_terms(names: list, count: int, seed: int = 2) -> list:
+    rnd = random.Random(seed)
+    terms = []
+    while len(terms) < count:
+        _, name = rnd.choice(names)
+        if not name or len(name) < 4:
+            continue
+        start = rnd.randrange(len(name) - 3)
+        term = name[start:start + rnd.randint(3, 10)]
+        terms.append(term.upper() if rnd.random() < 0.3 else term)
+    return terms
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--pages", type=int, default=200_000)
+    parser.add_argument("--queries", type=int, default=2000)
+    args = parser.parse_args()
+
+    names = make_names(args.pages)
+    index = PageSearchIndex(max_candidates=args.pages)
+    started = time.perf_counter()
+    index.replace(names, b"\x00" * 8)
+    build_s = time.perf_counter() - started
+
+    # Second build only to measure its memory (tracemalloc slows it down)
+    tracemalloc.start()
+    probe = PageSearchIndex()
+    probe.replace(names, b"\x00" * 8)
+    memory = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    del probe
+
+    folded = [(page_id, fold(name or "")) for page_id, name in names]
+    terms = make_terms(names, args.queries)
+
+    started = time.perf_counter()
+    results = [index.lookup(term) for term in terms]
+    index_s = time.perf_counter() - started
+
+    started = time.perf_counter()
+    expected = [sorted(page_id for page_id, text in folded if fold(term) in text) for term in terms]
+    scan_s = time.perf_counter() - started
+
+    for term, result, want in zip(terms, results, expected):
+        if result is None:
+            continue
+        if not set(want) <= set(result[0]):
+            sys.exit(f"index missed pages for {term!r}")
+    answered = sum(1 for r in results if r is not None)
+    stats = index.stats()
+    print(f"pages: {stats['pages']}  trigrams: {stats['trigrams']}  postings: {stats['postings']}")
+    print(f"build: {build_s:.2f} s  memory: {memory / 1e6:.1f} MB ({memory / max(stats['pages'], 1):.0f} B/page)")
+    print(f"parity OK on {answered}/{len(terms)} terms answered by the index")
+    print(f"index lookup: {index_s / len(terms) * 1e6:9.1f} us/query")
+    print(f"full scan:    {scan_s / len(terms) * 1e6:9.1f} us/query  ({scan_s / index_s:.0f}x)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,80 @@
+"""
+generators.py
+Deterministic synthetic data for the benchmarks: Meta ads_archive ads, pageListing rows as
+returned to query_pages, and stored ad-group analyses. Same seed + size = same data.
+"""
+
+import random
+from collections import namedtuple
+
+from main import PAGE_LIST_COLUMNS
+
+COUNTRIES = ["Spain", "France", "Italy", "Germany", "Portugal", "Lithuania", "Poland", "Austria"]
+
+# Behaves like a pyodbc.Row of the query_pages SELECT: positional unpacking and attribute access
+PageRow = namedtuple("PageRow", PAGE_LIST_COLUMNS)
+
+
+def make_ads(count: int, seed: int = 1, bodies: int = 0) -> list:
+    """
+    ads_archive ads with the fields meta_service requests, including the awkward cases:
+    missing reach, empty/None bodies, unparseable dates, zips/cities and excluded locations.
+    `bodies` distinct creative texts (default count // 50).
+    """
+    rnd = random.Random(seed)
+    texts = [f"  Oferta {i} — envío gratis  " for i in range(max(bodies or count // 50, 1))]
+    ads = []
+    for i in range(count):
+        locations = []
+        for _ in range(rnd.randint(0, 3)):
+            kind = rnd.choice(["countries", "countries", "zips", "cities"])
+            country = rnd.choice(COUNTRIES)
+            name = f"{rnd.randint(10000, 99999)}, {country}" if kind == "zips" else country
+            locations.append({"type": kind, "name": name, "excluded": rnd.random() < 0.1})
+        ad = {
+            "ad_snapshot_url": f"https://www.facebook.com/ads/archive/render_ad/?id={i}" if rnd.random() < 0.98 else None,
+            "eu_total_reach": rnd.randint(0, 250_000),
+            "ad_creative_bodies": rnd.choice([[rnd.choice(texts)], [rnd.choice(texts)], [], None]),
+            "ad_delivery_start_time": rnd.choice([
+                f"{rnd.randint(2022, 2026)}-{rnd.randint(1, 12):02d}-{rnd.randint(1, 28):02d}", None, "n/a"]),
+            "ad_delivery_stop_time": rnd.choice([
+                None, f"{rnd.randint(2022, 2027)}-{rnd.randint(1, 12):02d}-{rnd.randint(1, 28):02d}", "bad"]),
+            "target_locations": locations,
+        }
+        if rnd.random() < 0.01:
+            del ad["eu_total_reach"]
+        ads.append(ad)
+    return ads
+
+
+def make_page_rows(count: int, seed: int = 1) -> list:
+    """pageListing rows in PAGE_LIST_COLUMNS order, with NULLs, every status and creative type."""
+    rnd = random.Random(seed)
+    rows = []
+    for i in range(count):
+        has_creative = rnd.random() < 0.9
+        rows.append(PageRow(
+            Page_id=str(100000000000 + i),
+            Name=rnd.choice([f"Página {i}", None]),
+            eu_total_reach=rnd.choice([rnd.randint(200_000, 9_000_000), None]),
+            active_eu_total_reach=rnd.choice([rnd.randint(0, 1_000_000), None]),
+            active_ads_count=rnd.choice([rnd.randint(0, 400), None]),
+            TagName=rnd.choice([None, "Dropshipping", "Brand"]),
+            TagId=rnd.choice([None, 1, 2]),
+            status=rnd.choice([None, 0, 7, 11, 13]),
+            pp_beneficiary=rnd.choice([None, "", "ACME S.L."]),
+            pp_page_notes=rnd.choice([None, "revisar"]),
+            creativeUrl=f"https://cdn.example.com/{i}.jpg" if has_creative else None,
+            creative_type=rnd.choice([None, 0, 1, 2, 3]) if has_creative else None,
+            AdSnapshotUrl=rnd.choice([None, f"https://www.facebook.com/ads/archive/render_ad/?id={i}"]),
+        ))
+    return rows
+
+
+def make_analysis(ads_count: int, seed: int = 1) -> dict:
+    """A stored ad-group analysis (what AdGroupsJson / pageAdGroups hold) built from make_ads."""
+    from meta_service import PageAnalysisAggregator
+
+    aggregator = PageAnalysisAggregator()
+    aggregator.add_ads(make_ads(ads_count, seed))
+    return aggregator.result()
@@ -0,0 +1,54 @@
+"""
+mock_graph.py
+Offline stand-in for the Graph API ads_archive endpoint (httpx.MockTransport), so the fetch loop
+can be benchmarked without network or tokens.
+
+Serves a fixed list of ads with cursor paging (`after`), honours `limit`, answers error code 1
+("reduce the amount of data") when `limit` is above `max_limit`, and sends usage headers.
+`latency` (seconds) is slept before every response, like Graph API server time.
+"""
+
+import asyncio
+
+import httpx
+
+import fast_json
+
+
+class MockGraphAPI:
+    def __init__(self, ads: list, max_limit: int = 0, latency: float = 0.0):
+        self.ads = ads
+        self.max_limit = max_limit  # 0 = never ask to reduce the data
+        self.latency = latency
+        self.requests = 0
+        self.reduce_errors = 0
+        # Pre-encode each ad once: the benchmark should time the client, not this mock
+        self._encoded = [fast_json.dumps(ad) for ad in ads]
+
+    async def handler(self, request: httpx.Request) -> httpx.Response:
+        self.requests += 1
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        params = request.url.params
+        limit = int(params.get("limit", "25"))
+        if self.max_limit and limit > self.max_limit:
+            self.reduce_errors += 1
+            return httpx.Response(400, content=fast_json.dumps({"error": {
+                "message": "Please reduce the amount of data you're asking for, then retry your request",
+                "type": "OAuthException", "code": 1,
+            }}), headers={"content-type": "application/json"})
+
+        start = int(params.get("after", "0"))
+        end = min(start + limit, len(self._encoded))
+        paging = b""
+        if end < len(self._encoded):
+            next_url = str(request.url.copy_set_param("after", end).copy_remove_param("access_token"))
+            paging = b',"paging":{"cursors":{"after":"' + str(end).encode() + b'"},"next":' + fast_json.dumps(next_url) + b'}'
+        body = b'{"data":[' + b",".join(self._encoded[start:end]) + b']' + paging + b'}'
+        return httpx.Response(200, content=body, headers={
+            "content-type": "application/json",
+            "x-app-usage": '{"call_count":1,"total_cputime":1,"total_time":1}',
+        })
+
+    def client(self) -> httpx.AsyncClient:
+        return httpx.AsyncClient(transport=httpx.MockTransport(self.handler))
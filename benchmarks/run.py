@@ -0,0 +1,277 @@
+"""
+run.py
+Benchmark suite for the hot paths, fully offline (synthetic data from generators.py, Graph API
+served by mock_graph.py):
+
+    analysis.group_ads_by_body     ads -> body groups + country stats (Python loop / columnar engine)
+    analysis.build_activity_graph  ads -> weekly activity
+    pages.rows_to_dicts            query_pages rows -> /api/pages JSON (current mapping)
+    pages.rows_to_models           the previous TopCreative/PageData + response_model path
+    ad_groups.dumps / .loads       AdGroupsJson with fast_json and stdlib json
+    ad_groups.encode               dumps + gzip as stored in pageAdGroups
+    fetch.ads_archive              iter_page_ad_batches + aggregation against the mock, with and
+                                   without error code 1 ("reduce the amount of data") retries,
+                                   sequential and pipelined (META_FETCH_PIPELINE)
+
+Results are printed as a table and, with --out, written as JSON (one record per case plus
+environment info). --compare takes a previous JSON file and exits with status 1 when a case's
+median got slower than --tolerance.
+
+    python benchmarks/run.py [--ads 20000] [--rows 500] [--repeat 5] [--only fetch] [--latency-ms 0]
+                             [--out results.json] [--compare baseline.json --tolerance 0.15]
+"""
+
+import argparse
+import asyncio
+import contextlib
+import io
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import time
+from datetime import date, datetime, timezone
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import columnar  # noqa: E402
+import fast_json  # noqa: E402
+import meta_service  # noqa: E402
+from ad_groups_store import encode_analysis  # noqa: E402
+from main import page_rows_to_dicts  # noqa: E402
+from benchmarks.bench_page_rows import legacy_response  # noqa: E402
+from benchmarks.generators import make_ads, make_analysis, make_page_rows  # noqa: E402
+from benchmarks.mock_graph import MockGraphAPI  # noqa: E402
+
+SCHEMA_VERSION = 1
+
+
+def measure(fn, repeat: int, setup=None) -> dict:
+    """Runs fn `repeat` times (after one warm-up) and returns timings in ms."""
+    if setup:
+        setup()
+    fn()
+    samples = []
+    for _ in range(repeat):
+        if setup:
+            setup()
+        started = time.perf_counter()
+        fn()
+        samples.append((time.perf_counter() - started) * 1000)
+    return {
+        "repeat": repeat,
+        "min_ms": round(min(samples), 4),
+        "median_ms": round(statistics.median(samples), 4),
+        "mean_ms": round(statistics.fmean(samples), 4),
+        "max_ms": round(max(samples), 4),
+    }
+
+
+def stdlib_dumps(obj) -> bytes:
+    # What starlette's JSONResponse.render does
+    return json.dumps(obj, ensure_ascii=False, allow_nan=False, indent=None, separators=(",", ":")).encode("utf-8")
+
+
+def _clear_date_caches():
+    columnar.parse_meta_date.cache_clear()
+    columnar.iso_week_key.cache_clear()
+
+
+def analysis_cases(args) -> list:
+    ads = make_ads(args.ads)
+    engines = [("python", 0)]
+    if columnar.np is not None:
+        engines.append(("columnar", 1))
+    original_threshold = columnar.COLUMNAR_THRESHOLD
+    cases = []
+    try:
+        for engine, threshold in engines:
+            def group():
+                aggregator = meta_service.AdGroupAggregator(now_date=date(2026, 1, 1))
+                aggregator.add_ads(ads)
+                aggregator.result()
+
+            def activity():
+                meta_service.build_activity_graph(ads)
+
+            def setup(threshold=threshold):
+                # 0 = always the per-ad loop, 1 = always the NumPy engine
+                columnar.COLUMNAR_THRESHOLD = threshold if threshold else len(ads) + 1
+                _clear_date_caches()
+
+            params = {"ads": len(ads), "engine": engine}
+            cases.append(("analysis.group_ads_by_body", params, measure(group, args.repeat, setup),
+                          {"ads_per_s": None}))
+            cases.append(("analysis.build_activity_graph", params, measure(activity, args.repeat, setup),
+                          {"ads_per_s": None}))
+    finally:
+        columnar.COLUMNAR_THRESHOLD = original_threshold
+    return cases
+
+
+def pages_cases(args) -> list:
+    rows = make_page_rows(args.rows)
+    params = {"rows": len(rows)}
+    return [
+        ("pages.rows_to_dicts", params, measure(lambda: fast_json.dumps(page_rows_to_dicts(rows)), args.repeat), {}),
+        ("pages.rows_to_models", params, measure(lambda: legacy_response(rows), args.repeat), {}),
+    ]
+
+
+def ad_groups_cases(args) -> list:
+    analysis = make_analysis(args.ads)
+    encoded = fast_json.dumps(analysis)
+    params = {"ads": args.ads, "groups": len(analysis["groups"]), "bytes": len(encoded)}
+    return [
+        ("ad_groups.dumps", {**params, "backend": fast_json.BACKEND},
+         measure(lambda: fast_json.dumps(analysis), args.repeat), {}),
+        ("ad_groups.dumps", {**params, "backend": "stdlib"}, measure(lambda: stdlib_dumps(analysis), args.repeat), {}),
+        ("ad_groups.loads", {**params, "backend": fast_json.BACKEND},
+         measure(lambda: fast_json.loads(encoded), args.repeat), {}),
+        ("ad_groups.loads", {**params, "backend": "stdlib"}, measure(lambda: json.loads(encoded), args.repeat), {}),
+        ("ad_groups.encode", params, measure(lambda: encode_analysis(encoded), args.repeat), {}),
+    ]
+
+
+async def _consume(mock: MockGraphAPI, page_size) -> int:
+    # Aggregates each batch like analyze_and_save_page_groups, so pipelining has work to overlap
+    aggregator = meta_service.PageAnalysisAggregator()
+    async with mock.client() as client:
+        async for ads in meta_service.iter_page_ad_batches("123", access_token="bench", client=client,
+                                                           page_size=page_size):
+            aggregator.add_ads(ads)
+    return aggregator.ads_count
+
+
+def fetch_cases(args) -> list:
+    ads = make_ads(args.ads)
+    cases = []
+    original_pipeline = meta_service.META_FETCH_PIPELINE
+    try:
+        # max_limit 0: every request accepted; otherwise requests above it answer error code 1
+        for max_limit in (0, args.reduce_limit):
+            for pipeline in (False, True):
+                mock = MockGraphAPI(ads, max_limit=max_limit, latency=args.latency_ms / 1000)
+                fetched = []
+
+                def run():
+                    # Fresh controller each run: no remembered limit, so the retry path is exercised every time
+                    controller = meta_service.PageSizeController(memory=0)
+                    with contextlib.redirect_stdout(io.StringIO()):
+                        fetched.append(asyncio.run(_consume(mock, controller.session("123"))))
+
+                def reset(pipeline=pipeline, mock=mock):
+                    meta_service.META_FETCH_PIPELINE = pipeline
+                    mock.requests = mock.reduce_errors = 0
+
+                timing = measure(run, args.repeat, reset)
+                if fetched[-1] != len(ads):
+                    sys.exit(f"fetch loop returned {fetched[-1]} ads, expected {len(ads)}")
+                params = {"ads": len(ads), "max_limit": max_limit, "latency_ms": args.latency_ms, "pipeline": pipeline}
+                cases.append(("fetch.ads_archive", params, timing,
+                              {"requests": mock.requests, "reduce_errors": mock.reduce_errors, "ads_per_s": None}))
+    finally:
+        meta_service.META_FETCH_PIPELINE = original_pipeline
+    return cases
+
+
+SUITES = {
+    "analysis": analysis_cases,
+    "pages": pages_cases,
+    "ad_groups": ad_groups_cases,
+    "fetch": fetch_cases,
+}
+
+
+def git_revision() -> str:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, timeout=5,
+            cwd=os.path.dirname(os.path.abspath(__file__)),
+        ).stdout.strip()
+    except (OSError, subprocess.SubprocessError):
+        return ""
+
+
+def environment() -> dict:
+    return {
+        "schema": SCHEMA_VERSION,
+        "created_at": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+        "git": git_revision(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "json_backend": fast_json.BACKEND,
+        "numpy": getattr(columnar.np, "__version__", None),
+    }
+
+
+def case_key(result: dict) -> str:
+    return result["name"] + json.dumps(result["params"], sort_keys=True)
+
+
+def run_suites(args) -> list:
+    results = []
+    for suite, build in SUITES.items():
+        if args.only and suite not in args.only:
+            continue
+        for name, params, timing, extra in build(args):
+            if "ads_per_s" in extra:
+                extra["ads_per_s"] = round(params["ads"] / (timing["median_ms"] / 1000))
+            results.append({"name": name, "params": params, **timing, **extra})
+    return results
+
+
+def compare(results: list, baseline_path: str, tolerance: float) -> bool:
+    """Prints median changes against a previous run. Returns False if any case regressed."""
+    with open(baseline_path, "rb") as f:
+        baseline = {case_key(r): r for r in json.load(f)["results"]}
+    ok = True
+    print(f"\ncompared with {baseline_path} (tolerance {tolerance:.0%})")
+    for r in results:
+        before = baseline.get(case_key(r))
+        if not before:
+            print(f"  {case_key(r)}: new")
+            continue
+        change = r["median_ms"] / before["median_ms"] - 1
+        flag = "REGRESSION" if change > tolerance else ""
+        ok = ok and not flag
+        print(f"  {case_key(r):80} {before['median_ms']:10.2f} -> {r['median_ms']:10.2f} ms {change:+7.1%} {flag}")
+    return ok
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--ads", type=int, default=20_000, help="ads per synthetic page")
+    parser.add_argument("--rows", type=int, default=500, help="rows per /api/pages response")
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--reduce-limit", type=int, default=200,
+                        help="the mock answers error code 1 above this limit")
+    parser.add_argument("--latency-ms", type=float, default=0.0,
+                        help="simulated Graph API server time per request")
+    parser.add_argument("--only", nargs="*", choices=sorted(SUITES), help="run only these suites")
+    parser.add_argument("--out", help="write the results as JSON to this file")
+    parser.add_argument("--compare", help="previous JSON results to compare with")
+    parser.add_argument("--tolerance", type=float, default=0.15, help="allowed median slowdown for --compare")
+    args = parser.parse_args()
+
+    results = run_suites(args)
+    env = environment()
+    print(f"git {env['git'] or '?'}  python {env['python']}  json {env['json_backend']}  numpy {env['numpy']}")
+    print(f"{'case':34} {'params':52} {'median ms':>10} {'min ms':>10}")
+    for r in results:
+        params = " ".join(f"{k}={v}" for k, v in r["params"].items())
+        print(f"{r['name']:34} {params:52} {r['median_ms']:10.2f} {r['min_ms']:10.2f}")
+
+    if args.out:
+        with open(args.out, "wb") as f:
+            f.write(fast_json.dumps({**env, "args": vars(args), "results": results}))
+        print(f"\nresults written to {args.out}")
+
+    if args.compare and not compare(results, args.compare, args.tolerance):
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
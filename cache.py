@@ -0,0 +1,197 @@
+"""
+cache.py
+Small in-process caches shared by the API (per uvicorn worker).
+"""
+
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Callable, Hashable, Iterable, Optional
+
+_MISSING = object()
+
+
+class TTLCache:
+    """
+    Thread-safe LRU cache whose entries also expire after `ttl` seconds.
+    Holds at most `max_size` entries; the least recently used one is evicted first.
+    """
+
+    def __init__(self, max_size: int = 1024, ttl: float = 60.0):
+        self.max_size = max(1, max_size)
+        self.ttl = ttl
+        self._data: OrderedDict[Hashable, tuple[float, Any]] = OrderedDict()
+        self._lock = threading.Lock()
+        self._hits = 0
+        self._misses = 0
+
+    def _discard(self, key: Hashable):
+        # Caller must hold self._lock
+        self._data.pop(key, None)
+
+    def get(self, key: Hashable, default: Any = None) -> Any:
+        now = time.monotonic()
+        with self._lock:
+            item = self._data.get(key, _MISSING)
+            if item is _MISSING or item[0] <= now:
+                if item is not _MISSING:
+                    self._discard(key)
+                self._misses += 1
+                return default
+            self._data.move_to_end(key)
+            self._hits += 1
+            return item[1]
+
+    def set(self, key: Hashable, value: Any, ttl: Optional[float] = None):
+        expires_at = time.monotonic() + (self.ttl if ttl is None else ttl)
+        with self._lock:
+            self._data[key] = (expires_at, value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.max_size:
+                self._discard(next(iter(self._data)))
+
+    def invalidate(self, key: Hashable):
+        with self._lock:
+            self._discard(key)
+
+    def clear(self):
+        with self._lock:
+            for key in list(self._data):
+                self._discard(key)
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "size": len(self._data),
+                "max_size": self.max_size,
+                "ttl": self.ttl,
+                "hits": self._hits,
+                "misses": self._misses,
+            }
+
+
+class _Flight:
+    """A load in progress that concurrent callers of the same key wait on."""
+
+    __slots__ = ("event", "value", "error")
+
+    def __init__(self):
+        self.event = threading.Event()
+        self.value = None
+        self.error: Optional[BaseException] = None
+
+    def wait(self) -> Any:
+        self.event.wait()
+        if self.error is not None:
+            raise self.error
+        return self.value
+
+
+class QueryCache(TTLCache):
+    """
+    TTLCache for query results.
+
+    - Entries carry tags (e.g. ("page", "123"), ("tab", "saved")) so writes can evict only
+      the results they affect with `invalidate_tags`.
+    - `get_or_load` is single-flight: concurrent misses on the same key share one loader call.
+    - A load that overlaps an invalidation is returned to its callers but not stored.
+    """
+
+    def __init__(self, max_size: int = 256, ttl: float = 30.0):
+        super().__init__(max_size=max_size, ttl=ttl)
+        self._tag_index: dict[Hashable, set] = {}
+        self._entry_tags: dict[Hashable, tuple] = {}
+        self._inflight: dict[Hashable, _Flight] = {}
+        self._generation = 0
+        self._shared_loads = 0
+        self._invalidations = 0
+
+    def _discard(self, key: Hashable):
+        super()._discard(key)
+        for tag in self._entry_tags.pop(key, ()):
+            keys = self._tag_index.get(tag)
+            if keys is not None:
+                keys.discard(key)
+                if not keys:
+                    del self._tag_index[tag]
+
+    def set(self, key: Hashable, value: Any, ttl: Optional[float] = None, tags: Iterable[Hashable] = ()):
+        with self._lock:
+            self._set_locked(key, value, ttl, tags)
+
+    def _set_locked(self, key: Hashable, value: Any, ttl: Optional[float], tags: Iterable[Hashable]):
+        expires_at = time.monotonic() + (self.ttl if ttl is None else ttl)
+        entry_tags = tuple(set(tags))
+        self._discard(key)
+        self._data[key] = (expires_at, value)
+        self._entry_tags[key] = entry_tags
+        for tag in entry_tags:
+            self._tag_index.setdefault(tag, set()).add(key)
+        while len(self._data) > self.max_size:
+            self._discard(next(iter(self._data)))
+
+    def invalidate_tags(self, tags: Iterable[Hashable]) -> int:
+        """Evicts every entry carrying any of `tags`. Returns the number of evicted entries."""
+        with self._lock:
+            self._generation += 1
+            keys = set()
+            for tag in tags:
+                keys.update(self._tag_index.get(tag, ()))
+            for key in keys:
+                self._discard(key)
+            self._invalidations += len(keys)
+            return len(keys)
+
+    def clear(self):
+        with self._lock:
+            self._generation += 1
+        super().clear()
+
+    def get_or_load(
+        self,
+        key: Hashable,
+        loader: Callable[[], Any],
+        tags_for: Callable[[Any], Iterable[Hashable]] = lambda value: (),
+    ) -> Any:
+        value = self.get(key, _MISSING)
+        if value is not _MISSING:
+            return value
+
+        with self._lock:
+            flight = self._inflight.get(key)
+            leader = flight is None
+            if leader:
+                flight = _Flight()
+                self._inflight[key] = flight
+                generation = self._generation
+            else:
+                self._shared_loads += 1
+        if not leader:
+            return flight.wait()
+
+        try:
+            value = loader()
+        except BaseException as e:
+            flight.error = e
+            raise
+        else:
+            flight.value = value
+            tags = tags_for(value)
+            with self._lock:
+                if self._generation == generation:
+                    self._set_locked(key, value, None, tags)
+            return value
+        finally:
+            with self._lock:
+                self._inflight.pop(key, None)
+            flight.event.set()
+
+    def stats(self) -> dict:
+        stats = super().stats()
+        with self._lock:
+            stats.update({
+                "in_flight": len(self._inflight),
+                "shared_loads": self._shared_loads,
+                "invalidated": self._invalidations,
+            })
+        return stats
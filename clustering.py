@@ -0,0 +1,210 @@
+"""
+clustering.py
+Optional merging of near-duplicate ad groups (bodies that only differ by emojis, prices,
+punctuation or spacing).
+
+Works on the exact-body groups produced by AdGroupAggregator, so the cost depends on the number
+of distinct bodies, not ads:
+1. Normalise each body; identical normalised texts are merged directly.
+2. MinHash signature of the character shingles of each distinct normalised text.
+3. LSH banding: texts sharing any band bucket become candidates; each bucket is compared against
+   its first member only, so no bucket is compared pairwise.
+4. Candidates are kept if the exact Jaccard similarity of their shingle sets is >= threshold,
+   and merged with union-find.
+"""
+
+import os
+import re
+import unicodedata
+import zlib
+from typing import Optional
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+AD_GROUP_CLUSTERING = os.environ.get("AD_GROUP_CLUSTERING", "0") == "1"  # default for new analyses
+AD_GROUP_CLUSTER_THRESHOLD = float(os.environ.get("AD_GROUP_CLUSTER_THRESHOLD", "0.8"))  # Jaccard
+MINHASH_PERMUTATIONS = int(os.environ.get("AD_GROUP_MINHASH_PERMUTATIONS", "64"))
+SHINGLE_SIZE = 5
+
+_MASK64 = (1 << 64) - 1
+_MINHASH_CHUNK = 512  # texts hashed per NumPy pass (bounds the temporary matrix)
+
+_NUMBER_RE = re.compile(r"\d+(?:[.,]\d+)*")
+_DROP_RE = re.compile(r"[^\w\s]|_")  # emojis, symbols, punctuation
+_SPACE_RE = re.compile(r"\s+")
+
+
+def normalize_body(text: str) -> str:
+    """Lowercase, numbers -> '0', emojis/symbols/punctuation dropped, whitespace collapsed."""
+    text = unicodedata.normalize("NFKC", text).lower()
+    text = _NUMBER_RE.sub("0", text)
+    text = _DROP_RE.sub("", text)
+    return _SPACE_RE.sub(" ", text).strip()
+
+
+def shingles(text: str, k: int = SHINGLE_SIZE) -> frozenset:
+    """k-byte shingles of the UTF-8 text."""
+    data = text.encode("utf-8")
+    if len(data) <= k:
+        return frozenset([data])
+    return frozenset([data[i:i + k] for i in range(len(data) - k + 1)])
+
+
+def _permutations(count: int, seed: int = 1) -> tuple[list, list]:
+    # Deterministic (a, b) pairs for the multiply-shift hash h(x) = ((a * x + b) mod 2^64) >> 32
+    import random
+    rnd = random.Random(seed)
+    a = [rnd.randrange(1, 1 << 64) | 1 for _ in range(count)]
+    b = [rnd.randrange(0, 1 << 64) for _ in range(count)]
+    return a, b
+
+
+def _shingle_hashes(shingle_set: frozenset) -> list:
+    crc32 = zlib.crc32
+    return [crc32(s) for s in shingle_set]
+
+
+def minhash_signatures(shingle_sets: list, permutations: int = MINHASH_PERMUTATIONS) -> list:
+    """One signature (tuple of `permutations` ints) per shingle set."""
+    a, b = _permutations(permutations)
+    signatures = []
+    if np is not None:
+        # uint64 arithmetic wraps mod 2^64, same values as the pure-Python path below
+        a_arr = np.array(a, dtype=np.uint64)[:, None]
+        b_arr = np.array(b, dtype=np.uint64)[:, None]
+        shift = np.uint64(32)
+        # Hash a chunk of texts at once and take each text's minimum with reduceat
+        for chunk_start in range(0, len(shingle_sets), _MINHASH_CHUNK):
+            chunk = shingle_sets[chunk_start:chunk_start + _MINHASH_CHUNK]
+            hashes = []
+            offsets = []
+            for shingle_set in chunk:
+                offsets.append(len(hashes))
+                hashes.extend(_shingle_hashes(shingle_set))
+            values = (a_arr * np.array(hashes, dtype=np.uint64)[None, :] + b_arr) >> shift
+            minima = np.minimum.reduceat(values, np.array(offsets, dtype=np.intp), axis=1)
+            signatures.extend(map(tuple, minima.T.tolist()))
+        return signatures
+    for shingle_set in shingle_sets:
+        hashes = _shingle_hashes(shingle_set)
+        signatures.append(tuple(
+            min(((ai * h + bi) & _MASK64) >> 32 for h in hashes)
+            for ai, bi in zip(a, b)
+        ))
+    return signatures
+
+
+def lsh_bands(threshold: float, permutations: int = MINHASH_PERMUTATIONS) -> tuple[int, int]:
+    """(bands, rows) with bands * rows == permutations whose LSH threshold (1/b)^(1/r) is closest to `threshold`."""
+    best = (permutations, 1)
+    best_error = float("inf")
+    for rows in range(1, permutations + 1):
+        if permutations % rows:
+            continue
+        bands = permutations // rows
+        error = abs((1 / bands) ** (1 / rows) - threshold)
+        if error < best_error:
+            best, best_error = (bands, rows), error
+    return best
+
+
+class _UnionFind:
+    def __init__(self, size: int):
+        self.parent = list(range(size))
+
+    def find(self, x: int) -> int:
+        parent = self.parent
+        while parent[x] != x:
+            parent[x] = parent[parent[x]]
+            x = parent[x]
+        return x
+
+    def union(self, x: int, y: int):
+        rx, ry = self.find(x), self.find(y)
+        if rx != ry:
+            # Keep the smaller index (the higher-reach group) as root
+            if ry < rx:
+                rx, ry = ry, rx
+            self.parent[ry] = rx
+
+
+def jaccard(a: frozenset, b: frozenset) -> float:
+    if not a and not b:
+        return 1.0
+    return len(a & b) / len(a | b)
+
+
+def cluster_bodies(bodies: list, threshold: float = AD_GROUP_CLUSTER_THRESHOLD) -> list:
+    """Cluster index (the index of the cluster's first body) for each body."""
+    normalized = [normalize_body(b) for b in bodies]
+    uf = _UnionFind(len(bodies))
+
+    # Identical normalised texts: merge without hashing
+    first_by_text = {}
+    distinct = []
+    for i, text in enumerate(normalized):
+        first = first_by_text.get(text)
+        if first is None:
+            first_by_text[text] = i
+            distinct.append(i)
+        else:
+            uf.union(first, i)
+
+    if len(distinct) > 1 and threshold < 1.0:
+        shingle_sets = [shingles(normalized[i]) for i in distinct]
+        signatures = minhash_signatures(shingle_sets)
+        bands, rows = lsh_bands(threshold, len(signatures[0]))
+        checked = set()
+        for band in range(bands):
+            start = band * rows
+            buckets = {}
+            for pos, signature in enumerate(signatures):
+                key = signature[start:start + rows]
+                first_pos = buckets.get(key)
+                if first_pos is None:
+                    buckets[key] = pos
+                    continue
+                pair = (first_pos, pos)
+                if pair in checked:
+                    continue
+                checked.add(pair)
+                if uf.find(distinct[first_pos]) == uf.find(distinct[pos]):
+                    continue
+                if jaccard(shingle_sets[first_pos], shingle_sets[pos]) >= threshold:
+                    uf.union(distinct[first_pos], distinct[pos])
+
+    return [uf.find(i) for i in range(len(bodies))]
+
+
+def cluster_groups(groups: list, threshold: Optional[float] = None) -> list:
+    """
+    Merges near-duplicate groups of AdGroupAggregator.result() (sorted by reach desc).
+    A merged group keeps the body of its highest-reach member, sums reach, ORs is_active,
+    concatenates the links (re-sorted by reach) and lists the other bodies under "variants".
+    """
+    threshold = AD_GROUP_CLUSTER_THRESHOLD if threshold is None else threshold
+    if len(groups) < 2:
+        return groups
+    roots = cluster_bodies([g["body"] for g in groups], threshold)
+
+    merged = {}
+    for group, root in zip(groups, roots):
+        target = merged.get(root)
+        if target is None:
+            merged[root] = group
+            continue
+        if "variants" not in target:
+            target["variants"] = []
+        target["variants"].append(group["body"])
+        target["reach"] += group["reach"]
+        target["is_active"] = target["is_active"] or group["is_active"]
+        target["links"].extend(group["links"])
+
+    result = sorted(merged.values(), key=lambda g: g["reach"], reverse=True)
+    for group in result:
+        if "variants" in group:
+            group["links"].sort(key=lambda x: x["reach"], reverse=True)
+    return result
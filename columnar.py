@@ -0,0 +1,133 @@
+"""
+columnar.py
+Optional NumPy engine for the ad-group / activity aggregators in meta_service.
+
+Large batches (COLUMNAR_THRESHOLD ads or more, e.g. the stored links folded back in by an
+incremental analysis) are turned into column arrays: group reach, active flags, ISO-week counts
+and country counts are computed with bincount/add.at over integer codes, and dates are parsed
+once per distinct string. The result is identical to the per-ad Python loop, including dict
+insertion order (which decides ties when the results are sorted). Without NumPy every batch
+takes the Python path.
+"""
+
+import os
+from datetime import date, datetime
+from functools import lru_cache
+from typing import Callable, Optional
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+COLUMNAR_THRESHOLD = int(os.environ.get("COLUMNAR_THRESHOLD", "2000"))  # 0 disables the engine
+
+
+def enabled_for(count: int) -> bool:
+    return np is not None and COLUMNAR_THRESHOLD > 0 and count >= COLUMNAR_THRESHOLD
+
+
+@lru_cache(maxsize=65536)
+def parse_meta_date(value: str) -> Optional[date]:
+    """'YYYY-MM-DD' -> date, None if it doesn't parse (cached: Meta dates repeat a lot)."""
+    try:
+        return datetime.strptime(value, "%Y-%m-%d").date()
+    except ValueError:
+        return None
+
+
+@lru_cache(maxsize=65536)
+def iso_week_key(value: str) -> Optional[str]:
+    """'YYYY-MM-DD' -> 'YYYY-Www' (ISO week), None if the date doesn't parse."""
+    parsed = parse_meta_date(value)
+    if parsed is None:
+        return None
+    iso_year, iso_week, _ = parsed.isocalendar()
+    return f"{iso_year}-W{iso_week:02d}"
+
+
+def _codes(values: list) -> tuple[list, list]:
+    """Integer code per value, in order of first appearance. Returns (codes, distinct values)."""
+    index = {}
+    codes = [index.setdefault(v, len(index)) for v in values]
+    return codes, list(index)
+
+
+def fold_ad_groups(groups: dict, country_counts: dict, now_date: date, ads: list,
+                   ad_countries: Callable[[dict], set]) -> bool:
+    """
+    Folds `ads` into AdGroupAggregator state (groups, country_counts) like its Python loop.
+    Returns False without touching the state if the batch can't be handled here
+    (non-integer reach values), so the caller falls back to the loop.
+    """
+    reach_list = [ad.get("eu_total_reach", 0) for ad in ads]
+    if any(type(r) is not int for r in reach_list):
+        return False
+    reach = np.fromiter(reach_list, dtype=np.int64, count=len(reach_list))
+
+    keys = []
+    for ad in ads:
+        bodies = ad.get("ad_creative_bodies") or []
+        keys.append(bodies[0].strip() if bodies else "UNKNOWN")
+    group_codes, group_keys = _codes(keys)
+    group_codes = np.asarray(group_codes, dtype=np.intp)
+
+    # Active flag: parse each distinct stop time once, then index by code
+    stop_list = [ad.get("ad_delivery_stop_time") for ad in ads]
+    stop_codes, stop_values = _codes(stop_list)
+    stop_active = np.fromiter(
+        ((not s) or ((d := parse_meta_date(s)) is not None and d > now_date) for s in stop_values),
+        dtype=bool, count=len(stop_values),
+    )
+    active = stop_active[np.asarray(stop_codes, dtype=np.intp)]
+
+    group_reach = np.zeros(len(group_keys), dtype=np.int64)
+    np.add.at(group_reach, group_codes, reach)
+    group_active = np.bincount(group_codes, weights=active, minlength=len(group_keys)) > 0
+
+    # Countries: flatten every ad's set (iteration order kept) and count by code
+    ad_country_lists = []
+    flat = []
+    for ad in ads:
+        countries = list(ad_countries(ad))
+        ad_country_lists.append(countries)
+        flat.extend(countries)
+    if flat:
+        country_codes, country_names = _codes(flat)
+        counts = np.bincount(np.asarray(country_codes, dtype=np.intp), minlength=len(country_names))
+        for name, count in zip(country_names, counts.tolist()):
+            country_counts[name] += count
+
+    for i, key in enumerate(group_keys):
+        group = groups.get(key)
+        if group is None:
+            group = groups[key] = {"body": key, "reach": 0, "is_active": False, "links": []}
+        group["reach"] += int(group_reach[i])
+        if group_active[i]:
+            group["is_active"] = True
+
+    active_list = active.tolist()
+    for i, ad in enumerate(ads):
+        snapshot = ad.get("ad_snapshot_url")
+        if snapshot:
+            groups[keys[i]]["links"].append({
+                "url": snapshot,
+                "is_active": active_list[i],
+                "reach": reach_list[i],
+                "start_time": ad.get("ad_delivery_start_time"),
+                "stop_time": stop_list[i],
+                "countries": ad_country_lists[i]
+            })
+    return True
+
+
+def fold_activity(counts_per_week: dict, ads: list):
+    """Folds `ads` into ActivityAggregator state (ads per ISO week of ad_delivery_start_time)."""
+    start_codes, start_values = _codes([ad.get("ad_delivery_start_time") for ad in ads])
+    counts = np.bincount(np.asarray(start_codes, dtype=np.intp), minlength=len(start_values))
+    for value, count in zip(start_values, counts.tolist()):
+        if not value:
+            continue
+        week_key = iso_week_key(value)
+        if week_key is not None:
+            counts_per_week[week_key] += count
@@ -1,7 +1,15 @@
 import pyodbc
+import asyncio
+import functools
 import os
-from typing import Generator
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from typing import Any, Callable, Generator, Iterator
 from dotenv import load_dotenv
+from metrics import DB_CHECKOUT_WAIT, DB_CONNECT_DURATION, DB_POOL_TIMEOUTS, REGISTRY
 
 load_dotenv()
 
@@ -17,6 +25,16 @@ DRIVER = os.environ.get('DB_DRIVER', '{ODBC Driver 18 for SQL Server}')
 if os.name == 'nt':
     DRIVER = '{SQL Server}' # Fallback for local Windows, might need to be ODBC Driver 17
 
+# Pool sizing (per uvicorn worker process)
+POOL_MAX_SIZE = int(os.environ.get('DB_POOL_MAX_SIZE', '10'))
+POOL_MIN_IDLE = int(os.environ.get('DB_POOL_MIN_IDLE', '2'))
+POOL_MAX_LIFETIME = float(os.environ.get('DB_POOL_MAX_LIFETIME', '1800'))  # seconds before a connection is recycled
+POOL_PING_AFTER = float(os.environ.get('DB_POOL_PING_AFTER', '30'))  # idle seconds after which checkout runs SELECT 1
+POOL_TIMEOUT = float(os.environ.get('DB_POOL_TIMEOUT', '15'))  # max seconds to wait for a free connection
+
+# Threads reserved for blocking pyodbc work issued from async code (see run_db)
+DB_EXECUTOR_WORKERS = int(os.environ.get('DB_EXECUTOR_WORKERS', str(POOL_MAX_SIZE)))
+
 def get_db_connection() -> pyodbc.Connection:
     """Creates a connect to the Azure SQL Server using pyodbc for the MAIN database (dev-milco)."""
     conn_str = f"DRIVER={DRIVER};SERVER={SERVER};PORT=1433;DATABASE={DATABASE};UID={USERNAME};PWD={PASSWORD};Encrypt=yes;TrustServerCertificate=yes;"
@@ -28,24 +46,341 @@ def get_auth_db_connection() -> pyodbc.Connection:
     """Creates a connect to the Azure SQL Server using pyodbc for the AUTH database (backend)."""
     auth_db_name = os.environ.get('DB_AUTH_NAME', 'backend')
     auth_db_pwd = os.environ.get('DB_AUTH_PASSWORD')
-    
+
     conn_str = f"DRIVER={DRIVER};SERVER={SERVER};PORT=1433;DATABASE={auth_db_name};UID={USERNAME};PWD={auth_db_pwd};Encrypt=yes;TrustServerCertificate=yes;"
     if os.name == 'nt':
          conn_str = f"DRIVER={DRIVER};SERVER={SERVER};DATABASE={auth_db_name};UID={USERNAME};PWD={auth_db_pwd};Encrypt=yes;TrustServerCertificate=yes;"
     return pyodbc.connect(conn_str)
 
-def get_db() -> Generator[pyodbc.Connection, None, None]:
-    """Dependency injection for FastAPI routes (main db)."""
-    conn = get_db_connection()
+
+class PoolTimeoutError(Exception):
+    """Raised when no connection becomes available within the pool wait timeout."""
+
+
+class _PooledConnection:
+    __slots__ = ("conn", "created_at", "last_used")
+
+    def __init__(self, conn: pyodbc.Connection):
+        self.conn = conn
+        self.created_at = time.monotonic()
+        self.last_used = self.created_at
+
+
+class ConnectionPool:
+    """
+    Bounded pool of pyodbc connections.
+
+    - Never holds more than `max_size` connections (idle + in use).
+    - `warm()` keeps at least `min_idle` connections open so the first requests skip TLS/login.
+    - Connections idle for more than `ping_after` seconds are checked with SELECT 1 on checkout.
+    - Connections older than `max_lifetime` seconds are closed instead of being reused.
+    - `acquire()` waits at most `timeout` seconds for a free slot, then raises PoolTimeoutError.
+    """
+
+    def __init__(
+        self,
+        name: str,
+        factory: Callable[[], pyodbc.Connection],
+        max_size: int = POOL_MAX_SIZE,
+        min_idle: int = POOL_MIN_IDLE,
+        max_lifetime: float = POOL_MAX_LIFETIME,
+        ping_after: float = POOL_PING_AFTER,
+        timeout: float = POOL_TIMEOUT,
+    ):
+        self.name = name
+        self._factory = factory
+        self.max_size = max(1, max_size)
+        self.min_idle = max(0, min(min_idle, self.max_size))
+        self.max_lifetime = max_lifetime
+        self.ping_after = ping_after
+        self.timeout = timeout
+
+        self._cond = threading.Condition()
+        self._idle: deque[_PooledConnection] = deque()
+        self._in_use: dict[int, _PooledConnection] = {}
+        self._size = 0  # idle + in use + connections being opened
+        self._closed = False
+
+        # Stats
+        self._checkouts = 0
+        self._created = 0
+        self._discarded = 0
+        self._timeouts = 0
+        self._wait_total = 0.0
+        self._wait_max = 0.0
+        self._connect_total = 0.0
+
+    # --- internal helpers ---
+
+    def _open(self) -> _PooledConnection:
+        started = time.monotonic()
+        conn = self._factory()
+        elapsed = time.monotonic() - started
+        DB_CONNECT_DURATION.observe(elapsed, self.name)
+        with self._cond:
+            self._created += 1
+            self._connect_total += elapsed
+        return _PooledConnection(conn)
+
+    def _expired(self, pc: _PooledConnection, now: float) -> bool:
+        return self.max_lifetime > 0 and now - pc.created_at >= self.max_lifetime
+
+    def _is_alive(self, pc: _PooledConnection) -> bool:
+        try:
+            cursor = pc.conn.cursor()
+            cursor.execute("SELECT 1")
+            cursor.fetchone()
+            cursor.close()
+            return True
+        except Exception:
+            return False
+
+    def _close_quietly(self, pc: _PooledConnection):
+        try:
+            pc.conn.close()
+        except Exception:
+            pass
+
+    def _drop_slot(self):
+        # Caller must hold self._cond
+        self._size -= 1
+        self._discarded += 1
+        self._cond.notify()
+
+    # --- public API ---
+
+    def acquire(self) -> pyodbc.Connection:
+        started = time.monotonic()
+        deadline = started + self.timeout
+        while True:
+            pc = None
+            reserve = False
+            with self._cond:
+                while True:
+                    if self._closed:
+                        raise PoolTimeoutError(f"Connection pool '{self.name}' is closed")
+                    if self._idle:
+                        pc = self._idle.pop()  # LIFO keeps the warmest connections busy
+                        break
+                    if self._size < self.max_size:
+                        self._size += 1
+                        reserve = True
+                        break
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        self._timeouts += 1
+                        DB_POOL_TIMEOUTS.inc(self.name)
+                        raise PoolTimeoutError(
+                            f"Timed out after {self.timeout:.1f}s waiting for a '{self.name}' connection "
+                            f"(max_size={self.max_size})"
+                        )
+                    self._cond.wait(remaining)
+
+            if reserve:
+                try:
+                    pc = self._open()
+                except Exception:
+                    with self._cond:
+                        self._size -= 1
+                        self._cond.notify()
+                    raise
+            else:
+                now = time.monotonic()
+                if self._expired(pc, now) or (now - pc.last_used >= self.ping_after and not self._is_alive(pc)):
+                    self._close_quietly(pc)
+                    with self._cond:
+                        self._drop_slot()
+                    continue
+
+            waited = time.monotonic() - started
+            DB_CHECKOUT_WAIT.observe(waited, self.name)
+            with self._cond:
+                self._in_use[id(pc.conn)] = pc
+                self._checkouts += 1
+                self._wait_total += waited
+                self._wait_max = max(self._wait_max, waited)
+            return pc.conn
+
+    def release(self, conn: pyodbc.Connection, discard: bool = False):
+        with self._cond:
+            pc = self._in_use.pop(id(conn), None)
+        if pc is None:
+            # Not ours (or already released): just close it
+            try:
+                conn.close()
+            except Exception:
+                pass
+            return
+
+        if not discard:
+            try:
+                # Leave no open transaction behind for the next borrower
+                conn.rollback()
+            except Exception:
+                discard = True
+
+        now = time.monotonic()
+        if discard or self._closed or self._expired(pc, now):
+            self._close_quietly(pc)
+            with self._cond:
+                self._drop_slot()
+            return
+
+        pc.last_used = now
+        with self._cond:
+            self._idle.append(pc)
+            self._cond.notify()
+
+    def warm(self):
+        """Opens connections until at least `min_idle` are idle (bounded by max_size)."""
+        while True:
+            with self._cond:
+                if self._closed or len(self._idle) >= self.min_idle or self._size >= self.max_size:
+                    return
+                self._size += 1
+            try:
+                pc = self._open()
+            except Exception:
+                with self._cond:
+                    self._size -= 1
+                    self._cond.notify()
+                raise
+            with self._cond:
+                self._idle.append(pc)
+                self._cond.notify()
+
+    def close(self):
+        with self._cond:
+            self._closed = True
+            idle = list(self._idle)
+            self._idle.clear()
+            self._size -= len(idle)
+            self._cond.notify_all()
+        for pc in idle:
+            self._close_quietly(pc)
+
+    def stats(self) -> dict:
+        with self._cond:
+            checkouts = self._checkouts
+            return {
+                "name": self.name,
+                "max_size": self.max_size,
+                "min_idle": self.min_idle,
+                "size": self._size,
+                "in_use": len(self._in_use),
+                "idle": len(self._idle),
+                "checkouts": checkouts,
+                "created": self._created,
+                "discarded": self._discarded,
+                "timeouts": self._timeouts,
+                "avg_wait_ms": round(self._wait_total / checkouts * 1000, 3) if checkouts else 0.0,
+                "max_wait_ms": round(self._wait_max * 1000, 3),
+                "avg_connect_ms": round(self._connect_total / self._created * 1000, 3) if self._created else 0.0,
+            }
+
+
+main_pool = ConnectionPool("main", get_db_connection)
+auth_pool = ConnectionPool("auth", get_auth_db_connection)
+
+
+@contextmanager
+def pooled_connection(pool: ConnectionPool) -> Iterator[pyodbc.Connection]:
+    """Borrows a connection from `pool`; broken connections are discarded instead of returned."""
+    conn = pool.acquire()
+    discard = False
     try:
         yield conn
+    except pyodbc.Error:
+        # The connection may be dead; never hand it to another request
+        discard = True
+        raise
     finally:
-        conn.close()
+        pool.release(conn, discard=discard)
+
+
+def warm_pools():
+    for pool in (main_pool, auth_pool):
+        try:
+            pool.warm()
+        except Exception as e:
+            print(f"Could not warm '{pool.name}' connection pool: {e}")
+
+
+def close_pools():
+    for pool in (main_pool, auth_pool):
+        pool.close()
+
+
+def get_pool_stats() -> dict:
+    return {pool.name: pool.stats() for pool in (main_pool, auth_pool)}
+
+
+def _pool_connection_samples():
+    for pool in (main_pool, auth_pool):
+        stats = pool.stats()
+        yield (pool.name, "in_use"), stats["in_use"]
+        yield (pool.name, "idle"), stats["idle"]
+
+
+REGISTRY.gauge("db_pool_connections", "Pooled connections by state.", ("pool", "state"), _pool_connection_samples)
+
+
+# --- Async access ---
+# pyodbc calls block, so coroutines must never call them directly: they go through run_db,
+# which runs them on a dedicated bounded executor and keeps the event loop free.
+
+_db_executor = ThreadPoolExecutor(max_workers=max(1, DB_EXECUTOR_WORKERS), thread_name_prefix="db")
+_executor_lock = threading.Lock()
+_executor_stats = {"calls": 0, "pending": 0, "wait_total": 0.0, "wait_max": 0.0, "run_total": 0.0}
+
+
+def _run_timed(submitted_at: float, fn: Callable[[], Any]) -> Any:
+    started = time.monotonic()
+    waited = started - submitted_at
+    with _executor_lock:
+        _executor_stats["pending"] -= 1
+        _executor_stats["wait_total"] += waited
+        _executor_stats["wait_max"] = max(_executor_stats["wait_max"], waited)
+    try:
+        return fn()
+    finally:
+        with _executor_lock:
+            _executor_stats["run_total"] += time.monotonic() - started
+
+
+async def run_db(fn: Callable[..., Any], *args, **kwargs) -> Any:
+    """Runs blocking DB code `fn(*args, **kwargs)` on the DB executor and awaits its result."""
+    loop = asyncio.get_running_loop()
+    with _executor_lock:
+        _executor_stats["calls"] += 1
+        _executor_stats["pending"] += 1
+    call = functools.partial(fn, *args, **kwargs)
+    return await loop.run_in_executor(_db_executor, _run_timed, time.monotonic(), call)
+
+
+def get_db_executor_stats() -> dict:
+    with _executor_lock:
+        calls = _executor_stats["calls"]
+        return {
+            "workers": _db_executor._max_workers,
+            "calls": calls,
+            "pending": _executor_stats["pending"],
+            "avg_queue_wait_ms": round(_executor_stats["wait_total"] / calls * 1000, 3) if calls else 0.0,
+            "max_queue_wait_ms": round(_executor_stats["wait_max"] * 1000, 3),
+            "avg_run_ms": round(_executor_stats["run_total"] / calls * 1000, 3) if calls else 0.0,
+        }
+
+
+def shutdown_db_executor():
+    _db_executor.shutdown(wait=True)
+
+
+def get_db() -> Generator[pyodbc.Connection, None, None]:
+    """Dependency injection for FastAPI routes (main db)."""
+    with pooled_connection(main_pool) as conn:
+        yield conn
 
 def get_auth_db() -> Generator[pyodbc.Connection, None, None]:
     """Dependency injection for FastAPI routes (auth db)."""
-    conn = get_auth_db_connection()
-    try:
+    with pooled_connection(auth_pool) as conn:
         yield conn
-    finally:
-        conn.close()
@@ -0,0 +1,59 @@
+"""
+fast_json.py
+JSON backend shared by the API responses and meta_service.
+
+Uses orjson when it is installed and falls back to the stdlib `json` module otherwise
+(JSON_BACKEND=json forces the fallback). Both produce compact UTF-8 output, so the bytes only
+differ in float formatting corner cases.
+"""
+
+import json
+import os
+from typing import Any, Union
+
+from fastapi.responses import JSONResponse
+
+JSON_BACKEND = os.environ.get("JSON_BACKEND", "auto").lower()  # auto | orjson | json
+
+try:
+    if JSON_BACKEND == "json":
+        raise ImportError("stdlib json forced by JSON_BACKEND")
+    import orjson
+except ImportError:
+    if JSON_BACKEND == "orjson":
+        raise
+    orjson = None
+
+BACKEND = "orjson" if orjson is not None else "json"
+
+
+if orjson is not None:
+    _ORJSON_OPTIONS = orjson.OPT_NON_STR_KEYS | orjson.OPT_SERIALIZE_NUMPY
+
+    def dumps(obj: Any) -> bytes:
+        return orjson.dumps(obj, option=_ORJSON_OPTIONS)
+
+    def loads(data: Union[bytes, bytearray, memoryview, str]) -> Any:
+        return orjson.loads(data)
+
+else:
+    _encoder = json.JSONEncoder(ensure_ascii=False, separators=(",", ":"), allow_nan=False)
+
+    def dumps(obj: Any) -> bytes:
+        return _encoder.encode(obj).encode("utf-8")
+
+    def loads(data: Union[bytes, bytearray, memoryview, str]) -> Any:
+        if isinstance(data, memoryview):
+            data = data.tobytes()
+        return json.loads(data)
+
+
+def dumps_str(obj: Any) -> str:
+    return dumps(obj).decode("utf-8")
+
+
+class FastJSONResponse(JSONResponse):
+    """JSONResponse rendered with the fast backend; used as the app's default_response_class."""
+
+    def render(self, content: Any) -> bytes:
+        return dumps(content)
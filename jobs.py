@@ -0,0 +1,360 @@
+"""
+jobs.py
+In-process scheduler for ad-group analyses: bounded queue, fixed number of workers and
+at most one queued/running job per page_id. It is the source of truth for "is this page
+being analysed?" (per uvicorn worker). Batches feed many pages through the same queue.
+"""
+
+import asyncio
+import os
+import time
+import uuid
+from collections import OrderedDict
+from dataclasses import dataclass, field
+from typing import Any, Awaitable, Callable, Optional
+
+from metrics import ANALYSIS_JOB_DURATION
+
+ANALYSIS_WORKERS = int(os.environ.get("ANALYSIS_WORKERS", "2"))
+ANALYSIS_QUEUE_SIZE = int(os.environ.get("ANALYSIS_QUEUE_SIZE", "100"))
+ANALYSIS_JOB_TIMEOUT = float(os.environ.get("ANALYSIS_JOB_TIMEOUT", "3600"))  # seconds, 0 = no limit
+ANALYSIS_JOB_HISTORY = int(os.environ.get("ANALYSIS_JOB_HISTORY", "500"))  # finished jobs kept for status queries
+ANALYSIS_BATCH_CONCURRENCY = int(os.environ.get("ANALYSIS_BATCH_CONCURRENCY", "0"))  # jobs in flight per batch, 0 = workers
+ANALYSIS_BATCH_HISTORY = int(os.environ.get("ANALYSIS_BATCH_HISTORY", "50"))  # batches kept for progress queries
+
+QUEUED = "queued"
+RUNNING = "running"
+DONE = "done"
+FAILED = "failed"
+PENDING = "pending"  # batch page not submitted yet
+SKIPPED = "skipped"  # batch page that was already being analysed
+
+
+class QueueFullError(Exception):
+    """Raised by submit() when the analysis queue is at capacity."""
+
+
+@dataclass
+class AnalysisJob:
+    page_id: str
+    options: dict = field(default_factory=dict)
+    state: str = QUEUED
+    submitted_at: float = field(default_factory=time.time)
+    started_at: Optional[float] = None
+    finished_at: Optional[float] = None
+    error: Optional[str] = None
+    result: Any = None
+    _done: asyncio.Event = field(default_factory=asyncio.Event, repr=False, compare=False)
+
+    @property
+    def active(self) -> bool:
+        return self.state in (QUEUED, RUNNING)
+
+    async def wait(self):
+        """Waits until the job is done or failed."""
+        await self._done.wait()
+
+    def to_dict(self) -> dict:
+        queued_for = (self.started_at or self.finished_at or time.time()) - self.submitted_at
+        run_for = None
+        if self.started_at is not None:
+            run_for = (self.finished_at or time.time()) - self.started_at
+        return {
+            "page_id": self.page_id,
+            "state": self.state,
+            "options": self.options,
+            "submitted_at": self.submitted_at,
+            "started_at": self.started_at,
+            "finished_at": self.finished_at,
+            "queue_seconds": round(queued_for, 3),
+            "run_seconds": round(run_for, 3) if run_for is not None else None,
+            "error": self.error,
+            "result": self.result,
+        }
+
+
+@dataclass
+class AnalysisBatch:
+    page_ids: list
+    options: dict = field(default_factory=dict)
+    concurrency: int = 1
+    id: str = field(default_factory=lambda: uuid.uuid4().hex)
+    created_at: float = field(default_factory=time.time)
+    finished_at: Optional[float] = None
+    jobs: dict = field(default_factory=dict)  # page_id -> AnalysisJob submitted by this batch
+    skipped: set = field(default_factory=set)
+    error: Optional[str] = None
+
+    @property
+    def active(self) -> bool:
+        return self.finished_at is None
+
+    def page_state(self, page_id: str) -> str:
+        if page_id in self.skipped:
+            return SKIPPED
+        job = self.jobs.get(page_id)
+        return job.state if job is not None else PENDING
+
+    def to_dict(self, pages: bool = True) -> dict:
+        counts = {state: 0 for state in (PENDING, QUEUED, RUNNING, DONE, FAILED, SKIPPED)}
+        for page_id in self.page_ids:
+            counts[self.page_state(page_id)] += 1
+        ads_fetched = sum(
+            job.result.get("fetched", 0) for job in self.jobs.values()
+            if job.state == DONE and isinstance(job.result, dict)
+        )
+        elapsed = (self.finished_at or time.time()) - self.created_at
+        finished_pages = counts[DONE] + counts[FAILED]
+        out = {
+            "batch_id": self.id,
+            "state": "running" if self.active else "finished",
+            "options": self.options,
+            "concurrency": self.concurrency,
+            "total": len(self.page_ids),
+            "counts": counts,
+            "progress": round((finished_pages + counts[SKIPPED]) / len(self.page_ids), 4) if self.page_ids else 1.0,
+            "created_at": self.created_at,
+            "finished_at": self.finished_at,
+            "elapsed_seconds": round(elapsed, 3),
+            "pages_per_minute": round(finished_pages / elapsed * 60, 3) if elapsed > 0 else 0.0,
+            "ads_fetched": ads_fetched,
+            "ads_per_second": round(ads_fetched / elapsed, 1) if elapsed > 0 else 0.0,
+            "error": self.error,
+        }
+        if pages:
+            out["pages"] = []
+            for page_id in self.page_ids:
+                job = self.jobs.get(page_id)
+                entry = {"page_id": page_id, "state": self.page_state(page_id)}
+                if job is not None:
+                    entry.update(
+                        run_seconds=job.to_dict()["run_seconds"],
+                        error=job.error,
+                        result=job.result,
+                    )
+                out["pages"].append(entry)
+        return out
+
+
+class AnalysisScheduler:
+    """
+    Runs `runner(page_id, **options)` coroutines on `workers` worker tasks.
+
+    - submit() is single-flight per page_id: while a job is queued or running, the same job
+      is returned instead of enqueuing another one.
+    - The queue holds at most `max_queue` jobs; submit() raises QueueFullError beyond that and
+      submit_wait() waits for room (backpressure for batch producers).
+    - Finished jobs are kept (most recent `history` ones) so their state and timings can be queried.
+    - submit_batch() feeds a list of pages through the same queue and workers, keeping at most
+      `concurrency` of the batch's jobs queued/running so single-page requests are not starved.
+    """
+
+    def __init__(
+        self,
+        runner: Callable[..., Awaitable[Any]],
+        workers: int = ANALYSIS_WORKERS,
+        max_queue: int = ANALYSIS_QUEUE_SIZE,
+        job_timeout: float = ANALYSIS_JOB_TIMEOUT,
+        history: int = ANALYSIS_JOB_HISTORY,
+        batch_history: int = ANALYSIS_BATCH_HISTORY,
+    ):
+        self._runner = runner
+        self.workers = max(1, workers)
+        self.max_queue = max(1, max_queue)
+        self.job_timeout = job_timeout
+        self.history = max(0, history)
+
+        self._queue: Optional[asyncio.Queue] = None
+        self._tasks: list[asyncio.Task] = []
+        self._active: dict[str, AnalysisJob] = {}
+        self._finished: OrderedDict[str, AnalysisJob] = OrderedDict()
+        self._completed = 0
+        self._failed = 0
+        self.batch_history = max(1, batch_history)
+        self._batches: OrderedDict[str, AnalysisBatch] = OrderedDict()
+        self._feeders: set[asyncio.Task] = set()
+
+    # --- lifecycle ---
+
+    async def start(self):
+        if self._tasks:
+            return
+        self._queue = asyncio.Queue(maxsize=self.max_queue)
+        self._tasks = [asyncio.create_task(self._worker(i)) for i in range(self.workers)]
+
+    async def stop(self):
+        for task in list(self._feeders) + self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._feeders, *self._tasks, return_exceptions=True)
+        self._feeders.clear()
+        self._tasks = []
+
+    # --- submission ---
+
+    def _existing(self, page_id: str) -> Optional[AnalysisJob]:
+        return self._active.get(page_id)
+
+    def submit(self, page_id: str, **options) -> tuple[AnalysisJob, bool]:
+        """Enqueues an analysis. Returns (job, created); created=False if one was already active."""
+        existing = self._existing(page_id)
+        if existing is not None:
+            return existing, False
+        if self._queue is None:
+            raise RuntimeError("Analysis scheduler is not started")
+        job = AnalysisJob(page_id=page_id, options=options)
+        try:
+            self._queue.put_nowait(job)
+        except asyncio.QueueFull:
+            raise QueueFullError(f"Analysis queue is full ({self.max_queue} jobs)")
+        self._active[page_id] = job
+        return job, True
+
+    async def submit_wait(self, page_id: str, **options) -> tuple[AnalysisJob, bool]:
+        """Like submit(), but waits for room in the queue instead of raising QueueFullError."""
+        existing = self._existing(page_id)
+        if existing is not None:
+            return existing, False
+        if self._queue is None:
+            raise RuntimeError("Analysis scheduler is not started")
+        job = AnalysisJob(page_id=page_id, options=options)
+        # Registered before waiting so concurrent submits for the same page reuse this job
+        self._active[page_id] = job
+        try:
+            await self._queue.put(job)
+        except BaseException:
+            self._active.pop(page_id, None)
+            raise
+        return job, True
+
+    def submit_batch(self, page_ids: list, concurrency: int = 0, **options) -> AnalysisBatch:
+        """
+        Starts feeding `page_ids` (duplicates dropped, order kept) to the queue in the background.
+        Pages with a queued/running job when their turn comes are skipped, not re-analysed.
+        """
+        if self._queue is None:
+            raise RuntimeError("Analysis scheduler is not started")
+        concurrency = concurrency or ANALYSIS_BATCH_CONCURRENCY or self.workers
+        batch = AnalysisBatch(
+            page_ids=list(dict.fromkeys(page_ids)),
+            options=options,
+            concurrency=max(1, min(concurrency, self.max_queue)),
+        )
+        # Pages being analysed right now are skipped, even if their job ends before their turn
+        batch.skipped.update(page_id for page_id in batch.page_ids if self.is_active(page_id))
+        self._batches[batch.id] = batch
+        while len(self._batches) > self.batch_history:
+            oldest = next(iter(self._batches.values()))
+            if oldest.active:
+                break
+            self._batches.popitem(last=False)
+        task = asyncio.create_task(self._feed(batch))
+        self._feeders.add(task)
+        task.add_done_callback(self._feeders.discard)
+        return batch
+
+    async def _feed(self, batch: AnalysisBatch):
+        in_flight: set[asyncio.Task] = set()
+        try:
+            for page_id in batch.page_ids:
+                if page_id in batch.skipped:
+                    continue
+                while len(in_flight) >= batch.concurrency:
+                    _, in_flight = await asyncio.wait(in_flight, return_when=asyncio.FIRST_COMPLETED)
+                if self.is_active(page_id):
+                    batch.skipped.add(page_id)
+                    continue
+                job, created = await self.submit_wait(page_id, **batch.options)
+                if not created:
+                    batch.skipped.add(page_id)
+                    continue
+                batch.jobs[page_id] = job
+                in_flight.add(asyncio.create_task(job.wait()))
+            if in_flight:
+                await asyncio.wait(in_flight)
+        except asyncio.CancelledError:
+            batch.error = "cancelled"
+            raise
+        except Exception as e:
+            batch.error = str(e) or e.__class__.__name__
+            print(f"[jobs] Analysis batch {batch.id} stopped: {batch.error}")
+        finally:
+            for task in in_flight:
+                task.cancel()
+            batch.finished_at = time.time()
+
+    # --- queries ---
+
+    def get(self, page_id: str) -> Optional[AnalysisJob]:
+        return self._active.get(page_id) or self._finished.get(page_id)
+
+    def is_active(self, page_id: str) -> bool:
+        return page_id in self._active
+
+    def list_jobs(self) -> list[AnalysisJob]:
+        return list(self._active.values()) + list(reversed(self._finished.values()))
+
+    def get_batch(self, batch_id: str) -> Optional[AnalysisBatch]:
+        return self._batches.get(batch_id)
+
+    def list_batches(self) -> list[AnalysisBatch]:
+        return list(reversed(self._batches.values()))
+
+    def stats(self) -> dict:
+        states = {QUEUED: 0, RUNNING: 0}
+        for job in self._active.values():
+            states[job.state] += 1
+        return {
+            "workers": self.workers,
+            "max_queue": self.max_queue,
+            "queued": states[QUEUED],
+            "running": states[RUNNING],
+            "completed": self._completed,
+            "failed": self._failed,
+            "active_batches": sum(1 for batch in self._batches.values() if batch.active),
+        }
+
+    # --- workers ---
+
+    async def _worker(self, index: int):
+        while True:
+            job = await self._queue.get()
+            try:
+                await self._run(job)
+            finally:
+                self._queue.task_done()
+
+    async def _run(self, job: AnalysisJob):
+        job.state = RUNNING
+        job.started_at = time.time()
+        try:
+            coro = self._runner(job.page_id, **job.options)
+            if self.job_timeout > 0:
+                job.result = await asyncio.wait_for(coro, timeout=self.job_timeout)
+            else:
+                job.result = await coro
+            job.state = DONE
+            self._completed += 1
+        except asyncio.CancelledError:
+            job.state = FAILED
+            job.error = "cancelled"
+            self._failed += 1
+            raise
+        except asyncio.TimeoutError:
+            job.state = FAILED
+            job.error = f"timed out after {self.job_timeout:.0f}s"
+            self._failed += 1
+        except Exception as e:
+            job.state = FAILED
+            job.error = str(e) or e.__class__.__name__
+            self._failed += 1
+            print(f"[jobs] Analysis for page {job.page_id} failed: {job.error}")
+        finally:
+            job.finished_at = time.time()
+            ANALYSIS_JOB_DURATION.observe(job.finished_at - job.started_at, job.state)
+            job._done.set()
+            self._active.pop(job.page_id, None)
+            if self.history:
+                self._finished.pop(job.page_id, None)
+                self._finished[job.page_id] = job
+                while len(self._finished) > self.history:
+                    self._finished.popitem(last=False)
@@ -1,10 +1,17 @@
-from fastapi import FastAPI, Depends, Query, HTTPException, BackgroundTasks, status
+from fastapi import FastAPI, Depends, Query, HTTPException, Request, Response, status
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.security import OAuth2PasswordRequestForm
 from pydantic import BaseModel
 from typing import List, Optional, Any
 import pyodbc
-from database import get_db, get_auth_db
+from database import get_db, get_auth_db, get_pool_stats, get_db_executor_stats, main_pool, pooled_connection, run_db
+from cache import QueryCache
+from jobs import AnalysisScheduler, QueueFullError
+from ad_groups_store import GZIP, clear_analysis, decode_body, response_body
+from fast_json import FastJSONResponse, dumps_str as json_dumps_str
+from metrics import CONTENT_TYPE as METRICS_CONTENT_TYPE, METRICS_ENABLED, REGISTRY, MetricsMiddleware, render as render_metrics, sql_timer
+from meta_service import analyze_and_save_page_groups
+from search_index import page_search_index
 from auth import (
     Token,
     verify_password,
@@ -16,9 +23,14 @@ from auth import (
     UserInDB
 )
 from datetime import timedelta, datetime
+import base64
+import json
+import os
+import re
 import zoneinfo
 
-app = FastAPI(title="NicheBreaker API Bridge")
+# orjson-backed responses (stdlib json if orjson is missing), see fast_json.py
+app = FastAPI(title="NicheBreaker API Bridge", default_response_class=FastJSONResponse)
 
 # Allow frontend to access this API
 app.add_middleware(
@@ -27,23 +39,86 @@ app.add_middleware(
     allow_credentials=False, # Must be False if origins is ["*"]
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["X-Next-Cursor", "ETag", "Content-Encoding", "X-Analysis-Job-State", "X-Analysis-Job-Error"],
 )
 
+# Request latency per route template, exposed at /metrics (see metrics.py)
+app.add_middleware(MetricsMiddleware)
+
 @app.on_event("startup")
 def startup_event():
     # Attempt to create the 'users' table in the auth DB if it doesn't exist
     print("Running startup checks...")
     try:
-        # We manually create a connection here because Depends() doesn't work in startup event
-        from database import get_auth_db_connection
-        conn = get_auth_db_connection()
-        create_users_table_if_not_exists(conn)
-        create_initial_admin(conn)
-        conn.close()
+        # We manually borrow a connection here because Depends() doesn't work in startup event
+        from database import pooled_connection, auth_pool
+        with pooled_connection(auth_pool) as conn:
+            create_users_table_if_not_exists(conn)
+            create_initial_admin(conn)
         print("Startup checks for users table finished successfully.")
     except Exception as e:
         print(f"Error initializing users table: {e}")
 
+    # Make sure the pageListing read model (table, index, triggers) exists in the main DB
+    try:
+        from database import pooled_connection, main_pool
+        from read_model import create_page_listing_if_not_exists
+        with pooled_connection(main_pool) as conn:
+            create_page_listing_if_not_exists(conn)
+        print("Startup checks for pageListing read model finished successfully.")
+    except Exception as e:
+        print(f"Error initializing pageListing read model: {e}")
+
+    # Side table with the gzip-compressed ad-group analyses
+    try:
+        from database import pooled_connection, main_pool
+        from ad_groups_store import create_page_ad_groups_if_not_exists
+        with pooled_connection(main_pool) as conn:
+            create_page_ad_groups_if_not_exists(conn)
+        print("Startup checks for pageAdGroups table finished successfully.")
+    except Exception as e:
+        print(f"Error initializing pageAdGroups table: {e}")
+
+    # Open the minimum idle connections up front so the first requests skip TLS/login
+    from database import warm_pools
+    warm_pools()
+
+    # One keep-alive HTTP/2 client per worker for every Graph API call
+    from meta_service import start_meta_http_client
+    start_meta_http_client()
+
+# Ad-group analyses run here instead of in BackgroundTasks: bounded workers/queue, one job per page
+analysis_scheduler = AnalysisScheduler(runner=analyze_and_save_page_groups)
+
+def _analysis_job_samples():
+    stats = analysis_scheduler.stats()
+    return [(("queued",), stats["queued"]), (("running",), stats["running"])]
+
+REGISTRY.gauge("analysis_jobs", "Ad-group analysis jobs queued or running.", ("state",), _analysis_job_samples)
+
+@app.on_event("startup")
+async def start_analysis_scheduler():
+    # READY access tokens are loaded once here and then refreshed in the background
+    from meta_service import meta_token_pool
+    await meta_token_pool.start()
+    await analysis_scheduler.start()
+    # Page name trigram index: loaded in the background, searches use plain LIKE until it is ready
+    await page_search_index.start()
+
+@app.on_event("shutdown")
+async def close_meta_http_client_event():
+    await page_search_index.stop()
+    await analysis_scheduler.stop()
+    from meta_service import close_meta_http_client, meta_token_pool
+    await meta_token_pool.stop()
+    await close_meta_http_client()
+
+@app.on_event("shutdown")
+def shutdown_event():
+    from database import close_pools, shutdown_db_executor
+    shutdown_db_executor()
+    close_pools()
+
 @app.post("/api/login", response_model=Token)
 def login_for_access_token(
     form_data: OAuth2PasswordRequestForm = Depends(),
@@ -102,9 +177,149 @@ class PageData(BaseModel):
     top_creative: Optional[TopCreative] = None
     is_queued_for_scrape: bool = False
 
+# Final SELECT of query_pages, in this order, so rows can be unpacked by position
+PAGE_LIST_COLUMNS = (
+    "Page_id", "Name", "eu_total_reach", "active_eu_total_reach", "active_ads_count", "TagName", "TagId",
+    "status", "pp_beneficiary", "pp_page_notes", "creativeUrl", "creative_type", "AdSnapshotUrl",
+)
+
+def page_rows_to_dicts(rows) -> List[dict]:
+    """
+    Maps query_pages rows straight to the JSON shape of PageData (same keys, order and defaults
+    as PageData(...).model_dump()) without building or validating a model per row.
+    """
+    results = []
+    append = results.append
+    type_map = CREATIVE_TYPE_MAP
+    status_map = STATUS_MAP_TO_UI
+    for (page_id, name, reach, active_reach, active_ads, tag_name, tag_id, db_status,
+         beneficiary, notes, creative_url, creative_type, snapshot_url) in rows:
+        top_creative = None
+        if creative_url or snapshot_url:
+            top_creative = {
+                "media_url": creative_url or "",
+                "media_type": type_map.get(creative_type, "image") if creative_type else "image",
+                "snapshot_url": snapshot_url or "",
+            }
+        append({
+            "page_id": page_id,
+            "name": name or "Unknown",
+            "country": "",
+            "total_eu_reach": reach or 0,
+            "active_eu_total_reach": active_reach,
+            "active_ads_count": active_ads,
+            "manual_status": "unprocessed" if db_status in (0, 7) else status_map.get(db_status, "unprocessed"),
+            "beneficiary": beneficiary or "",
+            "notes": notes or "",
+            "tag": tag_name,
+            "tagId": tag_id,
+            "top_creative": top_creative,
+            "is_queued_for_scrape": db_status == 7,
+        })
+    return results
+
 class StatusUpdateRequest(BaseModel):
     manual_status: str
 
+def encode_page_cursor(eu_total_reach: int, page_id: str) -> str:
+    """Opaque keyset continuation token for /api/pages (last row's sort key)."""
+    raw = json.dumps([eu_total_reach, page_id], separators=(",", ":")).encode("utf-8")
+    return base64.urlsafe_b64encode(raw).decode("ascii").rstrip("=")
+
+# Per-worker cache of /api/pages results keyed by the normalised filters. Writes in this API
+# evict only the pages/tabs/tags they touch; changes made by the scraper show up after the TTL.
+pages_cache = QueryCache(
+    max_size=int(os.environ.get("PAGES_CACHE_MAX_SIZE", "256")),
+    ttl=float(os.environ.get("PAGES_CACHE_TTL", "30")),
+)
+
+# /api/pages/facets counts per (searchTerm, min_reach). Short TTL, and any status/tag write clears it
+facets_cache = QueryCache(
+    max_size=int(os.environ.get("PAGES_FACETS_CACHE_MAX_SIZE", "64")),
+    ttl=float(os.environ.get("PAGES_FACETS_CACHE_TTL", "15")),
+)
+
+PAGE_TABS = ("unprocessed", "saved", "deleted")
+
+def tab_for_db_status(db_status: Optional[int]) -> Optional[str]:
+    """Status tab of /api/pages in which a pagesProducts.status shows up (None: no tab)."""
+    if db_status is None or db_status == 0:
+        return "unprocessed"
+    if db_status in (7, 11):
+        return "saved"
+    if db_status == 13:
+        return "deleted"
+    return None
+
+def invalidate_pages_cache(page_ids=(), tabs=(), tag_names=(), tag_ids=()):
+    """
+    Evicts cached /api/pages results that show any of `page_ids`, list a status tab in `tabs`,
+    are filtered by a tag name in `tag_names` (None means "Untagged") or show a page with a tag id in `tag_ids`.
+    """
+    tags = [("page", page_id) for page_id in page_ids]
+    tags += [("tab", tab) for tab in tabs if tab]
+    tags += [("tagfilter", "Untagged" if name is None else name) for name in tag_names]
+    tags += [("tagid", tag_id) for tag_id in tag_ids]
+    pages_cache.invalidate_tags(tags)
+    # Tab and tag counts change with any status or tag write; notes-only writes leave them alone
+    if tabs or tag_names or tag_ids:
+        facets_cache.clear()
+
+def fetch_page_tabs(cursor: pyodbc.Cursor, page_id: str) -> set:
+    """Current status tabs of a page (all its clones / pagesProducts rows)."""
+    cursor.execute(
+        """
+        SELECT DISTINCT pp.status
+        FROM pages p
+        LEFT JOIN pagesProducts pp ON pp.pageId = p.Id
+        WHERE p.Page_id = ?
+        """,
+        [page_id]
+    )
+    return {tab_for_db_status(row[0]) for row in cursor.fetchall()}
+
+def normalize_page_filters(
+    status: str,
+    searchTerm: Optional[str],
+    country: Optional[str],
+    category: Optional[str],
+    tag: Optional[str],
+) -> tuple[str, Optional[str], Optional[str], Optional[str], Optional[str]]:
+    """(tab, searchTerm, country, category, tag) with the frontend's "All" placeholders turned into None."""
+    tab = status if status in ("saved", "deleted") else "unprocessed"
+    searchTerm = searchTerm if searchTerm and searchTerm != "All" else None
+    country = country if country and country not in ("All", "ALL") else None
+    category = category if category and category != "All" else None
+    tag = tag if tag and tag != "All" else None
+    return tab, searchTerm, country, category, tag
+
+def page_name_filter(searchTerm: str) -> tuple[str, List[Any]]:
+    """
+    WHERE lines (pageListing alias pl) and params for searchTerm. The LIKE always stays; when the
+    trigram index can answer, the rows are narrowed to its candidate Ids plus the rows changed
+    since its watermark (see search_index.py).
+    """
+    like = f"%{searchTerm}%"
+    lookup = page_search_index.lookup(searchTerm)
+    if lookup is None:
+        return "                  AND pl.Name LIKE ?\n", [like]
+    ids, watermark = lookup
+    sql = (
+        "                  AND (pl.PageInternalId IN (SELECT CAST(value AS INT) FROM OPENJSON(?)) OR pl.RowVer >= ?)\n"
+        "                  AND pl.Name LIKE ?\n"
+    )
+    return sql, [json_dumps_str(ids), watermark, like]
+
+def decode_page_cursor(token: str) -> tuple[int, str]:
+    try:
+        raw = base64.urlsafe_b64decode(token + "=" * (-len(token) % 4))
+        reach, page_id = json.loads(raw)
+        if not isinstance(reach, int) or not isinstance(page_id, str):
+            raise ValueError("bad cursor payload")
+        return reach, page_id
+    except Exception:
+        raise HTTPException(status_code=400, detail="Invalid 'after' cursor")
+
 @app.get("/api/pages", response_model=List[PageData])
 def get_pages(
     status: str = "unprocessed",
@@ -116,54 +331,191 @@ def get_pages(
     min_reach: int = Query(default=200000, ge=0, description="Minimum eu_total_reach filter"),
     limit: int = Query(default=100, ge=1, le=500, description="Number of results per page"),
     offset: int = Query(default=0, ge=0, description="Number of rows to skip"),
-    db: pyodbc.Connection = Depends(get_db),
+    after: Optional[str] = Query(None, description="Keyset cursor from the X-Next-Cursor header; replaces offset"),
+    current_user: UserInDB = Depends(get_current_active_user)
+) -> Response:
+    # Rows are mapped to plain dicts once and serialised directly (see page_rows_to_dicts); returning
+    # a Response skips response_model re-validation, which stays declared for the OpenAPI schema.
+
+    # Keyset mode: seek past the last (eu_total_reach, Page_id) instead of skipping rows.
+    # Offset mode is kept for older clients; both share the same deterministic order.
+    seek = decode_page_cursor(after) if after else None
+
+    # Normalise the filters so equivalent requests share a cache entry
+    tab, searchTerm, country, category, tag = normalize_page_filters(status, searchTerm, country, category, tag)
+    if seek:
+        offset = 0
+    cache_key = (tab, searchTerm, country, category, tag, action_date or None, min_reach, limit, offset, seek)
+
+    def cache_tags(value):
+        results, _ = value
+        tags = [("tab", tab)]
+        if tag:
+            tags.append(("tagfilter", tag))
+        for page in results:
+            tags.append(("page", page["page_id"]))
+            if page["tagId"] is not None:
+                tags.append(("tagid", page["tagId"]))
+        return tags
+
+    try:
+        results, next_cursor = pages_cache.get_or_load(
+            cache_key,
+            lambda: query_pages(tab, searchTerm, country, category, tag, action_date, min_reach, limit, offset, seek),
+            tags_for=cache_tags,
+        )
+    except Exception as e:
+        print(f"Error executing query: {e}")
+        raise HTTPException(status_code=500, detail=str(e))
+
+    headers = {"X-Next-Cursor": next_cursor} if next_cursor else None
+    return FastJSONResponse(content=results, headers=headers)
+
+@app.get("/api/pages/facets")
+def get_page_facets(
+    searchTerm: Optional[str] = None,
+    min_reach: int = Query(default=200000, ge=0, description="Minimum eu_total_reach filter"),
     current_user: UserInDB = Depends(get_current_active_user)
-) -> List[PageData]:
+):
+    """
+    Page counts per status tab and, within each tab, per country (niche), category and tag,
+    under the same searchTerm/min_reach filters as /api/pages. Keys are the values the
+    /api/pages filters accept ("Uncategorized", "Untagged"). Each value counts the pages that
+    filter would list, so a page in several niches counts under each (values don't sum to the tab).
+    """
+    searchTerm = normalize_page_filters("unprocessed", searchTerm, None, None, None)[1]
     try:
+        return facets_cache.get_or_load((searchTerm, min_reach), lambda: query_page_facets(searchTerm, min_reach))
+    except Exception as e:
+        print(f"Error executing facets query: {e}")
+        raise HTTPException(status_code=500, detail=str(e))
+
+def query_page_facets(searchTerm: Optional[str], min_reach: int) -> dict:
+    """One GROUPING SETS query over pageListing for every tab and facet value."""
+    # Same tab mapping as query_pages. query_pages applies country/category/tag to every listing
+    # row before keeping one row per Page_id, so a page with clones or pagesProducts rows in
+    # several niches is listed under each of them: every facet value counts the distinct pages
+    # its filter returns.
+    query = """
+        WITH TabPages AS (
+            SELECT
+                t.Page_id,
+                t.tab,
+                t.nicheName,
+                CASE WHEN t.category = 'UNKNOWN' THEN 'Uncategorized' ELSE t.category END AS category,
+                ISNULL(t.TagName, 'Untagged') AS tag
+            FROM (
+                SELECT
+                    pl.Page_id,
+                    CASE
+                        WHEN pl.status IS NULL OR pl.status = 0 THEN 'unprocessed'
+                        WHEN pl.status IN (7, 11) THEN 'saved'
+                        WHEN pl.status = 13 THEN 'deleted'
+                    END AS tab,
+                    pl.nicheName,
+                    pl.category,
+                    pl.TagName
+                FROM pageListing pl
+                WHERE pl.eu_total_reach >= ?
+    """
+    params: List[Any] = [min_reach]
+    if searchTerm:
+        search_sql, search_params = page_name_filter(searchTerm)
+        query += search_sql
+        params.extend(search_params)
+    query += """
+            ) t
+            WHERE t.tab IS NOT NULL
+        )
+        SELECT
+            tab, nicheName, category, tag,
+            GROUPING(nicheName) AS all_countries,
+            GROUPING(category)  AS all_categories,
+            GROUPING(tag)       AS all_tags,
+            COUNT(DISTINCT Page_id) AS pages
+        FROM TabPages
+        GROUP BY GROUPING SETS ((tab), (tab, nicheName), (tab, category), (tab, tag))
+    """
+
+    with pooled_connection(main_pool) as db:
         cursor = db.cursor()
-        
-        # Translate frontend status to DB integer
-        db_status = STATUS_MAP_TO_DB.get(status, 0)
-        
-        # Use a CTE to deduplicate pages (taking only 1 ad per page) before paginating.
-        # This avoiding duplicates from ads JOIN and makes OFFSET/FETCH NEXT reliable.
+        with sql_timer("pages_facets"):
+            cursor.execute(query, params)
+            rows = cursor.fetchall()
+
+    tabs = dict.fromkeys(PAGE_TABS, 0)
+    facets = {tab: {"country": {}, "category": {}, "tag": {}} for tab in PAGE_TABS}
+    for row in rows:
+        if not row.all_countries:
+            facet, value = "country", row.nicheName
+        elif not row.all_categories:
+            facet, value = "category", row.category
+        elif not row.all_tags:
+            facet, value = "tag", row.tag
+        else:
+            tabs[row.tab] = row.pages
+            continue
+        # NULL countries/categories can't be selected as a filter
+        if value is not None:
+            facets[row.tab][facet][value] = row.pages
+
+    for by_facet in facets.values():
+        for facet, counts in by_facet.items():
+            by_facet[facet] = dict(sorted(counts.items(), key=lambda item: (-item[1], item[0])))
+    return {"tabs": tabs, "facets": facets}
+
+def query_pages(
+    tab: str,
+    searchTerm: Optional[str],
+    country: Optional[str],
+    category: Optional[str],
+    tag: Optional[str],
+    action_date: Optional[str],
+    min_reach: int,
+    limit: int,
+    offset: int,
+    seek: Optional[tuple[int, str]],
+) -> tuple[List[dict], Optional[str]]:
+    """Runs the /api/pages query with already normalised filters. Returns (rows, next keyset cursor)."""
+    with pooled_connection(main_pool) as db:
+        cursor = db.cursor()
+
+        # Read from the pageListing read model (see read_model.py), which already carries each
+        # page's first creative, status, niche name and tag. The CTE only deduplicates page clones /
+        # multiple pagesProducts rows (keeping the row with the first ad) before paginating.
         
         # Always include status 0 (unprocessed) and 7 (queued for scrape).
         # Additionally add the tab-specific status.
         db_statuses = [0]
-        if status == "saved":
+        if tab == "saved":
             db_statuses = [7, 11]
-        elif status == "deleted":
+        elif tab == "deleted":
             db_statuses = [13]
             
         status_placeholders = ",".join(["?"] * len(db_statuses))
             
         query = f"""
-            WITH RankedAds AS (
+            WITH RankedPages AS (
                 SELECT
-                    pg.Id          AS PageInternalId,
-                    pg.Page_id,
-                    pg.Name,
-                    pg.eu_total_reach,
-                    pg.active_eu_total_reach,
-                    pg.active_ads_count,
-                    pg.category    AS pg_category,
-                    pg.TagName,
-                    pg.TagId,
-                    pp.status,
-                    pp.beneficiary AS pp_beneficiary,
-                    pp.page_notes AS pp_page_notes,
-                    a.creativeUrl,
-                    a.creative_type,
-                    a.AdSnapshotUrl,
-                    a.reachedCountries,
-                    ROW_NUMBER() OVER (PARTITION BY pg.Page_id ORDER BY a.Id ASC) AS rn
-                FROM pages pg
-                LEFT JOIN pagesProducts pp ON pp.pageId = pg.Id
-                LEFT JOIN niches n ON pp.nicheId = n.Id
-                LEFT JOIN ads a ON a.pageId = pg.Id
-                WHERE (pp.status IN ({status_placeholders}) OR (pp.status IS NULL AND ? = 0))
-                  AND pg.eu_total_reach >= ?
+                    pl.PageInternalId,
+                    pl.Page_id,
+                    pl.Name,
+                    pl.eu_total_reach,
+                    pl.active_eu_total_reach,
+                    pl.active_ads_count,
+                    pl.category    AS pg_category,
+                    pl.TagName,
+                    pl.TagId,
+                    pl.status,
+                    pl.beneficiary AS pp_beneficiary,
+                    pl.page_notes  AS pp_page_notes,
+                    pl.creativeUrl,
+                    pl.creative_type,
+                    pl.AdSnapshotUrl,
+                    ROW_NUMBER() OVER (PARTITION BY pl.Page_id ORDER BY pl.firstAdId ASC, pl.PageInternalId ASC) AS rn
+                FROM pageListing pl
+                WHERE (pl.status IN ({status_placeholders}) OR (pl.status IS NULL AND ? = 0))
+                  AND pl.eu_total_reach >= ?
         """
         params: List[Any] = []
         params.extend(db_statuses)
@@ -171,79 +523,76 @@ def get_pages(
         params.append(min_reach)
 
         if action_date:
-            query += "                  AND CONVERT(DATE, pp.status_updated_at) = ?\n"
+            query += "                  AND CONVERT(DATE, pl.status_updated_at) = ?\n"
             params.append(action_date)
 
-        if searchTerm and searchTerm != "All":
-            query += "                  AND pg.Name LIKE ?\n"
-            params.append(f"%{searchTerm}%")
+        if searchTerm:
+            search_sql, search_params = page_name_filter(searchTerm)
+            query += search_sql
+            params.extend(search_params)
 
-        if category and category != "All":
+        if category:
             if category == "Uncategorized":
-                query += "                  AND pg.category = 'UNKNOWN'\n"
+                query += "                  AND pl.category = 'UNKNOWN'\n"
             else:
-                query += "                  AND pg.category = ?\n"
+                query += "                  AND pl.category = ?\n"
                 params.append(category)
 
-        if country and country != "All" and country != "ALL":
+        if country:
             # Check country by relating to niche name
-            query += "                  AND n.Name = ?\n"
+            query += "                  AND pl.nicheName = ?\n"
             params.append(country)
 
-        if tag and tag != "All":
+        if tag:
             if tag == "Untagged":
-                query += "                  AND pg.TagName IS NULL\n"
+                query += "                  AND pl.TagName IS NULL\n"
             else:
-                query += "                  AND pg.TagName = ?\n"
+                query += "                  AND pl.TagName = ?\n"
                 params.append(tag)
 
-        query += """
+        query += f"""
             )
-            SELECT *
-            FROM RankedAds
+            SELECT {", ".join(PAGE_LIST_COLUMNS)}
+            FROM RankedPages
             WHERE rn = 1
-            ORDER BY eu_total_reach DESC
+        """
+
+        if seek:
+            # Seek on the deduplicated rows: clones of a page have their own reach, so seeking
+            # inside the CTE would let a lower-reach clone become rn = 1 and repeat the page
+            query += "              AND (eu_total_reach < ? OR (eu_total_reach = ? AND Page_id < ?))\n"
+            params.extend([seek[0], seek[0], seek[1]])
+
+        query += """
+            ORDER BY eu_total_reach DESC, Page_id DESC
             OFFSET ? ROWS FETCH NEXT ? ROWS ONLY
         """
         params.extend([offset, limit])
 
-        cursor.execute(query, params)
-        rows = cursor.fetchall()
-        
-        results = []
-        for row in rows:
-            top_creative = None
-            if row.creativeUrl or row.AdSnapshotUrl:
-                c_type_str = CREATIVE_TYPE_MAP.get(row.creative_type, "image") if row.creative_type else "image"
-                top_creative = TopCreative(
-                    media_url=row.creativeUrl or "",
-                    media_type=c_type_str,
-                    snapshot_url=row.AdSnapshotUrl or ""
-                )
-                
-            ui_status = STATUS_MAP_TO_UI.get(row.status, "unprocessed")
-            
-            results.append(PageData(
-                page_id=row.Page_id,
-                name=row.Name or "Unknown",
-                country="",
-                total_eu_reach=row.eu_total_reach or 0,
-                active_eu_total_reach=row.active_eu_total_reach,
-                active_ads_count=row.active_ads_count,
-                manual_status="unprocessed" if row.status in (0, 7) else ui_status,
-                beneficiary=row.pp_beneficiary or "",
-                notes=row.pp_page_notes or "",
-                tag=row.TagName,
-                tagId=row.TagId,
-                top_creative=top_creative,
-                is_queued_for_scrape=(row.status == 7)
-            ))
-            
-        return results
+        with sql_timer("pages_list"):
+            cursor.execute(query, params)
+            rows = cursor.fetchall()
         
-    except Exception as e:
-        print(f"Error executing query: {e}")
-        raise HTTPException(status_code=500, detail=str(e))
+        results = page_rows_to_dicts(rows)
+
+        next_cursor = None
+        if len(rows) == limit:
+            # Sort key of the deduplicated row the client received
+            last = rows[-1]
+            next_cursor = encode_page_cursor(last[2] or 0, last[0])
+
+        return results, next_cursor
+
+def get_lithuanian_now() -> datetime:
+    """Current time in Europe/Vilnius, used for status_updated_at."""
+    try:
+        tz = zoneinfo.ZoneInfo("Europe/Vilnius")
+    except zoneinfo.ZoneInfoNotFoundError:
+        # Fallback for environments without tzdata locally installed (like Windows temporarily)
+        # but in production/linux it will use Europe/Vilnius
+        from datetime import timezone
+        tz = timezone(timedelta(hours=2)) # Lithuania is UTC+2 (or +3 in summer, but +2 is standard)
+    return datetime.now(tz)
 
 @app.patch("/api/pages/{page_id}/status")
 def update_page_status(
@@ -259,39 +608,36 @@ def update_page_status(
             
         cursor = db.cursor()
         
-        # Calculate Lithuanian time
-        try:
-            tz = zoneinfo.ZoneInfo("Europe/Vilnius")
-        except zoneinfo.ZoneInfoNotFoundError:
-            # Fallback for environments without tzdata locally installed (like Windows temporarily)
-            # but in production/linux it will use Europe/Vilnius
-            from datetime import timezone
-            tz = timezone(timedelta(hours=2)) # Lithuania is UTC+2 (or +3 in summer, but +2 is standard)
-            
-        lithuanian_now = datetime.now(tz)
+        lithuanian_now = get_lithuanian_now()
+
+        # Tabs the page is leaving, for cache invalidation
+        old_tabs = fetch_page_tabs(cursor, page_id)
 
         # 1. Update existing pagesProducts
-        cursor.execute(
-            """
-            UPDATE pagesProducts 
-            SET status = ?, status_updated_at = ?
-            WHERE pageId IN (SELECT Id FROM pages WHERE Page_id = ?)
-            """, 
-            [db_status, lithuanian_now, page_id]
-        )
+        with sql_timer("status_update"):
+            cursor.execute(
+                """
+                UPDATE pagesProducts 
+                SET status = ?, status_updated_at = ?
+                WHERE pageId IN (SELECT Id FROM pages WHERE Page_id = ?)
+                """, 
+                [db_status, lithuanian_now, page_id]
+            )
         
         # 2. Insert missing pagesProducts for clones
-        cursor.execute(
-            """
-            INSERT INTO pagesProducts (pageId, nicheId, total_reach, total_ads, date_updated, status, status_updated_at)
-            SELECT p.Id, ISNULL((SELECT TOP 1 Id FROM niches), 1), ISNULL(p.eu_total_reach, 0), 1, GETUTCDATE(), ?, ?
-            FROM pages p
-            LEFT JOIN pagesProducts pp ON pp.pageId = p.Id
-            WHERE p.Page_id = ? AND pp.Id IS NULL
-            """,
-            [db_status, lithuanian_now, page_id]
-        )
+        with sql_timer("status_insert_clones"):
+            cursor.execute(
+                """
+                INSERT INTO pagesProducts (pageId, nicheId, total_reach, total_ads, date_updated, status, status_updated_at)
+                SELECT p.Id, ISNULL((SELECT TOP 1 Id FROM niches), 1), ISNULL(p.eu_total_reach, 0), 1, GETUTCDATE(), ?, ?
+                FROM pages p
+                LEFT JOIN pagesProducts pp ON pp.pageId = p.Id
+                WHERE p.Page_id = ? AND pp.Id IS NULL
+                """,
+                [db_status, lithuanian_now, page_id]
+            )
         db.commit()
+        invalidate_pages_cache(page_ids=[page_id], tabs=old_tabs | {tab_for_db_status(db_status)})
         
         return {"success": True, "message": "Status updated successfully"}
         
@@ -308,36 +654,35 @@ def trigger_full_scrape(
     try:
         cursor = db.cursor()
         
-        try:
-            tz = zoneinfo.ZoneInfo("Europe/Vilnius")
-        except zoneinfo.ZoneInfoNotFoundError:
-            from datetime import timezone
-            tz = timezone(timedelta(hours=2))
-            
-        lithuanian_now = datetime.now(tz)
+        lithuanian_now = get_lithuanian_now()
+
+        old_tabs = fetch_page_tabs(cursor, page_id)
 
         # 1. Update existing pagesProducts
-        cursor.execute(
-            """
-            UPDATE pagesProducts 
-            SET status = 7, scrappingType = 0, status_updated_at = ?
-            WHERE pageId IN (SELECT Id FROM pages WHERE Page_id = ?)
-            """, 
-            [lithuanian_now, page_id]
-        )
+        with sql_timer("full_scrape_trigger_update"):
+            cursor.execute(
+                """
+                UPDATE pagesProducts 
+                SET status = 7, scrappingType = 0, status_updated_at = ?
+                WHERE pageId IN (SELECT Id FROM pages WHERE Page_id = ?)
+                """, 
+                [lithuanian_now, page_id]
+            )
         
         # 2. Insert missing pagesProducts for clones
-        cursor.execute(
-            """
-            INSERT INTO pagesProducts (pageId, nicheId, total_reach, total_ads, date_updated, status, scrappingType, status_updated_at)
-            SELECT p.Id, ISNULL((SELECT TOP 1 Id FROM niches), 1), ISNULL(p.eu_total_reach, 0), 1, GETUTCDATE(), 7, 0, ?
-            FROM pages p
-            LEFT JOIN pagesProducts pp ON pp.pageId = p.Id
-            WHERE p.Page_id = ? AND pp.Id IS NULL
-            """,
-            [lithuanian_now, page_id]
-        )
+        with sql_timer("full_scrape_trigger_insert_clones"):
+            cursor.execute(
+                """
+                INSERT INTO pagesProducts (pageId, nicheId, total_reach, total_ads, date_updated, status, scrappingType, status_updated_at)
+                SELECT p.Id, ISNULL((SELECT TOP 1 Id FROM niches), 1), ISNULL(p.eu_total_reach, 0), 1, GETUTCDATE(), 7, 0, ?
+                FROM pages p
+                LEFT JOIN pagesProducts pp ON pp.pageId = p.Id
+                WHERE p.Page_id = ? AND pp.Id IS NULL
+                """,
+                [lithuanian_now, page_id]
+            )
         db.commit()
+        invalidate_pages_cache(page_ids=[page_id], tabs=old_tabs | {"saved"})
         
         return {"success": True, "message": "Triggered full page scrape"}
         
@@ -354,16 +699,18 @@ def cancel_full_scrape(
     try:
         cursor = db.cursor()
         # Revert to status 11 (Saved/Completed) instead of 0 (Pending)
-        cursor.execute(
-            """
-            UPDATE pagesProducts 
-            SET status = 11, scrappingType = NULL, status_updated_at = GETUTCDATE()
-            WHERE pageId IN (SELECT Id FROM pages WHERE Page_id = ?)
-              AND status = 7
-            """,
-            [page_id]
-        )
+        with sql_timer("full_scrape_cancel"):
+            cursor.execute(
+                """
+                UPDATE pagesProducts 
+                SET status = 11, scrappingType = NULL, status_updated_at = GETUTCDATE()
+                WHERE pageId IN (SELECT Id FROM pages WHERE Page_id = ?)
+                  AND status = 7
+                """,
+                [page_id]
+            )
         db.commit()
+        invalidate_pages_cache(page_ids=[page_id])
         return {"success": True, "message": "Full scrape cancelled, page reverted to pending"}
     except Exception as e:
         db.rollback()
@@ -373,6 +720,32 @@ def cancel_full_scrape(
 def health_check():
     return {"status": "healthy"}
 
+@app.get("/health/db-pools")
+def db_pool_stats(current_user: UserInDB = Depends(get_current_active_user)):
+    """In-use / idle connections and checkout wait times for this worker's DB pools."""
+    return {**get_pool_stats(), "executor": get_db_executor_stats()}
+
+@app.get("/health/meta-http")
+def meta_http_stats(current_user: UserInDB = Depends(get_current_active_user)):
+    """Connection reuse and latency of the shared Graph API client, plus access token usage."""
+    from meta_service import get_meta_http_stats, meta_token_pool
+    return {**get_meta_http_stats(), "access_tokens": meta_token_pool.stats()}
+
+@app.get("/health/search-index")
+def search_index_stats(current_user: UserInDB = Depends(get_current_active_user)):
+    """Pages, trigrams and lookups of this worker's page name index."""
+    return page_search_index.stats()
+
+# Left without a user on purpose: Prometheus scrapers can't log in for a bearer token. It only
+# carries aggregate latencies/counters (no ids or tokens); turn it off with METRICS_ENABLED=0
+# or keep it off the public ingress.
+@app.get("/metrics", include_in_schema=False)
+def prometheus_metrics():
+    """Latency histograms and counters of this worker in Prometheus text format (see metrics.py)."""
+    if not METRICS_ENABLED:
+        raise HTTPException(status_code=404, detail="Metrics are disabled")
+    return Response(content=render_metrics(), media_type=METRICS_CONTENT_TYPE)
+
 COUNTRY_LIST = ["ALL", "BR", "IN", "GB", "US", "CA", "AR", "AU", "AT", "BE", "CL", "CN", "CO", "HR", "DK", "DO", "EG", "FI", "FR", "DE", "GR", "HK", "ID", "IE", "IL", "IT", "JP", "JO", "KW", "LB", "MY", "MX", "NL", "NZ", "NG", "NO", "PK", "PA", "PE", "PH", "PL", "RU", "SA", "RS", "SG", "ZA", "KR", "ES", "SE", "CH", "TW", "TH", "TR", "AE", "VE", "PT", "LU", "BG", "CZ", "SI", "IS", "SK", "LT", "TT", "BD", "LK", "KE", "HU", "MA", "CY", "JM", "EC", "RO", "BO", "GT", "CR", "QA", "SV", "HN", "NI", "PY", "UY", "PR", "BA", "PS", "TN", "BH", "VN", "GH", "MU", "UA", "MT", "BS", "MV", "OM", "MK", "LV", "EE", "IQ", "DZ", "AL", "NP", "MO", "ME", "SN", "GE", "BN", "UG", "GP", "BB", "AZ", "TZ", "LY", "MQ", "CM", "BW", "ET", "KZ", "NA", "MG", "NC", "MD", "FJ", "BY", "JE", "GU", "YE", "ZM", "IM", "HT", "KH", "AW", "PF", "AF", "BM", "GY", "AM", "MW", "AG", "RW", "GG", "GM", "FO", "LC", "KY", "BJ", "AD", "GD", "VI", "BZ", "VC", "MN", "MZ", "ML", "AO", "GF", "UZ", "DJ", "BF", "MC", "TG", "GL", "GA", "GI", "CD", "KG", "PG", "BT", "KN", "SZ", "LS", "LA", "LI", "MP", "SR", "SC", "VG", "TC", "DM", "MR", "AX", "SM", "SL", "NE", "CG", "AI", "YT", "CV", "GN", "TM", "BI", "TJ", "VU", "SB", "ER", "WS", "AS", "FK", "GQ", "TO", "KM", "PW", "FM", "CF", "SO", "MH", "VA", "TD", "KI", "ST", "TV", "NR", "RE", "LR", "ZW", "CI", "MM", "AN", "AQ", "BQ", "BV", "IO", "CX", "CC", "CK", "CW", "TF", "GW", "HM", "XK", "MS", "NU", "NF", "PN", "BL", "SH", "MF", "PM", "SX", "GS", "SD", "SS", "SJ", "TL", "TK", "UM", "WF", "EH"]
 
 class SearchTermRequest(BaseModel):
@@ -409,7 +782,8 @@ def create_search_term(
         now = datetime.utcnow()
         params = [niche_id, term_data.search_term, country_index, 0, now, True, True]
         
-        cursor.execute(query, params)
+        with sql_timer("search_term_insert"):
+            cursor.execute(query, params)
         db.commit()
         
         return {"success": True, "message": "Search term created successfully"}
@@ -426,7 +800,8 @@ def get_countries(
 ):
     try:
         cursor = db.cursor()
-        cursor.execute("SELECT DISTINCT Name FROM niches ORDER BY Name ASC")
+        with sql_timer("countries_list"):
+            cursor.execute("SELECT DISTINCT Name FROM niches ORDER BY Name ASC")
         rows = cursor.fetchall()
         return [row.Name for row in rows if row.Name]
     except Exception as e:
@@ -456,6 +831,25 @@ class BulkReplaceTagsRequest(BaseModel):
 class PageNotesUpdateRequest(BaseModel):
     notes: str
 
+BULK_MAX_PAGES = 1000
+
+class BulkPagesRequest(BaseModel):
+    page_ids: List[str]
+    manual_status: Optional[str] = None
+    full_scrape: Optional[str] = None  # "trigger" | "cancel"
+    tag: Optional[TagUpdateRequest] = None
+    notes: Optional[str] = None
+
+class BulkPageResult(BaseModel):
+    page_id: str
+    outcome: str  # "updated" | "unchanged" | "not_found"
+
+class BulkPagesResponse(BaseModel):
+    updated: int
+    unchanged: int
+    not_found: int
+    results: List[BulkPageResult]
+
 @app.get("/api/tags", response_model=List[TagResponse])
 def get_tags(
     db: pyodbc.Connection = Depends(get_db),
@@ -463,7 +857,8 @@ def get_tags(
 ):
     try:
         cursor = db.cursor()
-        cursor.execute("SELECT Id, Name FROM tags ORDER BY Name ASC")
+        with sql_timer("tags_list"):
+            cursor.execute("SELECT Id, Name FROM tags ORDER BY Name ASC")
         rows = cursor.fetchall()
         return [{"Id": row.Id, "Name": row.Name} for row in rows]
     except Exception as e:
@@ -484,7 +879,8 @@ def create_tag(
             return {"Id": existing.Id, "Name": existing.Name}
             
         # SQL Server PyODBC syntax for OUTPUT inserted.Id doesn't easily return the value with execute, using @@IDENTITY
-        cursor.execute("INSERT INTO tags (Name) VALUES (?)", tag.name)
+        with sql_timer("tag_insert"):
+            cursor.execute("INSERT INTO tags (Name) VALUES (?)", tag.name)
         cursor.execute("SELECT @@IDENTITY AS Id")
         new_id = int(cursor.fetchone().Id)
         db.commit()
@@ -502,10 +898,13 @@ def delete_tag(
     try:
         cursor = db.cursor()
         # Sync: remove this tag from any assigned pages before deleting the tag
-        cursor.execute("UPDATE pages SET TagId = NULL, TagName = NULL WHERE TagId = ?", tag_id)
+        with sql_timer("tag_delete_clear_pages"):
+            cursor.execute("UPDATE pages SET TagId = NULL, TagName = NULL WHERE TagId = ?", tag_id)
         # Delete from tags
-        cursor.execute("DELETE FROM tags WHERE Id = ?", tag_id)
+        with sql_timer("tag_delete"):
+            cursor.execute("DELETE FROM tags WHERE Id = ?", tag_id)
         db.commit()
+        invalidate_pages_cache(tag_names=[None], tag_ids=[tag_id])
         return {"message": "Tag deleted successfully"}
     except Exception as e:
         db.rollback()
@@ -520,9 +919,13 @@ def update_page_tag(
 ):
     try:
         cursor = db.cursor()
+        cursor.execute("SELECT DISTINCT TagName FROM pages WHERE Page_id = ?", (page_id,))
+        old_tag_names = {row[0] for row in cursor.fetchall()}
         query = "UPDATE pages SET TagId = ?, TagName = ? WHERE Page_id = ?"
-        cursor.execute(query, (request.tagId, request.tagName, page_id))
+        with sql_timer("tag_update_page"):
+            cursor.execute(query, (request.tagId, request.tagName, page_id))
         db.commit()
+        invalidate_pages_cache(page_ids=[page_id], tag_names=old_tag_names | {request.tagName})
         return {"message": "Page tag updated successfully"}
     except Exception as e:
         db.rollback()
@@ -543,12 +946,16 @@ def rename_tag(
         if cursor.fetchone():
             raise HTTPException(status_code=400, detail="A tag with that name already exists")
             
-        cursor.execute("UPDATE tags SET Name = ? WHERE Id = ?", (request.name, tag_id))
+        with sql_timer("tag_rename"):
+            cursor.execute("UPDATE tags SET Name = ? OUTPUT deleted.Name WHERE Id = ?", (request.name, tag_id))
+        old_names = {row[0] for row in cursor.fetchall()}
         
         # Also rename denormalized TagName in pages
-        cursor.execute("UPDATE pages SET TagName = ? WHERE TagId = ?", (request.name, tag_id))
+        with sql_timer("tag_rename_pages"):
+            cursor.execute("UPDATE pages SET TagName = ? WHERE TagId = ?", (request.name, tag_id))
         
         db.commit()
+        invalidate_pages_cache(tag_names=old_names | {request.name}, tag_ids=[tag_id])
         return {"message": "Tag renamed successfully"}
     except HTTPException:
         raise
@@ -576,15 +983,18 @@ def bulk_replace_tags(
         target_name = target_row.Name
         
         # Update all pages that have source tag to target tag
-        cursor.execute(
-            "UPDATE pages SET TagId = ?, TagName = ? WHERE TagId = ?", 
-            (request.targetTagId, target_name, request.sourceTagId)
-        )
+        with sql_timer("tag_bulk_replace"):
+            cursor.execute(
+                "UPDATE pages SET TagId = ?, TagName = ? WHERE TagId = ?", 
+                (request.targetTagId, target_name, request.sourceTagId)
+            )
         
         if request.deleteSource:
-            cursor.execute("DELETE FROM tags WHERE Id = ?", (request.sourceTagId,))
+            with sql_timer("tag_bulk_replace_delete"):
+                cursor.execute("DELETE FROM tags WHERE Id = ?", (request.sourceTagId,))
             
         db.commit()
+        invalidate_pages_cache(tag_names=[target_name], tag_ids=[request.sourceTagId])
         return {"message": "Tags replaced successfully"}
     except HTTPException:
         raise
@@ -606,7 +1016,8 @@ def get_page_notes(
             INNER JOIN pages p ON pp.pageId = p.Id
             WHERE p.Page_id = ?
         """
-        cursor.execute(query, (page_id,))
+        with sql_timer("page_notes_get"):
+            cursor.execute(query, (page_id,))
         row = cursor.fetchone()
         
         notes = row.page_notes if row and hasattr(row, 'page_notes') and row.page_notes else ""
@@ -630,65 +1041,454 @@ def update_page_notes(
             INNER JOIN pages p ON pp.pageId = p.Id
             WHERE p.Page_id = ?
         """
-        cursor.execute(query, (request.notes, page_id))
+        with sql_timer("page_notes_update"):
+            cursor.execute(query, (request.notes, page_id))
         db.commit()
+        invalidate_pages_cache(page_ids=[page_id])
         return {"message": "Page notes updated successfully"}
     except Exception as e:
         db.rollback()
         raise HTTPException(status_code=500, detail=f"Failed to update page notes: {e}")
 
+@app.post("/api/pages/bulk", response_model=BulkPagesResponse)
+def bulk_update_pages(
+    request: BulkPagesRequest,
+    db: pyodbc.Connection = Depends(get_db),
+    current_user: UserInDB = Depends(get_current_active_user)
+):
+    """
+    Applies status / full scrape / tag / notes changes to many pages in one transaction.
+    The page ids are loaded into a temp table and every operation is a single set-based
+    statement joined to it, instead of one request (and UPDATE + INSERT) per page.
+    Each statement OUTPUTs the pages it touched into #bulkUpdated, so a page that exists but no
+    statement changed (e.g. cancel on a page whose status is not 7) is reported as "unchanged".
+    """
+    page_ids = list(dict.fromkeys(p for p in request.page_ids if p))
+    if not page_ids:
+        raise HTTPException(status_code=400, detail="page_ids is empty")
+    if len(page_ids) > BULK_MAX_PAGES:
+        raise HTTPException(status_code=400, detail=f"At most {BULK_MAX_PAGES} page_ids per request")
+    if request.manual_status is not None and request.full_scrape is not None:
+        raise HTTPException(status_code=400, detail="manual_status and full_scrape cannot be combined")
+    if request.full_scrape not in (None, "trigger", "cancel"):
+        raise HTTPException(status_code=400, detail="full_scrape must be 'trigger' or 'cancel'")
+    db_status = None
+    if request.manual_status is not None:
+        db_status = STATUS_MAP_TO_DB.get(request.manual_status)
+        if db_status is None:
+            raise HTTPException(status_code=400, detail="Invalid status")
+    if db_status is None and request.full_scrape is None and request.tag is None and request.notes is None:
+        raise HTTPException(status_code=400, detail="No operation given")
+
+    cursor = db.cursor()
+    try:
+        cursor.execute("DROP TABLE IF EXISTS #bulkPages")
+        cursor.execute("CREATE TABLE #bulkPages (Page_id NVARCHAR(450) PRIMARY KEY)")
+        cursor.fast_executemany = True
+        with sql_timer("bulk_load_pages"):
+            cursor.executemany("INSERT INTO #bulkPages (Page_id) VALUES (?)", [(p,) for p in page_ids])
+        # pages.Id of every page a statement changed (OUTPUT INTO, since the tables have triggers)
+        cursor.execute("DROP TABLE IF EXISTS #bulkUpdated")
+        cursor.execute("CREATE TABLE #bulkUpdated (PageInternalId INT NOT NULL)")
+
+        # Current state of the targeted pages: which exist, and their tabs / tags for cache invalidation
+        with sql_timer("bulk_page_state"):
+            cursor.execute(
+                """
+                SELECT b.Page_id, p.Id AS PageInternalId, pp.status, p.TagName
+                FROM #bulkPages b
+                LEFT JOIN pages p ON p.Page_id = b.Page_id
+                LEFT JOIN pagesProducts pp ON pp.pageId = p.Id
+                """
+            )
+        found = {}
+        old_tabs = set()
+        old_tag_names = set()
+        for row in cursor.fetchall():
+            if row.PageInternalId is None:
+                continue
+            found[row.PageInternalId] = row.Page_id
+            old_tabs.add(tab_for_db_status(row.status))
+            old_tag_names.add(row.TagName)
+
+        lithuanian_now = get_lithuanian_now()
+        new_tabs = set()
+        if db_status is not None or request.full_scrape == "trigger":
+            if db_status is not None:
+                set_clause, insert_cols, insert_vals = "status = ?, status_updated_at = ?", "status, status_updated_at", "?, ?"
+                params = [db_status, lithuanian_now]
+                new_tabs.add(tab_for_db_status(db_status))
+            else:
+                set_clause, insert_cols, insert_vals = "status = 7, scrappingType = 0, status_updated_at = ?", "status, scrappingType, status_updated_at", "7, 0, ?"
+                params = [lithuanian_now]
+                new_tabs.add("saved")
+
+            # 1. Update existing pagesProducts
+            with sql_timer("bulk_status_update"):
+                cursor.execute(
+                    f"""
+                    UPDATE pp
+                    SET {set_clause}
+                    OUTPUT inserted.pageId INTO #bulkUpdated (PageInternalId)
+                    FROM pagesProducts pp
+                    INNER JOIN pages p ON pp.pageId = p.Id
+                    INNER JOIN #bulkPages b ON b.Page_id = p.Page_id
+                    """,
+                    params
+                )
+            # 2. Insert missing pagesProducts for clones
+            with sql_timer("bulk_status_insert_clones"):
+                cursor.execute(
+                    f"""
+                    INSERT INTO pagesProducts (pageId, nicheId, total_reach, total_ads, date_updated, {insert_cols})
+                    OUTPUT inserted.pageId INTO #bulkUpdated (PageInternalId)
+                    SELECT p.Id, ISNULL((SELECT TOP 1 Id FROM niches), 1), ISNULL(p.eu_total_reach, 0), 1, GETUTCDATE(), {insert_vals}
+                    FROM pages p
+                    INNER JOIN #bulkPages b ON b.Page_id = p.Page_id
+                    LEFT JOIN pagesProducts pp ON pp.pageId = p.Id
+                    WHERE pp.Id IS NULL
+                    """,
+                    params
+                )
+        elif request.full_scrape == "cancel":
+            with sql_timer("bulk_full_scrape_cancel"):
+                cursor.execute(
+                    """
+                    UPDATE pp
+                    SET status = 11, scrappingType = NULL, status_updated_at = GETUTCDATE()
+                    OUTPUT inserted.pageId INTO #bulkUpdated (PageInternalId)
+                    FROM pagesProducts pp
+                    INNER JOIN pages p ON pp.pageId = p.Id
+                    INNER JOIN #bulkPages b ON b.Page_id = p.Page_id
+                    WHERE pp.status = 7
+                    """
+                )
+
+        if request.tag is not None:
+            with sql_timer("bulk_tag_update"):
+                cursor.execute(
+                    """
+                    UPDATE p
+                    SET TagId = ?, TagName = ?
+                    OUTPUT inserted.Id INTO #bulkUpdated (PageInternalId)
+                    FROM pages p
+                    INNER JOIN #bulkPages b ON b.Page_id = p.Page_id
+                    """,
+                    (request.tag.tagId, request.tag.tagName)
+                )
+
+        if request.notes is not None:
+            with sql_timer("bulk_notes_update"):
+                cursor.execute(
+                    """
+                    UPDATE pp
+                    SET pp.page_notes = ?
+                    OUTPUT inserted.pageId INTO #bulkUpdated (PageInternalId)
+                    FROM pagesProducts pp
+                    INNER JOIN pages p ON pp.pageId = p.Id
+                    INNER JOIN #bulkPages b ON b.Page_id = p.Page_id
+                    """,
+                    (request.notes,)
+                )
+
+        cursor.execute("SELECT DISTINCT PageInternalId FROM #bulkUpdated")
+        updated = {found[row[0]] for row in cursor.fetchall() if row[0] in found}
+
+        cursor.execute("DROP TABLE #bulkPages")
+        cursor.execute("DROP TABLE #bulkUpdated")
+        db.commit()
+    except Exception as e:
+        db.rollback()
+        raise HTTPException(status_code=500, detail=f"Failed to apply bulk update: {e}")
+
+    tabs = old_tabs | new_tabs if new_tabs else set()
+    tag_names = old_tag_names | {request.tag.tagName} if request.tag is not None else set()
+    invalidate_pages_cache(page_ids=updated, tabs=tabs, tag_names=tag_names)
+
+    existing = set(found.values())
+    results = [
+        BulkPageResult(
+            page_id=p,
+            outcome="updated" if p in updated else "unchanged" if p in existing else "not_found",
+        )
+        for p in page_ids
+    ]
+    return BulkPagesResponse(
+        updated=len(updated),
+        unchanged=len(existing - updated),
+        not_found=len(page_ids) - len(existing),
+        results=results,
+    )
+
 
 # --- Ad Groups Analysis ---
 
 @app.post("/api/pages/{page_id}/analyze-groups", status_code=202)
 async def trigger_ad_group_analysis(
     page_id: str,
-    background_tasks: BackgroundTasks,
+    mode: str = Query("auto", pattern="^(auto|full|incremental)$"),
+    cluster: Optional[bool] = Query(None, description="Merge near-duplicate bodies; default AD_GROUP_CLUSTERING"),
     current_user: UserInDB = Depends(get_current_active_user)
 ):
     """
-    Dispara el análisis de grupos de anuncios para la página dada.
-    Escribe __ANALYZING__ en la BD de forma síncrona y luego lanza el proceso en background.
+    Encola el análisis de grupos de anuncios para la página dada.
+    mode: 'auto' (incremental si hay un análisis previo reciente), 'full' o 'incremental'.
+    cluster: une en un grupo los cuerpos casi iguales (ver clustering.py).
+    Si la página ya tiene un análisis en cola o en curso, devuelve ese mismo job.
     """
-    from meta_service import analyze_and_save_page_groups, set_analyzing_marker
-    # Escribir marcador de forma síncrona para que el frontend lo vea de inmediato
-    set_analyzing_marker(page_id)
-    background_tasks.add_task(analyze_and_save_page_groups, page_id)
-    return {"message": "Analysis started", "page_id": page_id}
+    try:
+        job, created = analysis_scheduler.submit(page_id, mode=mode, cluster=cluster)
+    except QueueFullError as e:
+        raise HTTPException(status_code=503, detail=str(e), headers={"Retry-After": "30"})
+    message = "Analysis started" if created else f"Analysis already {job.state}"
+    return {"message": message, "page_id": page_id, "job": job.to_dict()}
+
 
+ANALYSIS_BATCH_MAX_PAGES = int(os.environ.get("ANALYSIS_BATCH_MAX_PAGES", "500"))
+
+class PageFilter(BaseModel):
+    """Same filters as GET /api/pages; the pages are taken in its order (eu_total_reach desc)."""
+    status: str = "unprocessed"
+    searchTerm: Optional[str] = None
+    country: Optional[str] = None
+    category: Optional[str] = None
+    tag: Optional[str] = None
+    action_date: Optional[str] = None
+    min_reach: int = 200000
+    limit: int = 100
+
+class BatchAnalysisRequest(BaseModel):
+    page_ids: Optional[List[str]] = None
+    filter: Optional[PageFilter] = None
+    mode: str = "auto"
+    cluster: Optional[bool] = None
+    concurrency: int = 0  # jobs of this batch queued/running at once, 0 = ANALYSIS_BATCH_CONCURRENCY
+
+@app.post("/api/analysis/batches", status_code=202)
+async def start_analysis_batch(
+    request: BatchAnalysisRequest,
+    current_user: UserInDB = Depends(get_current_active_user)
+):
+    """
+    Analiza muchas páginas: una lista de page_ids o las primeras `limit` páginas de un filtro de /api/pages.
+    Usa la misma cola, workers, cliente HTTP y tokens que los análisis individuales; las páginas que ya
+    se están analizando se saltean. El progreso se consulta en GET /api/analysis/batches/{batch_id}.
+    """
+    if (request.page_ids is None) == (request.filter is None):
+        raise HTTPException(status_code=400, detail="Give either page_ids or filter")
+    if request.mode not in ("auto", "full", "incremental"):
+        raise HTTPException(status_code=400, detail="mode must be 'auto', 'full' or 'incremental'")
+    if request.concurrency < 0:
+        raise HTTPException(status_code=400, detail="concurrency must be >= 0")
+
+    if request.page_ids is not None:
+        page_ids = [p for p in request.page_ids if p]
+    else:
+        f = request.filter
+        if not 1 <= f.limit <= ANALYSIS_BATCH_MAX_PAGES or f.min_reach < 0:
+            raise HTTPException(status_code=400, detail=f"filter.limit must be 1-{ANALYSIS_BATCH_MAX_PAGES} and min_reach >= 0")
+        tab, searchTerm, country, category, tag = normalize_page_filters(f.status, f.searchTerm, f.country, f.category, f.tag)
+        try:
+            rows, _ = await run_db(
+                query_pages, tab, searchTerm, country, category, tag, f.action_date or None, f.min_reach, f.limit, 0, None
+            )
+        except Exception as e:
+            print(f"Error selecting pages for analysis batch: {e}")
+            raise HTTPException(status_code=500, detail=str(e))
+        page_ids = [row["page_id"] for row in rows]
+
+    if not page_ids:
+        raise HTTPException(status_code=400, detail="No pages to analyse")
+    if len(page_ids) > ANALYSIS_BATCH_MAX_PAGES:
+        raise HTTPException(status_code=400, detail=f"At most {ANALYSIS_BATCH_MAX_PAGES} pages per batch")
+
+    batch = analysis_scheduler.submit_batch(
+        page_ids, concurrency=request.concurrency, mode=request.mode, cluster=request.cluster
+    )
+    return batch.to_dict(pages=False)
+
+
+@app.get("/api/analysis/batches")
+def list_analysis_batches(
+    current_user: UserInDB = Depends(get_current_active_user)
+):
+    """Lotes en curso y los últimos terminados (solo totales)."""
+    return [batch.to_dict(pages=False) for batch in analysis_scheduler.list_batches()]
+
+
+@app.get("/api/analysis/batches/{batch_id}")
+def get_analysis_batch(
+    batch_id: str,
+    current_user: UserInDB = Depends(get_current_active_user)
+):
+    """Progreso del lote: estado de cada página, páginas por minuto y anuncios por segundo."""
+    batch = analysis_scheduler.get_batch(batch_id)
+    if batch is None:
+        raise HTTPException(status_code=404, detail="Analysis batch not found")
+    return batch.to_dict()
+
+
+@app.get("/api/pages/{page_id}/analysis-job")
+def get_analysis_job(
+    page_id: str,
+    current_user: UserInDB = Depends(get_current_active_user)
+):
+    """Estado del último análisis de la página en este worker (queued, running, done, failed) con tiempos."""
+    job = analysis_scheduler.get(page_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="No analysis job for this page")
+    return job.to_dict()
+
+
+@app.get("/api/analysis/jobs")
+def list_analysis_jobs(
+    current_user: UserInDB = Depends(get_current_active_user)
+):
+    """Jobs activos y los últimos terminados, más contadores del scheduler."""
+    return {
+        "stats": analysis_scheduler.stats(),
+        "jobs": [job.to_dict() for job in analysis_scheduler.list_jobs()],
+    }
+
+
+# entity-tag = [ W/ ] DQUOTE *etagc DQUOTE; etagc may include commas, so tags are matched, not split
+ENTITY_TAG_RE = re.compile(r'(?:W/)?"([^"]*)"')
+
+def parse_if_none_match(header: Optional[str]) -> tuple[bool, List[str]]:
+    """
+    (matches any, content hashes) of an If-None-Match header (RFC 9110 §13.1.2): "*" matches any
+    current representation; otherwise every listed entity tag is compared weakly (W/ ignored),
+    without quotes or the -gzip encoding suffix.
+    """
+    if not header:
+        return False, []
+    if header.strip() == "*":
+        return True, []
+    hashes = []
+    for tag in ENTITY_TAG_RE.findall(header):
+        if tag.endswith("-gzip"):
+            # Same content as the identity representation, only the transfer encoding differs
+            tag = tag[:-len("-gzip")]
+        if tag:
+            hashes.append(tag)
+    return False, hashes
+
+def accepts_gzip(accept_encoding: Optional[str]) -> bool:
+    """True if the Accept-Encoding header allows gzip (q > 0)."""
+    for part in (accept_encoding or "").split(","):
+        name, _, params = part.strip().partition(";")
+        if name.strip().lower() in ("gzip", "*"):
+            q = params.strip()
+            if q.startswith("q="):
+                try:
+                    return float(q[2:]) > 0
+                except ValueError:
+                    return False
+            return True
+    return False
+
+def last_analysis_job(page_id: str) -> Optional[dict]:
+    """State of the page's latest analysis job in this worker's scheduler (None if it has none)."""
+    job = analysis_scheduler.get(page_id)
+    if job is None:
+        return None
+    return {"state": job.state, "error": job.error, "finished_at": job.finished_at}
+
+def analysis_job_headers(last_job: Optional[dict]) -> dict:
+    # The stored body is served as is, so the latest job's outcome travels in headers
+    if last_job is None:
+        return {}
+    headers = {"X-Analysis-Job-State": last_job["state"]}
+    if last_job["error"]:
+        error = " ".join(last_job["error"].split())[:200]
+        headers["X-Analysis-Job-Error"] = error.encode("ascii", "backslashreplace").decode("ascii")
+    return headers
 
 @app.get("/api/pages/{page_id}/ad-groups")
 def get_ad_groups(
     page_id: str,
+    request: Request,
     db: pyodbc.Connection = Depends(get_db),
     current_user: UserInDB = Depends(get_current_active_user)
 ):
     """
     Retorna los grupos de anuncios calculados para la página dada.
     Si aún no se analizó, retorna status='not_requested'.
-    Si está procesando (AdGroupsJson es NULL pero fue solicitado), retorna status='processing'.
+    Si hay un job en cola o en curso para la página, retorna status='processing'.
     Si tiene datos, retorna status='done' con la lista de grupos.
+
+    El cuerpo completo de la respuesta está guardado comprimido (gzip) en pageAdGroups: si el
+    cliente acepta gzip se envían esos bytes tal cual con Content-Encoding: gzip; si no, se
+    descomprimen. El ETag es el SHA-256 del cuerpo sin comprimir (con sufijo -gzip en la variante
+    comprimida) y si coincide con alguno de los ETags de If-None-Match (comparación débil, o "*")
+    se responde 304 sin leer el blob de la BD.
+    Las páginas analizadas antes de pageAdGroups se leen de pages.AdGroupsJson.
+
+    El último job de análisis de la página (estado, error, fin) va en `last_job` en las respuestas
+    sin grupos y en los headers X-Analysis-Job-State / X-Analysis-Job-Error en las demás, para
+    distinguir un análisis que falló de uno que nunca se pidió. Sale del historial del scheduler
+    de este worker (ANALYSIS_JOB_HISTORY).
     """
+    last_job = last_analysis_job(page_id)
+    if analysis_scheduler.is_active(page_id):
+        return {"status": "processing", "groups": None, "last_job": last_job}
+
     try:
-        import json as json_lib
+        match_any, client_hashes = parse_if_none_match(request.headers.get("if-none-match"))
+        client_hashes_json = json_dumps_str(client_hashes)
         cursor = db.cursor()
-        cursor.execute(
-            "SELECT AdGroupsJson FROM pages WHERE Page_id = ?",
-            page_id
-        )
+        # The blob is only read when neither "*" nor any listed tag matches the stored analysis
+        with sql_timer("ad_groups_get"):
+            cursor.execute(
+                """
+                SELECT
+                    COALESCE(CONVERT(VARCHAR(64), g.ContentHash, 2), h.content_hash) AS content_hash,
+                    CASE WHEN g.Page_id IS NULL AND p.AdGroupsJson = N'__ANALYZING__' THEN 1 ELSE 0 END AS is_analyzing,
+                    g.Encoding,
+                    CASE WHEN ? = 1 OR CONVERT(VARCHAR(64), g.ContentHash, 2) IN (SELECT value FROM OPENJSON(?))
+                         THEN NULL ELSE g.Body END AS body,
+                    CASE WHEN g.Page_id IS NULL
+                          AND NOT (? = 1 OR h.content_hash IN (SELECT value FROM OPENJSON(?)))
+                         THEN p.AdGroupsJson END AS legacy_json
+                FROM pages p
+                LEFT JOIN pageAdGroups g ON g.Page_id = p.Page_id
+                CROSS APPLY (
+                    SELECT CASE WHEN g.Page_id IS NULL
+                                THEN CONVERT(VARCHAR(64), HASHBYTES('SHA2_256', p.AdGroupsJson), 2) END AS content_hash
+                ) h
+                WHERE p.Page_id = ?
+                """,
+                (int(match_any), client_hashes_json, int(match_any), client_hashes_json, page_id)
+            )
         row = cursor.fetchone()
         if not row:
             raise HTTPException(status_code=404, detail="Page not found")
 
-        ad_groups_json = row[0]
-        if ad_groups_json is None:
-            return {"status": "not_requested", "groups": None}
+        content_hash, is_analyzing, encoding, body, legacy_json = row[0], row[1], row[2], row[3], row[4]
+        if content_hash is None:
+            return {"status": "not_requested", "groups": None, "last_job": last_job}
 
-        if ad_groups_json == "__ANALYZING__":
-            return {"status": "processing", "groups": None}
+        if is_analyzing:
+            # Leftover __ANALYZING__ marker from before the job scheduler: nothing is running
+            return {"status": "not_requested", "groups": None, "last_job": last_job}
 
-        groups = json_lib.loads(ad_groups_json)
-        return {"status": "done", "groups": groups}
+        gzip_ok = encoding is not None and accepts_gzip(request.headers.get("accept-encoding"))
+        etag = f'"{content_hash}-gzip"' if gzip_ok else f'"{content_hash}"'
+        headers = {"ETag": etag, "Cache-Control": "private, no-cache", "Vary": "Accept-Encoding",
+                   **analysis_job_headers(last_job)}
+        if body is None and legacy_json is None:
+            # Hash matched If-None-Match: the client already has this analysis
+            return Response(status_code=304, headers=headers)
+
+        if body is not None:
+            body = bytes(body)
+            if gzip_ok and encoding == GZIP:
+                headers["Content-Encoding"] = "gzip"
+            else:
+                body = decode_body(encoding, body)
+        else:
+            body = response_body(legacy_json)
+        return Response(content=body, media_type="application/json", headers=headers)
 
     except HTTPException:
         raise
@@ -701,11 +1501,9 @@ def bulk_clear_ad_groups(
     db: pyodbc.Connection = Depends(get_db),
     current_user: UserInDB = Depends(get_current_active_user)
 ):
-    """Limpia el AdGroupsJson de TODAS las páginas que hayan sido analizadas."""
+    """Limpia el análisis de grupos (pageAdGroups y AdGroupsJson) de TODAS las páginas analizadas."""
     try:
-        cursor = db.cursor()
-        cursor.execute("UPDATE pages SET AdGroupsJson = NULL WHERE AdGroupsJson IS NOT NULL")
-        db.commit()
+        clear_analysis(db)
         return {"message": "All ad group analyses cleared"}
     except Exception as e:
         db.rollback()
@@ -718,11 +1516,9 @@ def clear_page_ad_groups(
     db: pyodbc.Connection = Depends(get_db),
     current_user: UserInDB = Depends(get_current_active_user)
 ):
-    """Limpia el AdGroupsJson de una página específica."""
+    """Limpia el análisis de grupos (pageAdGroups y AdGroupsJson) de una página específica."""
     try:
-        cursor = db.cursor()
-        cursor.execute("UPDATE pages SET AdGroupsJson = NULL WHERE Page_id = ?", page_id)
-        db.commit()
+        clear_analysis(db, page_id)
         return {"message": f"Ad group analysis for page {page_id} cleared"}
     except Exception as e:
         db.rollback()
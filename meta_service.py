@@ -3,9 +3,33 @@ meta_service.py
 Lógica para llamar a la API de Anuncios de Meta, paginar y agrupar los anuncios por cuerpo creativo.
 """
 
+import asyncio
 import httpx
-import json
-from database import get_db_connection
+import os
+import time
+from collections import OrderedDict
+from typing import AsyncIterator, Optional
+from database import main_pool, pooled_connection, run_db
+import clustering
+import columnar
+from ad_groups_store import load_analysis, save_analysis
+from fast_json import dumps as json_dumps, loads as json_loads
+from metrics import ANALYSIS_ADS, ANALYSIS_ADS_PER_SECOND, META_API_REQUEST_DURATION, META_API_RETRIES
+from token_pool import AccessTokenPool, NoTokenAvailableError, AUTH_ERROR, THROTTLED
+
+# Shared Graph API client settings (one client per worker, see start_meta_http_client)
+META_HTTP2 = os.environ.get("META_HTTP2", "1") == "1"
+META_HTTP_MAX_CONNECTIONS = int(os.environ.get("META_HTTP_MAX_CONNECTIONS", "20"))
+META_HTTP_MAX_KEEPALIVE = int(os.environ.get("META_HTTP_MAX_KEEPALIVE", "10"))
+META_HTTP_KEEPALIVE_EXPIRY = float(os.environ.get("META_HTTP_KEEPALIVE_EXPIRY", "60"))
+META_HTTP_CONNECT_TIMEOUT = float(os.environ.get("META_HTTP_CONNECT_TIMEOUT", "10"))
+META_HTTP_READ_TIMEOUT = float(os.environ.get("META_HTTP_READ_TIMEOUT", "120"))
+META_HTTP_WRITE_TIMEOUT = float(os.environ.get("META_HTTP_WRITE_TIMEOUT", "30"))
+META_HTTP_POOL_TIMEOUT = float(os.environ.get("META_HTTP_POOL_TIMEOUT", "30"))
+
+_meta_http_client: Optional[httpx.AsyncClient] = None
+_meta_http2_enabled = False
+_meta_http_stats = {"requests": 0, "new_connections": 0, "errors": 0, "latency_total": 0.0, "latency_max": 0.0}
 
 
 def get_backend_db_connection():
@@ -24,313 +48,812 @@ def get_backend_db_connection():
     return pyodbc.connect(conn_str)
 
 
-def get_available_access_token():
-    """Obtiene un token de acceso disponible de la BD 'backend'."""
+def load_ready_access_tokens() -> list:
+    """Lista (Id, accessToken) de los tokens con status='READY' de la BD 'backend' (bloqueante)."""
     conn = get_backend_db_connection()
     try:
         cursor = conn.cursor()
         cursor.execute("""
-            SELECT TOP 1 accessToken 
+            SELECT Id, accessToken 
             FROM accessTokens 
             WHERE status = 'READY'
             ORDER BY Id ASC
         """)
-        row = cursor.fetchone()
-        if row:
-            return row[0]
-        print("[meta_service] No tokens found with status='READY' in 'backend' DB")
-        return None
-    except Exception as e:
-        print(f"[meta_service] Error querying accessTokens: {e}")
-        return None
+        return [(row[0], row[1]) for row in cursor.fetchall()]
     finally:
         conn.close()
 
 
-def set_analyzing_marker(page_id: str):
-    """Escribe el marcador __ANALYZING__ en la BD para la page dada."""
-    conn = get_db_connection()
-    try:
-        cursor = conn.cursor()
-        cursor.execute("UPDATE pages SET AdGroupsJson = '__ANALYZING__' WHERE Page_id = ?", page_id)
-        conn.commit()
-        print(f"[meta_service] Set ANALYZING marker for page {page_id}")
-    except Exception as e:
-        print(f"[meta_service] Could not set ANALYZING marker: {e}")
-    finally:
-        conn.close()
+# Tokens are refreshed in the background and spread across requests (see token_pool.py)
+meta_token_pool = AccessTokenPool(loader=load_ready_access_tokens)
+
+# Retries of one Graph API request with another token after a throttle/auth error
+META_TOKEN_RETRIES = int(os.environ.get("META_TOKEN_RETRIES", "5"))
+
+# Page size (`limit`) of the ads_archive pagination, see PageSizeController
+META_PAGE_LIMIT_START = int(os.environ.get("META_PAGE_LIMIT_START", "500"))
+META_PAGE_LIMIT_MIN = int(os.environ.get("META_PAGE_LIMIT_MIN", "10"))
+META_PAGE_LIMIT_MAX = int(os.environ.get("META_PAGE_LIMIT_MAX", "500"))
+META_PAGE_LIMIT_STEP = int(os.environ.get("META_PAGE_LIMIT_STEP", "50"))
+META_PAGE_LIMIT_GROW_AFTER = int(os.environ.get("META_PAGE_LIMIT_GROW_AFTER", "3"))  # successes before growing
+META_PAGE_LIMIT_MEMORY = int(os.environ.get("META_PAGE_LIMIT_MEMORY", "5000"))  # pages whose best limit is kept
+
+# Request the next ads_archive page while the current one is decoded (worker thread) and aggregated
+META_FETCH_PIPELINE = os.environ.get("META_FETCH_PIPELINE", "1") == "1"
+
+# Only the fields the aggregators read
+AD_FIELDS = "ad_snapshot_url,eu_total_reach,ad_creative_bodies,ad_delivery_start_time,ad_delivery_stop_time,target_locations"
+
+# mode='auto' re-analyses incrementally, but does a full scrape again once the last one is this old
+ANALYSIS_FULL_REFRESH_DAYS = int(os.environ.get("ANALYSIS_FULL_REFRESH_DAYS", "30"))
+ANALYSIS_MODES = ("auto", "full", "incremental")
+
+
+def save_page_groups(page_id: str, groups_json: bytes):
+    """Guarda el JSON del análisis comprimido en pageAdGroups (bloqueante: llamar vía run_db)."""
+    with pooled_connection(main_pool) as conn:
+        try:
+            save_analysis(conn, page_id, groups_json)
+        except Exception:
+            conn.rollback()
+            raise
+
+
+def load_page_groups(page_id: str) -> Optional[dict]:
+    """Último análisis guardado de la página (dict) o None si no hay (bloqueante: llamar vía run_db)."""
+    with pooled_connection(main_pool) as conn:
+        return load_analysis(conn, page_id)
 
 
-def clear_analyzing_marker(page_id: str):
-    """Limpia el marcador __ANALYZING__ si el proceso falla."""
-    conn = get_db_connection()
+def start_meta_http_client() -> httpx.AsyncClient:
+    """Crea el cliente HTTP compartido (HTTP/2, keep-alive) para la Graph API. Se llama en el startup."""
+    global _meta_http_client, _meta_http2_enabled
+    if _meta_http_client is not None:
+        return _meta_http_client
+
+    http2 = META_HTTP2
+    if http2:
+        try:
+            import h2  # noqa: F401  (httpx needs it for HTTP/2)
+        except ImportError:
+            print("[meta_service] 'h2' is not installed, falling back to HTTP/1.1 for the Graph API client")
+            http2 = False
+    _meta_http2_enabled = http2
+
+    _meta_http_client = httpx.AsyncClient(
+        http2=http2,
+        limits=httpx.Limits(
+            max_connections=META_HTTP_MAX_CONNECTIONS,
+            max_keepalive_connections=META_HTTP_MAX_KEEPALIVE,
+            keepalive_expiry=META_HTTP_KEEPALIVE_EXPIRY,
+        ),
+        timeout=httpx.Timeout(
+            connect=META_HTTP_CONNECT_TIMEOUT,
+            read=META_HTTP_READ_TIMEOUT,
+            write=META_HTTP_WRITE_TIMEOUT,
+            pool=META_HTTP_POOL_TIMEOUT,
+        ),
+    )
+    return _meta_http_client
+
+
+async def close_meta_http_client():
+    global _meta_http_client
+    if _meta_http_client is not None:
+        client, _meta_http_client = _meta_http_client, None
+        await client.aclose()
+
+
+def get_meta_http_client() -> httpx.AsyncClient:
+    """Cliente compartido; se crea bajo demanda si el startup no lo hizo (scripts, tests)."""
+    return _meta_http_client or start_meta_http_client()
+
+
+async def _trace_connections(event_name: str, info: dict):
+    # httpcore trace hook: a TCP connect means the request could not reuse a pooled connection
+    if event_name == "connection.connect_tcp.complete":
+        _meta_http_stats["new_connections"] += 1
+
+
+async def meta_get(client: httpx.AsyncClient, url: str) -> httpx.Response:
+    """GET a la Graph API registrando latencia y reutilización de conexiones."""
+    started = time.monotonic()
+    status = "error"
     try:
-        cursor = conn.cursor()
-        cursor.execute("UPDATE pages SET AdGroupsJson = NULL WHERE Page_id = ? AND AdGroupsJson = '__ANALYZING__'", page_id)
-        conn.commit()
+        response = await client.get(url, extensions={"trace": _trace_connections})
+        status = str(response.status_code)
+        return response
     except Exception:
-        pass
+        _meta_http_stats["errors"] += 1
+        raise
     finally:
-        conn.close()
+        elapsed = time.monotonic() - started
+        META_API_REQUEST_DURATION.observe(elapsed, status)
+        _meta_http_stats["requests"] += 1
+        _meta_http_stats["latency_total"] += elapsed
+        _meta_http_stats["latency_max"] = max(_meta_http_stats["latency_max"], elapsed)
+
+
+def get_meta_http_stats() -> dict:
+    requests = _meta_http_stats["requests"]
+    new_connections = _meta_http_stats["new_connections"]
+    return {
+        "http2": _meta_http2_enabled,
+        "requests": requests,
+        "errors": _meta_http_stats["errors"],
+        "new_connections": new_connections,
+        "connection_reuse_ratio": round(1 - new_connections / requests, 4) if requests else 0.0,
+        "avg_latency_ms": round(_meta_http_stats["latency_total"] / requests * 1000, 3) if requests else 0.0,
+        "max_latency_ms": round(_meta_http_stats["latency_max"] * 1000, 3),
+        "page_size": page_size_controller.stats(),
+    }
+
+
+class PageSizeSession:
+    """
+    Límite de paginación de un scrape (AIMD): se reduce a la mitad con el error 1 de Meta
+    ("reduce the amount of data") y crece de a `step` tras `grow_after` respuestas correctas.
+    """
+
+    def __init__(self, controller: "PageSizeController", page_id: str, start: int):
+        self.controller = controller
+        self.page_id = page_id
+        self.limit = start
+        self.start = start
+        self.requests = 0
+        self.retries = 0
+        self.min_limit = start
+        self.max_limit = start
+        self._streak = 0
+        self._failed_at: Optional[int] = None  # smallest limit rejected with error 1 in this run
+        self._best_ok = 0  # largest limit that worked below _failed_at
+
+    def on_success(self):
+        c = self.controller
+        self.requests += 1
+        if self._failed_at is None or self.limit < self._failed_at:
+            self._best_ok = max(self._best_ok, self.limit)
+        self._streak += 1
+        # Within one run never grow back to a limit Meta already rejected
+        ceiling = c.max_limit if self._failed_at is None else min(c.max_limit, self._failed_at - 1)
+        if self._streak >= c.grow_after and self.limit < ceiling:
+            self._streak = 0
+            self.limit = min(self.limit + c.step, ceiling)
+            self.max_limit = max(self.max_limit, self.limit)
+            c._increases += 1
+
+    def on_too_large(self) -> bool:
+        """Registra un error 1. Devuelve False si ya no se puede reducir más (no reintentar)."""
+        c = self.controller
+        self.requests += 1
+        self._streak = 0
+        self._failed_at = self.limit if self._failed_at is None else min(self._failed_at, self.limit)
+        if self._best_ok >= self._failed_at:
+            self._best_ok = 0
+        if self.limit <= c.min_limit:
+            return False
+        self.limit = max(self.limit // 2, c.min_limit)
+        self.min_limit = min(self.min_limit, self.limit)
+        self.retries += 1
+        c._retries += 1
+        return True
+
+    def finish(self):
+        self.controller._remember(self.page_id, self._best_ok)
+
+    def summary(self) -> dict:
+        return {
+            "start_limit": self.start,
+            "final_limit": self.limit,
+            "min_limit": self.min_limit,
+            "max_limit": self.max_limit,
+            "requests": self.requests,
+            "retries": self.retries,
+        }
 
 
-async def fetch_all_page_ads(page_id: str, access_token: str) -> list:
+class PageSizeController:
     """
-    Llama a la Meta Ads Library API paginando hasta obtener todos los anuncios
-    de la página dada. Retorna una lista de dicts con los campos básicos.
-    Limita a 2.000.000 de eu_total_reach acumulado para no tardar demasiado.
+    Recuerda (en memoria, por worker) el mayor `limit` que funcionó para cada página,
+    así el siguiente scrape empieza ahí en lugar de volver a chocar con el error 1.
     """
-    fields = "ad_snapshot_url,eu_total_reach,ad_creative_bodies,ad_delivery_start_time,ad_delivery_stop_time,status,target_locations"
-    limit = 500
-    base_url = (
-        f"https://graph.facebook.com/v24.0/ads_archive"
-        f"?ad_reached_countries=['']"
-        f"&search_page_ids={page_id}"
-        f"&fields={fields}"
-        f"&access_token={access_token}"
-        f"&limit={limit}"
-        f"&locale=en_US"
-    )
 
-    all_ads = []
-    total_reach = 0
-    current_limit = 500
-    
-    # We build the base URL without the limit first to handle retries easily
-    api_base = (
-        f"https://graph.facebook.com/v24.0/ads_archive"
-        f"?ad_reached_countries=['']"
-        f"&search_page_ids={page_id}"
-        f"&fields={fields}"
-        f"&access_token={access_token}"
-        f"&locale=en_US"
-    )
-    
-    next_url = f"{api_base}&limit={current_limit}"
+    def __init__(
+        self,
+        start: int = META_PAGE_LIMIT_START,
+        min_limit: int = META_PAGE_LIMIT_MIN,
+        max_limit: int = META_PAGE_LIMIT_MAX,
+        step: int = META_PAGE_LIMIT_STEP,
+        grow_after: int = META_PAGE_LIMIT_GROW_AFTER,
+        memory: int = META_PAGE_LIMIT_MEMORY,
+    ):
+        self.min_limit = max(1, min_limit)
+        self.max_limit = max(self.min_limit, max_limit)
+        self.start = min(max(start, self.min_limit), self.max_limit)
+        self.step = max(1, step)
+        self.grow_after = max(1, grow_after)
+        self.memory = max(0, memory)
+        self._best: OrderedDict[str, int] = OrderedDict()
+        self._runs = 0
+        self._remembered_starts = 0
+        self._retries = 0
+        self._increases = 0
+
+    def session(self, page_id: str) -> PageSizeSession:
+        self._runs += 1
+        start = self._best.get(page_id)
+        if start is not None:
+            self._best.move_to_end(page_id)
+            self._remembered_starts += 1
+        return PageSizeSession(self, page_id, start or self.start)
+
+    def _remember(self, page_id: str, limit: int):
+        if not limit or not self.memory:
+            return
+        self._best[page_id] = limit
+        self._best.move_to_end(page_id)
+        while len(self._best) > self.memory:
+            self._best.popitem(last=False)
+
+    def stats(self) -> dict:
+        return {
+            "runs": self._runs,
+            "remembered_pages": len(self._best),
+            "remembered_starts": self._remembered_starts,
+            "retries": self._retries,
+            "increases": self._increases,
+            "start_limit": self.start,
+            "min_limit": self.min_limit,
+            "max_limit": self.max_limit,
+        }
+
+
+page_size_controller = PageSizeController()
+
+
+class IncompleteFetchError(Exception):
+    """Raised when the ads_archive pagination stops before its last page (the ads fetched so far are partial)."""
+
+
+def graph_error(response: httpx.Response) -> dict:
+    """Objeto `error` de una respuesta fallida de la Graph API ({} si no hay)."""
+    if response.status_code < 400:
+        return {}
+    try:
+        return json_loads(response.content).get("error") or {}
+    except ValueError:
+        return {}
+
+
+_PAGING_KEY = b'"paging":'
+
+
+def paging_next_url(body: bytes) -> Optional[str]:
+    """
+    paging.next de una respuesta de ads_archive sin decodificar `data`: la Graph API manda
+    `paging` después de `data`, así que alcanza con parsear el final del cuerpo.
+    Dentro de los textos las comillas van escapadas, por lo que '"paging":' no aparece en `data`.
+    """
+    start = body.rfind(_PAGING_KEY)
+    if start == -1:
+        return None
+    try:
+        paging = json_loads(b"{" + body[start:])["paging"]
+    except (ValueError, KeyError, TypeError):
+        # Unexpected layout: decode the whole body
+        paging = json_loads(body).get("paging")
+    return paging.get("next") if isinstance(paging, dict) else None
+
 
-    async with httpx.AsyncClient(timeout=120.0) as client:
-        while next_url:
+def decode_ads(body: bytes) -> list:
+    return json_loads(body).get("data") or []
+
+
+async def _fetch_ads_page(
+    client: httpx.AsyncClient,
+    page_id: str,
+    url: httpx.URL,
+    access_token: Optional[str],
+    page_size: PageSizeSession,
+) -> httpx.Response:
+    """
+    Un request de ads_archive con sus reintentos (token limitado o rechazado, error 1).
+    Devuelve la respuesta correcta; si no se pudo obtener lanza IncompleteFetchError,
+    porque cortar la paginación dejaría el análisis incompleto.
+    """
+    token_retries = 0
+    while True:
+        try:
+            lease = None
+            if access_token:
+                token = access_token
+            else:
+                lease = await meta_token_pool.acquire()
+                token = lease.token
+            # paging.next already carries limit/access_token: override both for this request
+            request_url = url.copy_merge_params({"limit": page_size.limit, "access_token": token})
             try:
-                response = await client.get(next_url)
-                
-                # Handle "Reduce the amount of data" error (Code 1)
-                if response.status_code == 400:
-                    err_data = response.json().get("error", {})
-                    if err_data.get("code") == 1:
-                        if current_limit > 10:
-                            current_limit = current_limit // 2
-                            print(f"[meta_service] Meta API 'Reduce data' error. Retrying page {page_id} with limit={current_limit}")
-                            
-                            # Replace limit in next_url or rebuild it if it was the initial one
-                            import re
-                            next_url = re.sub(r'limit=\d+', f'limit={current_limit}', next_url)
-                            continue # Retry current request
-                
-                if not response.is_success:
-                    print(f"[meta_service] Error {response.status_code} fetching ads for page {page_id}: {response.text[:300]}")
-                    break
-
-                data = response.json()
-                ads = data.get("data", [])
-                all_ads.extend(ads)
+                response = await meta_get(client, str(request_url))
+                err_data = graph_error(response)
+                if lease is not None:
+                    outcome = meta_token_pool.report(lease, response.headers, err_data)
+            finally:
+                if lease is not None:
+                    meta_token_pool.release(lease)
+
+            # Throttled or rejected token: same request with another token from the pool
+            if lease is not None and outcome in (THROTTLED, AUTH_ERROR) and token_retries < META_TOKEN_RETRIES:
+                token_retries += 1
+                META_API_RETRIES.inc("token")
+                continue
+            token_retries = 0
 
-                for ad in ads:
-                    total_reach += ad.get("eu_total_reach", 0)
+            # Handle "Reduce the amount of data" error (Code 1)
+            if response.status_code == 400 and err_data.get("code") == 1:
+                if page_size.on_too_large():
+                    META_API_RETRIES.inc("reduce_data")
+                    print(f"[meta_service] Meta API 'Reduce data' error. Retrying page {page_id} with limit={page_size.limit}")
+                    continue # Retry current request
 
-                # NOTA: Límite de 2M removido para permitir Full Scrape
-                # (Se extraerán todos los anuncios históricos de la página)
+            if not response.is_success:
+                print(f"[meta_service] Error {response.status_code} fetching ads for page {page_id}: {response.text[:300]}")
+                raise IncompleteFetchError(f"Meta API error {response.status_code} fetching ads for page {page_id}")
 
-                next_url = data.get("paging", {}).get("next")
-                # Ensure the next_url also uses our current reduced limit if it evolved
-                if next_url and current_limit < 150:
-                    import re
-                    next_url = re.sub(r'limit=\d+', f'limit={current_limit}', next_url)
+            page_size.on_success()
+            return response
 
-            except Exception as e:
-                print(f"[meta_service] Exception fetching ads for page {page_id}: {e}")
+        except (NoTokenAvailableError, IncompleteFetchError):
+            raise
+        except Exception as e:
+            print(f"[meta_service] Exception fetching ads for page {page_id}: {e}")
+            raise IncompleteFetchError(f"Exception fetching ads for page {page_id}: {e}") from e
+
+
+def _discard(task: Optional[asyncio.Task]):
+    if task is None:
+        return
+    if not task.done():
+        task.cancel()  # releases its token lease
+    elif not task.cancelled():
+        task.exception()  # retrieved, so asyncio does not log it as unhandled
+
+
+async def iter_page_ad_batches(
+    page_id: str,
+    access_token: Optional[str] = None,
+    client: Optional[httpx.AsyncClient] = None,
+    page_size: Optional[PageSizeSession] = None,
+    params: Optional[dict] = None,
+) -> AsyncIterator[list]:
+    """
+    Llama a la Meta Ads Library API paginando hasta obtener todos los anuncios
+    de la página dada. Produce (yield) cada página de resultados de la API como una
+    lista de dicts con los campos básicos, para que el consumidor la agregue y la descarte.
+    Sin access_token, cada request toma un token de meta_token_pool y, si Meta lo limita
+    o lo rechaza, se reintenta con otro.
+    El `limit` de cada request lo decide page_size (por defecto una sesión de page_size_controller).
+    `params` agrega filtros de ads_archive (p. ej. ad_delivery_date_min, ad_active_status).
+    Con META_FETCH_PIPELINE, el request de la página siguiente sale apenas se conoce paging.next,
+    mientras la actual se decodifica (en un thread) y el consumidor la agrega.
+    Si un request falla (después de sus reintentos) o la respuesta no es JSON válido lanza
+    IncompleteFetchError: los lotes ya producidos no son el historial completo.
+    """
+    next_url = httpx.URL(
+        "https://graph.facebook.com/v24.0/ads_archive",
+        params={
+            "ad_reached_countries": "['']",
+            "search_page_ids": page_id,
+            "fields": AD_FIELDS,
+            "locale": "en_US",
+            **(params or {}),
+        },
+    )
+    page_size = page_size or page_size_controller.session(page_id)
+    client = client or get_meta_http_client()
+    prefetch: Optional[asyncio.Task] = None
+    try:
+        response = await _fetch_ads_page(client, page_id, next_url, access_token, page_size)
+        while True:
+            body = response.content
+            del response
+            try:
+                next_page = paging_next_url(body)
+                next_url = httpx.URL(next_page) if next_page else None
+                if next_url is not None and META_FETCH_PIPELINE:
+                    prefetch = asyncio.ensure_future(
+                        _fetch_ads_page(client, page_id, next_url, access_token, page_size)
+                    )
+                    ads = await asyncio.to_thread(decode_ads, body)
+                else:
+                    ads = decode_ads(body)
+            except ValueError as e:
+                print(f"[meta_service] Invalid JSON fetching ads for page {page_id}: {e}")
+                raise IncompleteFetchError(f"Invalid JSON fetching ads for page {page_id}: {e}") from e
+            del body
+
+            # NOTA: Límite de 2M removido para permitir Full Scrape
+            # (Se extraerán todos los anuncios históricos de la página)
+
+            if ads:
+                yield ads
+            del ads
+
+            if next_url is None:
                 break
+            if prefetch is not None:
+                task, prefetch = prefetch, None
+                response = await task
+            else:
+                response = await _fetch_ads_page(client, page_id, next_url, access_token, page_size)
+    finally:
+        _discard(prefetch)
+        page_size.finish()
 
+
+async def fetch_all_page_ads(page_id: str, access_token: Optional[str] = None) -> list:
+    """
+    Descarga todos los anuncios de la página en una sola lista.
+    El análisis usa iter_page_ad_batches + PageAnalysisAggregator para no acumularlos.
+    """
+    all_ads = []
+    async for ads in iter_page_ad_batches(page_id, access_token):
+        all_ads.extend(ads)
     return all_ads
 
 
-def group_ads_by_body(ads: list) -> tuple[list, dict]:
+
+def _ad_countries(ad: dict) -> set:
+    """Países (no excluidos) de target_locations: tipo 'countries' o el país de un 'zips'."""
+    locations = ad.get("target_locations") or []
+    ad_countries = set()
+    for loc in locations:
+        if loc.get("excluded"):
+            continue
+
+        l_type = loc.get("type")
+        l_name = loc.get("name", "")
+
+        if l_type == "countries":
+            ad_countries.add(l_name)
+        elif l_type == "zips":
+            # Extract country name after the comma
+            country = l_name.split(",")[-1].strip() if "," in l_name else l_name
+            if country:
+                ad_countries.add(country)
+        # Skip cities, regions, and others as per user request
+    return ad_countries
+
+
+class AdGroupAggregator:
     """
-    Agrupa los anuncios por su primer `ad_creative_bodies`.
-    Por cada grupo retorna: reach total, si está activo, y lista de links detallados.
-    Ordenado de mayor a menor reach individual dentro del grupo.
-    También retorna un diccionario con estadísticas de países.
+    Agrupa anuncios por su primer `ad_creative_bodies` de forma incremental:
+    cada lote se pliega con add_ads() y puede descartarse después.
+    Resultado idéntico a group_ads_by_body sobre la lista completa.
     """
-    from datetime import datetime
-    from collections import defaultdict
-    
-    groups: dict[str, dict] = {}
-    country_counts = defaultdict(int)
-    now_date = datetime.utcnow().date()
-
-    for ad in ads:
-        bodies = ad.get("ad_creative_bodies") or []
-        key = bodies[0].strip() if bodies else "UNKNOWN"
-
-        if key not in groups:
-            groups[key] = {
-                "body": key,
-                "reach": 0,
-                "is_active": False,
-                "links": []
-            }
-
-        groups[key]["reach"] += ad.get("eu_total_reach", 0)
-        snapshot = ad.get("ad_snapshot_url")
-        
-        # Aggregate country stats from target_locations
-        locations = ad.get("target_locations") or []
-        ad_countries = set()
-        for loc in locations:
-            if loc.get("excluded"):
+
+    def __init__(self, now_date=None):
+        from datetime import datetime
+        from collections import defaultdict
+
+        self.groups: dict[str, dict] = {}
+        self.country_counts = defaultdict(int)
+        self.now_date = now_date or datetime.utcnow().date()
+
+    def add_ads(self, ads: list):
+        from datetime import datetime
+
+        groups = self.groups
+        country_counts = self.country_counts
+        now_date = self.now_date
+
+        # Big batches go through the NumPy engine (same result, see columnar.py)
+        if columnar.enabled_for(len(ads)) and columnar.fold_ad_groups(groups, country_counts, now_date, ads, _ad_countries):
+            return
+
+        for ad in ads:
+            bodies = ad.get("ad_creative_bodies") or []
+            key = bodies[0].strip() if bodies else "UNKNOWN"
+
+            if key not in groups:
+                groups[key] = {
+                    "body": key,
+                    "reach": 0,
+                    "is_active": False,
+                    "links": []
+                }
+
+            groups[key]["reach"] += ad.get("eu_total_reach", 0)
+            snapshot = ad.get("ad_snapshot_url")
+
+            # Aggregate country stats from target_locations
+            ad_countries = _ad_countries(ad)
+            for country in ad_countries:
+                country_counts[country] += 1
+
+            countries_for_ad = list(ad_countries)
+
+            # Meta API logic: ad is active if stop_time is absent, or if it's strictly in the future.
+            stop_time_str = ad.get("ad_delivery_stop_time")
+            is_active = False
+            if not stop_time_str:
+                is_active = True
+            else:
+                try:
+                    stop_date = datetime.strptime(stop_time_str, "%Y-%m-%d").date()
+                    if stop_date > now_date:
+                        is_active = True
+                except ValueError:
+                    pass # Default to inactive if we can't parse
+
+            if is_active:
+                groups[key]["is_active"] = True
+
+            if snapshot:
+                groups[key]["links"].append({
+                    "url": snapshot,
+                    "is_active": is_active,
+                    "reach": ad.get("eu_total_reach", 0),
+                    "start_time": ad.get("ad_delivery_start_time"),
+                    "stop_time": stop_time_str,
+                    "countries": countries_for_ad
+                })
+
+    def result(self) -> tuple[list, dict]:
+        # Sort groups by total reach
+        sorted_groups = sorted(self.groups.values(), key=lambda g: g["reach"], reverse=True)
+
+        # Sort ads within each group by reach descending
+        for group in sorted_groups:
+            group["links"].sort(key=lambda x: x["reach"], reverse=True)
+
+        # Sort country_stats by count descending
+        sorted_countries = sorted(self.country_counts.items(), key=lambda x: x[1], reverse=True)
+        country_stats = {k: v for k, v in sorted_countries}
+
+        return sorted_groups, country_stats
+
+
+class ActivityAggregator:
+    """Cuenta anuncios creados por semana ISO ('YYYY-Www') de forma incremental."""
+
+    def __init__(self):
+        from collections import defaultdict
+
+        self.counts_per_week = defaultdict(int)
+
+    def add_ads(self, ads: list):
+        from datetime import datetime
+
+        counts_per_week = self.counts_per_week
+        if columnar.enabled_for(len(ads)):
+            columnar.fold_activity(counts_per_week, ads)
+            return
+
+        for ad in ads:
+            start_str = ad.get("ad_delivery_start_time")
+            if not start_str:
                 continue
-            
-            l_type = loc.get("type")
-            l_name = loc.get("name", "")
-            
-            if l_type == "countries":
-                ad_countries.add(l_name)
-            elif l_type == "zips":
-                # Extract country name after the comma
-                country = l_name.split(",")[-1].strip() if "," in l_name else l_name
-                if country:
-                    ad_countries.add(country)
-            # Skip cities, regions, and others as per user request
-
-        for country in ad_countries:
-            country_counts[country] += 1
-            
-        countries_for_ad = list(ad_countries)
-
-        # Meta API logic: ad is active if stop_time is absent, or if it's strictly in the future.
-        stop_time_str = ad.get("ad_delivery_stop_time")
-        is_active = False
-        if not stop_time_str:
-            is_active = True
-        else:
+
             try:
-                stop_date = datetime.strptime(stop_time_str, "%Y-%m-%d").date()
-                if stop_date > now_date:
-                    is_active = True
+                # Meta format is generally "YYYY-MM-DD"
+                start_date = datetime.strptime(start_str, "%Y-%m-%d").date()
             except ValueError:
-                pass # Default to inactive if we can't parse
-
-        if is_active:
-            groups[key]["is_active"] = True
-
-        if snapshot:
-            groups[key]["links"].append({
-                "url": snapshot,
-                "is_active": is_active,
-                "reach": ad.get("eu_total_reach", 0),
-                "start_time": ad.get("ad_delivery_start_time"),
-                "stop_time": stop_time_str,
-                "countries": countries_for_ad
-            })
-
-    # Sort groups by total reach
-    sorted_groups = sorted(groups.values(), key=lambda g: g["reach"], reverse=True)
-    
-    # Sort ads within each group by reach descending
-    for group in sorted_groups:
-        group["links"].sort(key=lambda x: x["reach"], reverse=True)
+                continue
 
-    # Sort country_stats by count descending
-    sorted_countries = sorted(country_counts.items(), key=lambda x: x[1], reverse=True)
-    country_stats = {k: v for k, v in sorted_countries}
+            # ISO format e.g. "2023-W41"
+            iso_year, iso_week, _ = start_date.isocalendar()
+            week_key = f"{iso_year}-W{iso_week:02d}"
+            counts_per_week[week_key] += 1
 
-    return sorted_groups, country_stats
+    def result(self) -> list:
+        # Convert to sorted list format
+        sorted_weeks = sorted(self.counts_per_week.keys())
+        return [{"week": w, "active_count": self.counts_per_week[w]} for w in sorted_weeks]
 
 
-def build_activity_graph(ads: list) -> list:
+class PageAnalysisAggregator:
     """
-    Construye un historial de actividad agrupando la cantidad de anuncios creados
-    por semana ('YYYY-Www') basándose en ad_delivery_start_time.
+    Estado completo del análisis de una página (grupos, países, actividad semanal, reach total).
+    La memoria depende del estado agregado, no de la cantidad de lotes ya procesados.
     """
-    from datetime import datetime, timedelta
-    from collections import defaultdict
-    
-    counts_per_week = defaultdict(int)
-    
-    for ad in ads:
-        start_str = ad.get("ad_delivery_start_time")
-        if not start_str:
-            continue
-            
-        try:
-            # Meta format is generally "YYYY-MM-DD"
-            start_date = datetime.strptime(start_str, "%Y-%m-%d").date()
-        except ValueError:
-            continue
-             
-        # ISO format e.g. "2023-W41"
-        iso_year, iso_week, _ = start_date.isocalendar()
-        week_key = f"{iso_year}-W{iso_week:02d}"
-        counts_per_week[week_key] += 1
 
-    # Convert to sorted list format
-    sorted_weeks = sorted(counts_per_week.keys())
-    graph_data = [{"week": w, "active_count": counts_per_week[w]} for w in sorted_weeks]
-    return graph_data
+    def __init__(self, cluster_threshold: Optional[float] = None):
+        self.groups = AdGroupAggregator()
+        self.activity = ActivityAggregator()
+        # None = exact-body groups; a Jaccard threshold merges near-duplicate bodies (clustering.py)
+        self.cluster_threshold = cluster_threshold
+        self.total_reach = 0
+        self.ads_count = 0
+        # Ads without ad_snapshot_url: counted in reach/countries/activity but not kept as links
+        self.linkless_ads = 0
+        self.latest_start_time: Optional[str] = None
+
+    def add_ads(self, ads: list):
+        self.groups.add_ads(ads)
+        self.activity.add_ads(ads)
+        self.ads_count += len(ads)
+        for ad in ads:
+            self.total_reach += ad.get("eu_total_reach", 0)
+            if not ad.get("ad_snapshot_url"):
+                self.linkless_ads += 1
+            start = ad.get("ad_delivery_start_time")
+            # "YYYY-MM-DD" strings compare in date order
+            if start and (self.latest_start_time is None or start > self.latest_start_time):
+                self.latest_start_time = start
+
+    def result(self) -> dict:
+        groups, country_stats = self.groups.result()
+        if self.cluster_threshold is not None:
+            groups = clustering.cluster_groups(groups, self.cluster_threshold)
+        return {
+            "groups": groups,
+            "activity_graph": self.activity.result(),
+            "total_scraped_reach": self.total_reach,
+            "country_stats": country_stats
+        }
 
 
-async def analyze_and_save_page_groups(page_id: str):
+def stored_link_ads(previous: dict, skip_urls: set, today: str) -> list:
     """
-    Proceso completo bajo demanda:
-    1. Obtiene un token de acceso.
-    2. Descarga todos los anuncios de la página.
-    3. Agrupa por cuerpo creativo.
-    4. Guarda el JSON en pages.AdGroupsJson.
+    Reconstruye anuncios (mismos campos que devuelve la API) a partir de los links de un análisis
+    guardado, salteando los que se volvieron a descargar (`skip_urls`). Un link que seguía activo
+    y no volvió a aparecer entre los activos terminó desde el último análisis: se cierra con `today`.
+    Solo vale si `skip_urls` incluye una pasada ACTIVE completa; con today=None los links
+    activos quedan como estaban.
     """
-    try:
-        print(f"[meta_service] Starting ad group analysis for page_id={page_id}")
+    ads = []
+    for group in previous.get("groups") or []:
+        body = group.get("body") or "UNKNOWN"
+        for link in group.get("links") or []:
+            url = link.get("url")
+            if not url or url in skip_urls:
+                continue
+            stop_time = link.get("stop_time")
+            if link.get("is_active") and today:
+                stop_time = today
+            ads.append({
+                "ad_snapshot_url": url,
+                "ad_creative_bodies": [body],
+                "eu_total_reach": link.get("reach", 0),
+                "ad_delivery_start_time": link.get("start_time"),
+                "ad_delivery_stop_time": stop_time,
+                "target_locations": [{"type": "countries", "name": c} for c in link.get("countries") or []],
+            })
+    return ads
 
-        access_token = get_available_access_token()
-        if not access_token:
-            print(f"[meta_service] No access token with status='READY' found. Aborting.")
-            clear_analyzing_marker(page_id)
-            return
 
-        ads = await fetch_all_page_ads(page_id, access_token)
-        print(f"[meta_service] Fetched {len(ads)} ads for page {page_id}")
+def group_ads_by_body(ads: list) -> tuple[list, dict]:
+    """
+    Agrupa los anuncios por su primer `ad_creative_bodies`.
+    Por cada grupo retorna: reach total, si está activo, y lista de links detallados.
+    Ordenado de mayor a menor reach individual dentro del grupo.
+    También retorna un diccionario con estadísticas de países.
+    """
+    aggregator = AdGroupAggregator()
+    aggregator.add_ads(ads)
+    return aggregator.result()
 
-        groups, country_stats = group_ads_by_body(ads)
-        print(f"[meta_service] Grouped into {len(groups)} groups and {len(country_stats)} countries")
-        
-        graph = build_activity_graph(ads)
 
-        total_scraped_reach = sum(g["reach"] for g in groups)
+def build_activity_graph(ads: list) -> list:
+    """
+    Construye un historial de actividad agrupando la cantidad de anuncios creados
+    por semana ('YYYY-Www') basándose en ad_delivery_start_time.
+    """
+    aggregator = ActivityAggregator()
+    aggregator.add_ads(ads)
+    return aggregator.result()
 
-        final_data = {
-             "groups": groups,
-             "activity_graph": graph,
-             "total_scraped_reach": total_scraped_reach,
-             "country_stats": country_stats
-        }
 
-        groups_json = json.dumps(final_data, ensure_ascii=False)
+def _incremental_watermark(previous: Optional[dict], mode: str, now: float) -> Optional[dict]:
+    """
+    Watermark del análisis guardado si corresponde un análisis incremental, si no None.
+    El incremental reconstruye los anuncios previos desde los links guardados, así que solo vale
+    si cada anuncio previo tiene su link: con anuncios sin ad_snapshot_url (reach y conteos sin
+    link) o con grupos clusterizados (los links quedaron bajo el cuerpo canónico, sin sus
+    variantes) se hace un análisis completo. Lo mismo con análisis guardados antes de
+    registrar `linkless_ads`.
+    """
+    if mode == "full" or not previous:
+        return None
+    watermark = previous.get("watermark") or {}
+    if not watermark.get("latest_start_time"):
+        return None
+    if watermark.get("clustered") or watermark.get("linkless_ads") != 0:
+        print(f"[meta_service] Previous analysis can't be merged incrementally "
+              f"(clustered={bool(watermark.get('clustered'))}, linkless_ads={watermark.get('linkless_ads')}): full run")
+        return None
+    if mode == "auto" and now - (watermark.get("last_full_at") or 0) > ANALYSIS_FULL_REFRESH_DAYS * 86400:
+        return None
+    return watermark
 
-        # Guardar en la BD
-        conn = get_db_connection()
-        try:
-            cursor = conn.cursor()
-            cursor.execute(
-                "UPDATE pages SET AdGroupsJson = CAST(? AS NVARCHAR(MAX)) WHERE Page_id = ?",
-                (groups_json, page_id)
-            )
-            conn.commit()
-            print(f"[meta_service] Saved AdGroupsJson for page {page_id} ({len(groups)} groups)")
-        except Exception as e:
-            print(f"[meta_service] Error saving to DB: {e}")
-            conn.rollback()
-            clear_analyzing_marker(page_id)
-        finally:
-            conn.close()
 
-    except Exception as e:
-        print(f"[meta_service] Unexpected error in analyze_and_save_page_groups: {e}")
-        clear_analyzing_marker(page_id)
+async def analyze_and_save_page_groups(page_id: str, mode: str = "auto", cluster: Optional[bool] = None) -> dict:
+    """
+    Proceso completo bajo demanda (lo ejecuta el AnalysisScheduler de jobs.py):
+    1. Los tokens de acceso salen de meta_token_pool en cada request.
+    2. Descarga los anuncios de la página lote a lote (una página de la API).
+    3. Agrega cada lote (grupos, países, actividad, reach) y lo descarta.
+    4. Guarda el JSON comprimido en pageAdGroups, con un watermark para el próximo análisis.
+    Modo incremental ('auto' si hay un análisis previo reciente, o 'incremental'): solo descarga
+    los anuncios que empezaron desde el watermark y los que siguen activos, y el resto sale de
+    los links guardados. 'full' descarga siempre todo el historial.
+    cluster: une grupos con cuerpos casi iguales (emojis, precios, espacios); None usa AD_GROUP_CLUSTERING.
+    Todo acceso a la BD pasa por run_db para no bloquear el event loop.
+    Si algo falla lanza la excepción (el job queda en 'failed') y el análisis previo no se toca:
+    una paginación cortada (IncompleteFetchError) nunca se guarda ni mueve el watermark.
+    """
+    if mode not in ANALYSIS_MODES:
+        raise ValueError(f"Unknown analysis mode '{mode}'")
+    print(f"[meta_service] Starting ad group analysis for page_id={page_id} (mode={mode})")
+
+    now = time.time()
+    previous = await run_db(load_page_groups, page_id) if mode != "full" else None
+    watermark = _incremental_watermark(previous, mode, now)
+
+    if cluster is None:
+        cluster = clustering.AD_GROUP_CLUSTERING
+    aggregator = PageAnalysisAggregator(clustering.AD_GROUP_CLUSTER_THRESHOLD if cluster else None)
+    page_size = page_size_controller.session(page_id)
+    if watermark is None:
+        async for ads in iter_page_ad_batches(page_id, page_size=page_size):
+            aggregator.add_ads(ads)
+        fetched = aggregator.ads_count
+    else:
+        # New ads since the watermark, then every ad that is still running (fresh reach/stop time).
+        # Both passes overlap, so ads are deduplicated by snapshot URL.
+        seen = set()
+        passes = (
+            {"ad_delivery_date_min": watermark["latest_start_time"][:10]},
+            {"ad_active_status": "ACTIVE"},
+        )
+        active_complete = False
+        for params in passes:
+            # Raises IncompleteFetchError on a truncated pass, before anything is saved
+            async for ads in iter_page_ad_batches(page_id, page_size=page_size, params=params):
+                fresh = []
+                for ad in ads:
+                    url = ad.get("ad_snapshot_url")
+                    if url:
+                        if url in seen:
+                            continue
+                        seen.add(url)
+                    fresh.append(ad)
+                aggregator.add_ads(fresh)
+            active_complete = active_complete or params.get("ad_active_status") == "ACTIVE"
+        fetched = aggregator.ads_count
+        # Active links not re-seen are closed only when the ACTIVE pass ran to its last page
+        today = time.strftime("%Y-%m-%d", time.gmtime(now)) if active_complete else None
+        aggregator.add_ads(stored_link_ads(previous, seen, today))
+    print(f"[meta_service] Fetched {fetched} ads for page {page_id} "
+          f"({page_size.requests} requests, limit {page_size.start}->{page_size.limit}, {page_size.retries} retries)")
+
+    final_data = aggregator.result()
+    groups = final_data["groups"]
+    print(f"[meta_service] Grouped into {len(groups)} groups and {len(final_data['country_stats'])} countries")
+
+    run_mode = "full" if watermark is None else "incremental"
+    ANALYSIS_ADS.inc(run_mode, amount=fetched)
+    ANALYSIS_ADS_PER_SECOND.observe(fetched / max(time.time() - now, 1e-3), run_mode)
+    final_data["watermark"] = {
+        "latest_start_time": aggregator.latest_start_time,
+        "analyzed_at": now,
+        "last_full_at": now if watermark is None else watermark.get("last_full_at"),
+        "mode": run_mode,
+        "clustered": bool(cluster),
+        "linkless_ads": aggregator.linkless_ads,
+    }
+
+    groups_json = json_dumps(final_data)
+
+    # Guardar en la BD
+    await run_db(save_page_groups, page_id, groups_json)
+    print(f"[meta_service] Saved ad groups for page {page_id} ({len(groups)} groups, {run_mode})")
+
+    return {
+        "mode": run_mode,
+        "ads": aggregator.ads_count,
+        "fetched": fetched,
+        "groups": len(groups),
+        "clustered": bool(cluster),
+        "page_size": page_size.summary(),
+    }
@@ -0,0 +1,230 @@
+"""
+metrics.py
+Minimal in-process metrics (counters, histograms and scrape-time gauges) exposed in the
+Prometheus text format at /metrics.
+
+Recording is a dict lookup and a couple of additions under one lock; cumulative buckets,
+formatting and gauge callbacks only run when /metrics is scraped. Values are per uvicorn
+worker process, like the /health/* stats. METRICS_ENABLED=0 turns every recorder into a no-op.
+"""
+
+import os
+import threading
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+from typing import Callable, Iterable, Iterator
+
+METRICS_ENABLED = os.environ.get("METRICS_ENABLED", "1") == "1"
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+# Bucket upper bounds
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)  # seconds
+JOB_BUCKETS = (1, 5, 15, 30, 60, 120, 300, 600, 1200, 1800, 3600, 7200)  # seconds
+RATE_BUCKETS = (10, 50, 100, 250, 500, 1000, 2500, 5000, 10000, 25000, 50000)  # per second
+
+_lock = threading.Lock()
+
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _labels(names: tuple, values: tuple, extra: str = "") -> str:
+    parts = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        parts.append(extra)
+    return "{" + ",".join(parts) + "}" if parts else ""
+
+
+def _number(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    if float(value).is_integer():
+        return str(int(value))
+    return repr(float(value))
+
+
+class Counter:
+    kind = "counter"
+
+    def __init__(self, name: str, documentation: str, labelnames: tuple = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = labelnames
+        self._values: dict[tuple, float] = {}
+
+    def inc(self, *labels, amount: float = 1):
+        if not METRICS_ENABLED:
+            return
+        with _lock:
+            self._values[labels] = self._values.get(labels, 0) + amount
+
+    def collect(self) -> list[str]:
+        with _lock:
+            items = list(self._values.items())
+        return [f"{self.name}{_labels(self.labelnames, labels)} {_number(value)}" for labels, value in items]
+
+
+class Histogram:
+    kind = "histogram"
+
+    def __init__(self, name: str, documentation: str, labelnames: tuple = (), buckets: tuple = LATENCY_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = labelnames
+        self.buckets = tuple(sorted(buckets))
+        # labels -> [per-bucket counts (last one is +Inf), sum]
+        self._series: dict[tuple, list] = {}
+
+    def observe(self, value: float, *labels):
+        if not METRICS_ENABLED:
+            return
+        index = bisect_left(self.buckets, value)
+        with _lock:
+            series = self._series.get(labels)
+            if series is None:
+                series = self._series[labels] = [[0] * (len(self.buckets) + 1), 0.0]
+            series[0][index] += 1
+            series[1] += value
+
+    @contextmanager
+    def time(self, *labels) -> Iterator[None]:
+        """Observes the seconds spent in the block (also when it raises)."""
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - started, *labels)
+
+    def collect(self) -> list[str]:
+        with _lock:
+            items = [(labels, list(counts), total) for labels, (counts, total) in self._series.items()]
+        lines = []
+        for labels, counts, total in items:
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float("inf"),), counts):
+                cumulative += count
+                le = 'le="' + _number(bound) + '"'
+                lines.append(f"{self.name}_bucket{_labels(self.labelnames, labels, le)} {cumulative}")
+            lines.append(f"{self.name}_sum{_labels(self.labelnames, labels)} {_number(total)}")
+            lines.append(f"{self.name}_count{_labels(self.labelnames, labels)} {cumulative}")
+        return lines
+
+
+class CallbackGauge:
+    """Gauge read at scrape time: `callback()` yields (label values tuple, value) pairs."""
+
+    kind = "gauge"
+
+    def __init__(self, name: str, documentation: str, labelnames: tuple,
+                 callback: Callable[[], Iterable[tuple[tuple, float]]]):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = labelnames
+        self._callback = callback
+
+    def collect(self) -> list[str]:
+        return [f"{self.name}{_labels(self.labelnames, labels)} {_number(value)}" for labels, value in self._callback()]
+
+
+class Registry:
+    def __init__(self):
+        self._metrics: dict[str, object] = {}
+
+    def _register(self, metric):
+        if metric.name in self._metrics:
+            raise ValueError(f"Metric '{metric.name}' is already registered")
+        self._metrics[metric.name] = metric
+        return metric
+
+    def counter(self, name: str, documentation: str, labelnames: tuple = ()) -> Counter:
+        return self._register(Counter(name, documentation, labelnames))
+
+    def histogram(self, name: str, documentation: str, labelnames: tuple = (),
+                  buckets: tuple = LATENCY_BUCKETS) -> Histogram:
+        return self._register(Histogram(name, documentation, labelnames, buckets))
+
+    def gauge(self, name: str, documentation: str, labelnames: tuple,
+              callback: Callable[[], Iterable[tuple[tuple, float]]]) -> CallbackGauge:
+        return self._register(CallbackGauge(name, documentation, labelnames, callback))
+
+    def render(self) -> str:
+        lines = []
+        for metric in list(self._metrics.values()):
+            try:
+                samples = metric.collect()
+            except Exception as e:
+                # A failing gauge callback must not break the whole scrape
+                print(f"[metrics] Could not collect {metric.name}: {e}")
+                continue
+            lines.append(f"# HELP {metric.name} {metric.documentation}")
+            lines.append(f"# TYPE {metric.name} {metric.kind}")
+            lines.extend(samples)
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = Registry()
+
+HTTP_REQUEST_DURATION = REGISTRY.histogram(
+    "http_request_duration_seconds", "HTTP request latency by route template.", ("method", "route", "status"))
+DB_CONNECT_DURATION = REGISTRY.histogram(
+    "db_connect_duration_seconds", "Time to open a new pyodbc connection.", ("pool",))
+DB_CHECKOUT_WAIT = REGISTRY.histogram(
+    "db_checkout_wait_seconds", "Time to borrow a pooled connection (wait, ping and connect included).", ("pool",))
+DB_POOL_TIMEOUTS = REGISTRY.counter(
+    "db_pool_timeouts_total", "Checkouts that gave up waiting for a free connection.", ("pool",))
+SQL_STATEMENT_DURATION = REGISTRY.histogram(
+    "sql_statement_duration_seconds", "Execution (and fetch) time of named SQL statements.", ("statement",))
+META_API_REQUEST_DURATION = REGISTRY.histogram(
+    "meta_api_request_duration_seconds", "Graph API request latency by HTTP status ('error' if no response).",
+    ("status",))
+META_API_RETRIES = REGISTRY.counter(
+    "meta_api_retries_total", "Graph API requests retried, by reason.", ("reason",))
+ANALYSIS_JOB_DURATION = REGISTRY.histogram(
+    "analysis_job_duration_seconds", "Ad-group analysis job run time by final state.", ("state",), JOB_BUCKETS)
+ANALYSIS_ADS = REGISTRY.counter(
+    "analysis_ads_total", "Ads fetched from the Graph API by ad-group analyses.", ("mode",))
+ANALYSIS_ADS_PER_SECOND = REGISTRY.histogram(
+    "analysis_ads_per_second", "Fetched ads per second of each ad-group analysis.", ("mode",), RATE_BUCKETS)
+
+
+def sql_timer(statement: str):
+    """`with sql_timer("pages_list"): cursor.execute(...)` records the block under that statement name."""
+    return SQL_STATEMENT_DURATION.time(statement)
+
+
+def render() -> str:
+    return REGISTRY.render()
+
+
+class MetricsMiddleware:
+    """
+    ASGI middleware recording HTTP_REQUEST_DURATION. Routes are labelled with their path
+    template (/api/pages/{page_id}/status), so page ids never become label values.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or not METRICS_ENABLED:
+            await self.app(scope, receive, send)
+            return
+
+        status_code = 500
+        started = time.perf_counter()
+
+        async def send_with_status(message):
+            nonlocal status_code
+            if message["type"] == "http.response.start":
+                status_code = message["status"]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_status)
+        finally:
+            # The router stores the matched route in the (shared) scope
+            route = getattr(scope.get("route"), "path", None) or "unmatched"
+            HTTP_REQUEST_DURATION.observe(time.perf_counter() - started, scope["method"], route, str(status_code))
@@ -0,0 +1,349 @@
+"""
+read_model.py
+Read model `pageListing` used by GET /api/pages.
+
+One row per (pages.Id, pagesProducts.Id) with the page columns, its status/notes, the niche name
+and the page's first creative (lowest ads.Id) already resolved. It is kept up to date by triggers
+on ads, pagesProducts, pages and niches, which only touch the rows of the pages they change, so
+list requests never have to scan `ads` or run the per-page window over it.
+
+The DDL is versioned (MIGRATIONS, applied version kept in schemaVersions): a startup on an
+up-to-date database only reads the version, so workers don't take schema locks on ads/pages/...
+on every deploy. Pending migrations run once, serialised across workers by an app lock, either at
+startup (READ_MODEL_MIGRATE_ON_STARTUP=1) or as a one-off with `python read_model.py`.
+
+Loads that bypass the triggers (bulk copy / BULK INSERT without FIRE_TRIGGERS, disabled triggers,
+TRUNCATE) leave pageListing stale: resync it afterwards with `python read_model.py rebuild`.
+"""
+
+import os
+
+import pyodbc
+
+READ_MODEL_MIGRATE_ON_STARTUP = os.environ.get("READ_MODEL_MIGRATE_ON_STARTUP", "1") == "1"
+READ_MODEL_MIGRATION_LOCK_TIMEOUT = float(os.environ.get("READ_MODEL_MIGRATION_LOCK_TIMEOUT", "600"))  # seconds
+
+# ProductId is pagesProducts.Id, or 0 for pages that don't have a pagesProducts row yet.
+# Filter/sort columns are bounded so they can live in the covering index.
+CREATE_TABLE = """
+    IF OBJECT_ID('dbo.pageListing', 'U') IS NULL
+    BEGIN
+        CREATE TABLE pageListing (
+            PageInternalId INT NOT NULL,
+            ProductId INT NOT NULL,
+            Page_id NVARCHAR(450) NULL,
+            Name NVARCHAR(MAX) NULL,
+            eu_total_reach BIGINT NULL,
+            active_eu_total_reach BIGINT NULL,
+            active_ads_count INT NULL,
+            category NVARCHAR(450) NULL,
+            TagName NVARCHAR(450) NULL,
+            TagId INT NULL,
+            status INT NULL,
+            status_updated_at DATETIME2 NULL,
+            beneficiary NVARCHAR(MAX) NULL,
+            page_notes NVARCHAR(MAX) NULL,
+            nicheName NVARCHAR(450) NULL,
+            firstAdId INT NULL,
+            creativeUrl NVARCHAR(MAX) NULL,
+            creative_type INT NULL,
+            AdSnapshotUrl NVARCHAR(MAX) NULL,
+            CONSTRAINT PK_pageListing PRIMARY KEY (PageInternalId, ProductId)
+        )
+    END
+"""
+
+# Narrow key for the status tab + reach ordering (and keyset seek); INCLUDE covers the
+# remaining filters and the per-page ROW_NUMBER so only the returned rows need lookups.
+CREATE_INDEX = """
+    IF NOT EXISTS (SELECT 1 FROM sys.indexes WHERE name = 'IX_pageListing_status_reach' AND object_id = OBJECT_ID('dbo.pageListing'))
+        CREATE INDEX IX_pageListing_status_reach
+            ON pageListing (status, eu_total_reach DESC, Page_id DESC)
+            INCLUDE (firstAdId, category, TagName, nicheName, status_updated_at)
+"""
+
+# Change watermark for the in-process name search index (search_index.py): every insert/update
+# of a row, including the trigger-maintained ones, gets a new RowVer. Adding the column rewrites
+# every row, so it is its own migration (run it with `python read_model.py` in a quiet window on a
+# large table); the index is built online so list queries keep running meanwhile.
+ADD_ROWVERSION = """
+    IF COL_LENGTH('dbo.pageListing', 'RowVer') IS NULL
+        ALTER TABLE pageListing ADD RowVer ROWVERSION
+"""
+
+CREATE_ROWVERSION_INDEX = """
+    IF NOT EXISTS (SELECT 1 FROM sys.indexes WHERE name = 'IX_pageListing_rowver' AND object_id = OBJECT_ID('dbo.pageListing'))
+        CREATE INDEX IX_pageListing_rowver ON pageListing (RowVer) INCLUDE (Name) WITH (ONLINE = ON)
+"""
+
+# trg_ads_pageListing and the source view look up each page's first ad with
+# TOP 1 ... WHERE pageId = ? ORDER BY Id; without this index every ad write scans `ads`.
+CREATE_ADS_FIRST_AD_INDEX = """
+    IF NOT EXISTS (SELECT 1 FROM sys.indexes WHERE name = 'IX_ads_pageId_Id' AND object_id = OBJECT_ID('dbo.ads'))
+        CREATE INDEX IX_ads_pageId_Id ON ads (pageId, Id)
+            INCLUDE (creativeUrl, creative_type, AdSnapshotUrl) WITH (ONLINE = ON)
+"""
+
+CREATE_SOURCE_VIEW = """
+    CREATE OR ALTER VIEW vw_pageListingSource AS
+    SELECT
+        pg.Id                                   AS PageInternalId,
+        ISNULL(pp.Id, 0)                        AS ProductId,
+        CAST(pg.Page_id AS NVARCHAR(450))       AS Page_id,
+        pg.Name,
+        pg.eu_total_reach,
+        pg.active_eu_total_reach,
+        pg.active_ads_count,
+        CAST(pg.category AS NVARCHAR(450))      AS category,
+        CAST(pg.TagName AS NVARCHAR(450))       AS TagName,
+        pg.TagId,
+        pp.status,
+        pp.status_updated_at,
+        pp.beneficiary,
+        pp.page_notes,
+        CAST(n.Name AS NVARCHAR(450))           AS nicheName,
+        fa.Id                                   AS firstAdId,
+        fa.creativeUrl,
+        fa.creative_type,
+        fa.AdSnapshotUrl
+    FROM pages pg
+    LEFT JOIN pagesProducts pp ON pp.pageId = pg.Id
+    LEFT JOIN niches n ON pp.nicheId = n.Id
+    OUTER APPLY (
+        SELECT TOP 1 a.Id, a.creativeUrl, a.creative_type, a.AdSnapshotUrl
+        FROM ads a
+        WHERE a.pageId = pg.Id
+        ORDER BY a.Id ASC
+    ) fa
+"""
+
+LISTING_COLUMNS = """
+    PageInternalId, ProductId, Page_id, Name, eu_total_reach, active_eu_total_reach, active_ads_count,
+    category, TagName, TagId, status, status_updated_at, beneficiary, page_notes, nicheName,
+    firstAdId, creativeUrl, creative_type, AdSnapshotUrl
+"""
+
+# Rebuilds the listing rows of every page touched by the statement.
+_RESYNC_PAGES = f"""
+        DELETE pl FROM pageListing pl WHERE pl.PageInternalId IN (SELECT Id FROM @changed);
+        INSERT INTO pageListing ({LISTING_COLUMNS})
+        SELECT {LISTING_COLUMNS}
+        FROM vw_pageListingSource
+        WHERE PageInternalId IN (SELECT Id FROM @changed);
+"""
+
+CREATE_TRIGGERS = [
+    # New/removed/edited ads only matter when they change a page's first creative
+    """
+    CREATE OR ALTER TRIGGER trg_ads_pageListing ON ads AFTER INSERT, UPDATE, DELETE AS
+    BEGIN
+        SET NOCOUNT ON;
+        IF EXISTS (SELECT 1 FROM inserted) AND EXISTS (SELECT 1 FROM deleted)
+           AND NOT (UPDATE(pageId) OR UPDATE(creativeUrl) OR UPDATE(creative_type) OR UPDATE(AdSnapshotUrl))
+            RETURN;
+
+        UPDATE pl
+        SET firstAdId = fa.Id,
+            creativeUrl = fa.creativeUrl,
+            creative_type = fa.creative_type,
+            AdSnapshotUrl = fa.AdSnapshotUrl
+        FROM pageListing pl
+        JOIN (SELECT pageId FROM inserted UNION SELECT pageId FROM deleted) c ON c.pageId = pl.PageInternalId
+        OUTER APPLY (
+            SELECT TOP 1 a.Id, a.creativeUrl, a.creative_type, a.AdSnapshotUrl
+            FROM ads a
+            WHERE a.pageId = pl.PageInternalId
+            ORDER BY a.Id ASC
+        ) fa
+        WHERE EXISTS (
+            SELECT pl.firstAdId, pl.creativeUrl, pl.creative_type, pl.AdSnapshotUrl
+            EXCEPT
+            SELECT fa.Id, fa.creativeUrl, fa.creative_type, fa.AdSnapshotUrl
+        );
+    END
+    """,
+    # Status, notes, beneficiary or niche changes (and new clones) re-sync the page
+    f"""
+    CREATE OR ALTER TRIGGER trg_pagesProducts_pageListing ON pagesProducts AFTER INSERT, UPDATE, DELETE AS
+    BEGIN
+        SET NOCOUNT ON;
+        IF EXISTS (SELECT 1 FROM inserted) AND EXISTS (SELECT 1 FROM deleted)
+           AND NOT (UPDATE(pageId) OR UPDATE(nicheId) OR UPDATE(status) OR UPDATE(status_updated_at)
+                    OR UPDATE(beneficiary) OR UPDATE(page_notes))
+            RETURN;
+
+        DECLARE @changed TABLE (Id INT PRIMARY KEY);
+        INSERT INTO @changed (Id)
+        SELECT pageId FROM inserted WHERE pageId IS NOT NULL
+        UNION
+        SELECT pageId FROM deleted WHERE pageId IS NOT NULL;
+        {_RESYNC_PAGES}
+    END
+    """,
+    # Page columns shown in the list; AdGroupsJson writes are ignored
+    f"""
+    CREATE OR ALTER TRIGGER trg_pages_pageListing ON pages AFTER INSERT, UPDATE, DELETE AS
+    BEGIN
+        SET NOCOUNT ON;
+        IF EXISTS (SELECT 1 FROM inserted) AND EXISTS (SELECT 1 FROM deleted)
+           AND NOT (UPDATE(Page_id) OR UPDATE(Name) OR UPDATE(eu_total_reach) OR UPDATE(active_eu_total_reach)
+                    OR UPDATE(active_ads_count) OR UPDATE(category) OR UPDATE(TagName) OR UPDATE(TagId))
+            RETURN;
+
+        DECLARE @changed TABLE (Id INT PRIMARY KEY);
+        INSERT INTO @changed (Id)
+        SELECT Id FROM inserted
+        UNION
+        SELECT Id FROM deleted;
+        {_RESYNC_PAGES}
+    END
+    """,
+    """
+    CREATE OR ALTER TRIGGER trg_niches_pageListing ON niches AFTER UPDATE, DELETE AS
+    BEGIN
+        SET NOCOUNT ON;
+        UPDATE pl
+        SET nicheName = CAST(n.Name AS NVARCHAR(450))
+        FROM pageListing pl
+        JOIN pagesProducts pp ON pp.Id = pl.ProductId
+        LEFT JOIN niches n ON n.Id = pp.nicheId
+        WHERE pp.nicheId IN (SELECT Id FROM inserted UNION SELECT Id FROM deleted);
+    END
+    """,
+]
+
+BACKFILL = f"""
+    IF NOT EXISTS (SELECT 1 FROM pageListing)
+        INSERT INTO pageListing ({LISTING_COLUMNS})
+        SELECT {LISTING_COLUMNS} FROM vw_pageListingSource
+"""
+
+
+# (version, description, statements). Every statement stays idempotent, so databases set up
+# before the versioning simply re-apply them once. Changing a trigger/view means a new entry.
+MIGRATIONS = [
+    (1, "table, indexes, source view, triggers and backfill",
+     [CREATE_TABLE, CREATE_INDEX, CREATE_SOURCE_VIEW, *CREATE_TRIGGERS, BACKFILL]),
+    (2, "RowVer change watermark for the page name search index",
+     [ADD_ROWVERSION, CREATE_ROWVERSION_INDEX]),
+    (3, "ads (pageId, Id) index for the first-ad lookups",
+     [CREATE_ADS_FIRST_AD_INDEX]),
+]
+READ_MODEL_VERSION = MIGRATIONS[-1][0]
+
+SELECT_VERSION = """
+    IF OBJECT_ID('dbo.schemaVersions', 'U') IS NULL
+        SELECT 0
+    ELSE
+        SELECT ISNULL((SELECT Version FROM schemaVersions WHERE Component = 'pageListing'), 0)
+"""
+
+CREATE_VERSION_TABLE = """
+    IF OBJECT_ID('dbo.schemaVersions', 'U') IS NULL
+        CREATE TABLE schemaVersions (
+            Component NVARCHAR(128) NOT NULL PRIMARY KEY,
+            Version INT NOT NULL,
+            AppliedAt DATETIME2 NOT NULL DEFAULT SYSUTCDATETIME()
+        )
+"""
+
+# Held until the migration transaction ends; >= 0 means granted
+GET_MIGRATION_LOCK = """
+    SET NOCOUNT ON;
+    DECLARE @result INT;
+    EXEC @result = sp_getapplock @Resource = 'pageListing_migrations', @LockMode = 'Exclusive',
+                                 @LockOwner = 'Transaction', @LockTimeout = ?;
+    SELECT @result;
+"""
+
+SET_VERSION = """
+    UPDATE schemaVersions SET Version = ?, AppliedAt = SYSUTCDATETIME() WHERE Component = 'pageListing';
+    IF @@ROWCOUNT = 0
+        INSERT INTO schemaVersions (Component, Version) VALUES ('pageListing', ?);
+"""
+
+
+def page_listing_version(db: pyodbc.Connection) -> int:
+    cursor = db.cursor()
+    cursor.execute(SELECT_VERSION)
+    return cursor.fetchone()[0]
+
+
+def migrate_page_listing(db: pyodbc.Connection) -> int:
+    """
+    Applies the pending MIGRATIONS in one transaction and returns the resulting version.
+    Concurrent callers (other workers) wait on the app lock and then find nothing left to do.
+    """
+    cursor = db.cursor()
+    try:
+        cursor.execute(GET_MIGRATION_LOCK, int(READ_MODEL_MIGRATION_LOCK_TIMEOUT * 1000))
+        result = cursor.fetchone()[0]
+        if result < 0:
+            raise RuntimeError(f"Could not get the pageListing migration lock (sp_getapplock returned {result})")
+        cursor.execute(CREATE_VERSION_TABLE)
+        # Re-read under the lock: another worker may have migrated while this one waited
+        version = page_listing_version(db)
+        for target, description, statements in MIGRATIONS:
+            if target <= version:
+                continue
+            print(f"[read_model] Applying pageListing migration {target}: {description}")
+            for sql in statements:
+                cursor.execute(sql)
+            version = target
+        cursor.execute(SET_VERSION, version, version)
+        db.commit()
+    except Exception:
+        db.rollback()
+        raise
+    return version
+
+
+def create_page_listing_if_not_exists(db: pyodbc.Connection):
+    """
+    Brings the pageListing read model (table, indexes, source view, triggers, backfill) up to
+    READ_MODEL_VERSION. On an up-to-date database this is a single read and no DDL runs.
+    """
+    version = page_listing_version(db)
+    if version >= READ_MODEL_VERSION:
+        return
+    if not READ_MODEL_MIGRATE_ON_STARTUP:
+        print(f"[read_model] pageListing schema is at version {version}, expected {READ_MODEL_VERSION}: "
+              f"run `python read_model.py`")
+        return
+    migrate_page_listing(db)
+
+
+def rebuild_page_listing(db: pyodbc.Connection) -> int:
+    """
+    Full rebuild from the source tables in one transaction, after a load that bypassed the
+    triggers (`python read_model.py rebuild`). Returns the number of listing rows.
+    """
+    cursor = db.cursor()
+    try:
+        cursor.execute("DELETE FROM pageListing")
+        cursor.execute(f"INSERT INTO pageListing ({LISTING_COLUMNS}) SELECT {LISTING_COLUMNS} FROM vw_pageListingSource")
+        rows = cursor.rowcount
+        db.commit()
+    except Exception:
+        db.rollback()
+        raise
+    return rows
+
+
+if __name__ == "__main__":
+    # python read_model.py          apply pending migrations (release step when READ_MODEL_MIGRATE_ON_STARTUP=0)
+    # python read_model.py rebuild  resync pageListing after a load that bypassed the triggers
+    import sys
+
+    from database import get_db_connection
+
+    command = sys.argv[1] if len(sys.argv) > 1 else "migrate"
+    if command not in ("migrate", "rebuild"):
+        sys.exit("usage: python read_model.py [migrate|rebuild]")
+    conn = get_db_connection()
+    try:
+        print(f"[read_model] pageListing schema at version {migrate_page_listing(conn)}")
+        if command == "rebuild":
+            print(f"[read_model] Rebuilt pageListing ({rebuild_page_listing(conn)} rows)")
+    finally:
+        conn.close()
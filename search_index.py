@@ -0,0 +1,254 @@
+"""
+search_index.py
+In-process trigram index of pageListing.Name -> PageInternalId (pages.Id) for the /api/pages
+searchTerm filter (per uvicorn worker).
+
+`Name LIKE '%term%'` can't use an index, so every search scanned the listing. lookup() returns
+the ids whose name contains the term, resolved from the index, and the SQL restricts the scan to
+them. The LIKE itself stays in the query, so results, ranking and the collation's matching are
+unchanged:
+- The index only has to be a superset. Names and terms are folded the way a case-insensitive
+  collation compares them (NFC, lowercase, ß/æ/œ/þ expansions, ignorable format characters dropped);
+  anything the fold can't answer (terms under 3 characters, LIKE wildcards, too many candidates,
+  index not loaded yet) falls back to the plain LIKE.
+- Rows inserted or updated since the index watermark (pageListing.RowVer) are matched by the
+  query directly, so a page is never missing between refreshes. Deleted pages linger until the
+  next full reload; the LIKE on the current row drops them.
+- Until the RowVer migration (read_model.py) is applied the index never loads and every search
+  uses the plain LIKE.
+
+Memory per page: its folded name plus ~4 bytes per distinct trigram (array('i') postings).
+"""
+
+import asyncio
+import os
+import threading
+import time
+import unicodedata
+from array import array
+from typing import Iterable, Optional
+
+import pyodbc
+
+from database import main_pool, pooled_connection, run_db
+
+SEARCH_INDEX_ENABLED = os.environ.get("SEARCH_INDEX_ENABLED", "1") == "1"
+SEARCH_INDEX_REFRESH_INTERVAL = float(os.environ.get("SEARCH_INDEX_REFRESH_INTERVAL", "30"))  # seconds
+SEARCH_INDEX_FULL_RELOAD_INTERVAL = float(os.environ.get("SEARCH_INDEX_FULL_RELOAD_INTERVAL", "21600"))  # seconds
+SEARCH_INDEX_MAX_CANDIDATES = int(os.environ.get("SEARCH_INDEX_MAX_CANDIDATES", "5000"))  # above: plain LIKE
+
+_FETCH_SIZE = 5000
+_LIKE_WILDCARDS = frozenset("%_[")
+# Expansions the collation treats as equal, and format characters (zero-width, soft hyphen...) it ignores
+_FOLD_TABLE = str.maketrans({
+    **{"ß": "ss", "æ": "ae", "œ": "oe", "þ": "th"},
+    **{chr(c): None for c in range(0x10000) if unicodedata.category(chr(c)) == "Cf"},
+})
+
+
+def fold(text: str) -> str:
+    """Case-insensitive comparison form of a name or search term."""
+    text = unicodedata.normalize("NFC", text).lower()
+    return text if text.isascii() else text.translate(_FOLD_TABLE)
+
+
+def trigrams(folded: str) -> set:
+    return {folded[i:i + 3] for i in range(len(folded) - 2)}
+
+
+def load_all_names(db: pyodbc.Connection) -> tuple[list, bytes]:
+    """(PageInternalId, Name) of every listing row below the current watermark, and that watermark."""
+    cursor = db.cursor()
+    cursor.execute("SELECT COL_LENGTH('dbo.pageListing', 'RowVer')")
+    if cursor.fetchone()[0] is None:
+        raise RuntimeError("pageListing.RowVer is missing, apply the read model migrations (python read_model.py)")
+    cursor.execute("SELECT MIN_ACTIVE_ROWVERSION()")
+    watermark = bytes(cursor.fetchone()[0])
+    cursor.execute("SELECT PageInternalId, Name FROM pageListing WHERE RowVer < ?", (watermark,))
+    rows = []
+    while True:
+        batch = cursor.fetchmany(_FETCH_SIZE)
+        if not batch:
+            break
+        rows.extend((row[0], row[1]) for row in batch)
+    return rows, watermark
+
+
+def load_changed_names(db: pyodbc.Connection, since: bytes) -> tuple[list, bytes]:
+    """Listing rows inserted/updated in [since, current watermark), and the new watermark."""
+    cursor = db.cursor()
+    cursor.execute("SELECT MIN_ACTIVE_ROWVERSION()")
+    watermark = bytes(cursor.fetchone()[0])
+    cursor.execute(
+        "SELECT PageInternalId, Name FROM pageListing WHERE RowVer >= ? AND RowVer < ?",
+        (since, watermark),
+    )
+    return [(row[0], row[1]) for row in cursor.fetchall()], watermark
+
+
+class PageSearchIndex:
+    """
+    Trigram postings (append-only until the next full reload) plus the current folded name of
+    each page, used to verify candidates so stale postings never leak into the results.
+    """
+
+    def __init__(
+        self,
+        refresh_interval: float = SEARCH_INDEX_REFRESH_INTERVAL,
+        full_reload_interval: float = SEARCH_INDEX_FULL_RELOAD_INTERVAL,
+        max_candidates: int = SEARCH_INDEX_MAX_CANDIDATES,
+    ):
+        self.refresh_interval = refresh_interval
+        self.full_reload_interval = full_reload_interval
+        self.max_candidates = max_candidates
+
+        self._lock = threading.Lock()
+        self._names: dict[int, str] = {}
+        self._postings: dict[str, array] = {}
+        self.watermark: Optional[bytes] = None
+        self._task: Optional[asyncio.Task] = None
+        self._loaded_at = 0.0
+
+        # Stats
+        self._lookups = 0
+        self._fallbacks = 0
+        self._refreshes = 0
+        self._changed_rows = 0
+        self._last_error: Optional[str] = None
+
+    @property
+    def ready(self) -> bool:
+        return self.watermark is not None
+
+    # --- building ---
+
+    @staticmethod
+    def _add(names: dict, postings: dict, page_id: int, name: Optional[str]):
+        folded = fold(name or "")
+        old = names.get(page_id)
+        if old == folded:
+            return
+        names[page_id] = folded
+        grams = trigrams(folded)
+        if old:
+            grams -= trigrams(old)
+        for gram in grams:
+            posting = postings.get(gram)
+            if posting is None:
+                posting = postings[gram] = array("i")
+            posting.append(page_id)
+
+    def replace(self, rows: Iterable[tuple[int, Optional[str]]], watermark: bytes):
+        """Full (re)build; the previous index keeps answering until the swap."""
+        names: dict[int, str] = {}
+        postings: dict[str, array] = {}
+        for page_id, name in rows:
+            self._add(names, postings, page_id, name)
+        with self._lock:
+            self._names, self._postings, self.watermark = names, postings, watermark
+        self._loaded_at = time.monotonic()
+
+    def apply(self, rows: Iterable[tuple[int, Optional[str]]], watermark: bytes):
+        """Incremental update with the rows changed since the current watermark."""
+        with self._lock:
+            for page_id, name in rows:
+                self._add(self._names, self._postings, page_id, name)
+                self._changed_rows += 1
+            self.watermark = watermark
+
+    # --- querying ---
+
+    def lookup(self, term: str) -> Optional[tuple[list, bytes]]:
+        """
+        (sorted candidate ids, watermark) for `Name LIKE '%term%'`, or None if the index
+        can't answer and the query has to use the plain LIKE.
+        """
+        folded = fold(term)
+        # Called from threadpool endpoints: the counters are only updated under the lock
+        if not self.ready or len(folded) < 3 or any(c in _LIKE_WILDCARDS for c in term):
+            with self._lock:
+                self._lookups += 1
+                self._fallbacks += 1
+            return None
+        with self._lock:
+            self._lookups += 1
+            names, watermark = self._names, self.watermark
+            postings = [self._postings.get(gram) for gram in trigrams(folded)]
+            if any(posting is None for posting in postings):
+                shortest = array("i")
+            else:
+                shortest = min(postings, key=len)[:]
+        ids = sorted({page_id for page_id in shortest if folded in names.get(page_id, "")})
+        if len(ids) > self.max_candidates:
+            with self._lock:
+                self._fallbacks += 1
+            return None
+        return ids, watermark
+
+    # --- background refresh ---
+
+    async def start(self):
+        if self._task is None and SEARCH_INDEX_ENABLED:
+            self._task = asyncio.create_task(self._refresh_loop())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+
+    async def _refresh_loop(self):
+        while True:
+            await self.refresh()
+            await asyncio.sleep(self.refresh_interval)
+
+    async def refresh(self):
+        """Full load the first time and every full_reload_interval, otherwise only the changed rows."""
+        try:
+            full = not self.ready or time.monotonic() - self._loaded_at >= self.full_reload_interval
+            if full:
+                started = time.monotonic()
+                rows, watermark = await run_db(self._load_all)
+                # CPU-only: build off the event loop without holding a DB executor thread
+                await asyncio.to_thread(self.replace, rows, watermark)
+                print(f"[search_index] Indexed {len(self._names)} page names in {time.monotonic() - started:.1f}s")
+            else:
+                rows, watermark = await run_db(self._load_changed, self.watermark)
+                self.apply(rows, watermark)
+            self._refreshes += 1
+            self._last_error = None
+        except Exception as e:
+            if str(e) != self._last_error:
+                # Logged once per distinct error, not on every refresh interval
+                print(f"[search_index] Error refreshing page name index: {e}")
+            self._last_error = str(e)
+
+    @staticmethod
+    def _load_all() -> tuple[list, bytes]:
+        with pooled_connection(main_pool) as db:
+            return load_all_names(db)
+
+    @staticmethod
+    def _load_changed(since: bytes) -> tuple[list, bytes]:
+        with pooled_connection(main_pool) as db:
+            return load_changed_names(db, since)
+
+    def stats(self) -> dict:
+        with self._lock:
+            postings = sum(len(p) for p in self._postings.values())
+            return {
+                "enabled": SEARCH_INDEX_ENABLED,
+                "ready": self.ready,
+                "pages": len(self._names),
+                "trigrams": len(self._postings),
+                "postings": postings,
+                "lookups": self._lookups,
+                "fallbacks": self._fallbacks,
+                "refreshes": self._refreshes,
+                "changed_rows": self._changed_rows,
+                "watermark": self.watermark.hex() if self.watermark else None,
+                "last_error": self._last_error,
+            }
+
+
+page_search_index = PageSearchIndex()
@@ -0,0 +1,261 @@
+"""
+token_pool.py
+In-process pool of Graph API access tokens (per uvicorn worker).
+
+The READY tokens are loaded from the 'backend' DB in the background and handed out per request,
+least-loaded first (round-robin among equals). Meta's usage headers and throttling errors put a
+token in cooldown before it gets blocked; auth errors quarantine it.
+"""
+
+import asyncio
+import json
+import os
+import time
+from dataclasses import dataclass, field
+from typing import Callable, Iterable, Optional
+
+from database import run_db
+
+TOKEN_REFRESH_INTERVAL = float(os.environ.get("META_TOKEN_REFRESH_INTERVAL", "300"))  # seconds
+TOKEN_USAGE_SOFT = float(os.environ.get("META_TOKEN_USAGE_SOFT", "75"))  # % usage: deprioritise the token
+TOKEN_USAGE_HIGH = float(os.environ.get("META_TOKEN_USAGE_HIGH", "90"))  # % usage: stop using it for a while
+TOKEN_BACKOFF_SECONDS = float(os.environ.get("META_TOKEN_BACKOFF_SECONDS", "60"))
+TOKEN_BACKOFF_MAX = float(os.environ.get("META_TOKEN_BACKOFF_MAX", "3600"))
+TOKEN_QUARANTINE_SECONDS = float(os.environ.get("META_TOKEN_QUARANTINE_SECONDS", "3600"))
+TOKEN_ACQUIRE_TIMEOUT = float(os.environ.get("META_TOKEN_ACQUIRE_TIMEOUT", "900"))  # max wait for a usable token
+
+# Graph API error codes (https://developers.facebook.com/docs/graph-api/overview/rate-limiting)
+RATE_LIMIT_CODES = {4, 17, 32, 613} | set(range(80000, 80015))
+AUTH_ERROR_CODES = {10, 102, 190, 463, 467} | set(range(200, 300))
+
+OK = "ok"
+THROTTLED = "throttled"
+AUTH_ERROR = "auth_error"
+
+
+class NoTokenAvailableError(Exception):
+    """Raised by acquire() when no READY token exists or none became usable in time."""
+
+
+@dataclass
+class _TokenState:
+    token_id: int
+    token: str
+    in_flight: int = 0
+    requests: int = 0
+    throttles: int = 0
+    strikes: int = 0  # consecutive throttles, drives the exponential backoff
+    usage: float = 0.0  # highest % reported by the usage headers on the last response
+    cooldown_until: float = 0.0
+    quarantined_until: float = 0.0
+    last_error: Optional[str] = None
+
+    def usable_at(self) -> float:
+        return max(self.cooldown_until, self.quarantined_until)
+
+
+@dataclass
+class TokenLease:
+    """A token handed out for one request; give it back with AccessTokenPool.release()."""
+    token: str
+    _state: _TokenState = field(repr=False)
+    _released: bool = field(default=False, repr=False)
+
+
+def classify_error(error: Optional[dict]) -> str:
+    """Maps a Graph API `error` object to OK / THROTTLED / AUTH_ERROR."""
+    if not error:
+        return OK
+    code = error.get("code")
+    if code in RATE_LIMIT_CODES:
+        return THROTTLED
+    if code in AUTH_ERROR_CODES:
+        return AUTH_ERROR
+    return OK
+
+
+def parse_usage_headers(headers) -> tuple[float, float]:
+    """
+    Reads x-app-usage and x-business-use-case-usage.
+    Returns (highest usage %, seconds until access is regained as estimated by Meta).
+    """
+    usage = 0.0
+    regain = 0.0
+
+    raw = headers.get("x-app-usage")
+    if raw:
+        try:
+            data = json.loads(raw)
+            usage = max([usage] + [float(v) for v in data.values() if isinstance(v, (int, float))])
+        except (ValueError, AttributeError):
+            pass
+
+    raw = headers.get("x-business-use-case-usage")
+    if raw:
+        try:
+            for entries in json.loads(raw).values():
+                for entry in entries:
+                    for key in ("call_count", "total_cputime", "total_time"):
+                        usage = max(usage, float(entry.get(key) or 0))
+                    regain = max(regain, float(entry.get("estimated_time_to_regain_access") or 0) * 60)
+        except (ValueError, AttributeError, TypeError):
+            pass
+
+    return usage, regain
+
+
+class AccessTokenPool:
+    """
+    Hands out access tokens loaded by `loader()` (blocking, run via run_db), which returns
+    (id, token) pairs. Call start() on startup: it loads the tokens and refreshes them every
+    `refresh_interval` seconds in the background.
+    """
+
+    def __init__(
+        self,
+        loader: Callable[[], Iterable[tuple[int, str]]],
+        refresh_interval: float = TOKEN_REFRESH_INTERVAL,
+        acquire_timeout: float = TOKEN_ACQUIRE_TIMEOUT,
+    ):
+        self._loader = loader
+        self.refresh_interval = refresh_interval
+        self.acquire_timeout = acquire_timeout
+        self._tokens: dict[str, _TokenState] = {}
+        self._order: list[str] = []
+        self._rr = 0
+        self._refresh_task: Optional[asyncio.Task] = None
+        self._last_refresh: Optional[float] = None
+        self._waits = 0
+
+    # --- lifecycle ---
+
+    async def start(self):
+        if self._refresh_task is not None:
+            return
+        await self.refresh()
+        self._refresh_task = asyncio.create_task(self._refresh_loop())
+
+    async def stop(self):
+        if self._refresh_task is not None:
+            self._refresh_task.cancel()
+            await asyncio.gather(self._refresh_task, return_exceptions=True)
+            self._refresh_task = None
+
+    async def _refresh_loop(self):
+        while True:
+            await asyncio.sleep(self.refresh_interval)
+            await self.refresh()
+
+    async def refresh(self):
+        """Reloads the READY tokens; cooldown/quarantine of tokens that are still READY is kept."""
+        try:
+            rows = await run_db(self._loader)
+        except Exception as e:
+            print(f"[meta_service] Error refreshing access tokens: {e}")
+            return
+        tokens = {}
+        for token_id, token in rows:
+            if token:
+                tokens[token] = self._tokens.get(token) or _TokenState(token_id=token_id, token=token)
+        self._tokens = tokens
+        self._order = list(tokens)
+        self._last_refresh = time.time()
+        if not tokens:
+            print("[meta_service] No tokens found with status='READY' in 'backend' DB")
+
+    # --- leases ---
+
+    def _pick(self, now: float) -> Optional[_TokenState]:
+        count = len(self._order)
+        best = None
+        best_key = None
+        best_index = 0
+        for i in range(count):
+            index = (self._rr + i) % count
+            state = self._tokens[self._order[index]]
+            if state.usable_at() > now:
+                continue
+            key = (state.usage >= TOKEN_USAGE_SOFT, state.in_flight)
+            if best is None or key < best_key:
+                best, best_key, best_index = state, key, index
+        if best is not None:
+            # Next search starts after the chosen token, so equally loaded tokens take turns
+            self._rr = (best_index + 1) % count
+        return best
+
+    async def acquire(self) -> TokenLease:
+        deadline = time.monotonic() + self.acquire_timeout
+        if not self._tokens:
+            await self.refresh()
+        while True:
+            now = time.time()
+            state = self._pick(now)
+            if state is not None:
+                state.in_flight += 1
+                state.requests += 1
+                return TokenLease(token=state.token, _state=state)
+            if not self._tokens:
+                raise NoTokenAvailableError("No access token with status='READY' found")
+            wait = min(s.usable_at() for s in self._tokens.values()) - now
+            remaining = deadline - time.monotonic()
+            if wait > remaining:
+                raise NoTokenAvailableError(f"All {len(self._tokens)} access tokens are throttled or quarantined")
+            self._waits += 1
+            await asyncio.sleep(max(wait, 0.05))
+
+    def release(self, lease: TokenLease):
+        if not lease._released:
+            lease._released = True
+            lease._state.in_flight -= 1
+
+    def report(self, lease: TokenLease, headers, error: Optional[dict] = None) -> str:
+        """
+        Feeds a response back into the token's state. Returns OK, THROTTLED or AUTH_ERROR;
+        on the last two the request should be retried with another lease.
+        """
+        state = lease._state
+        now = time.time()
+        usage, regain = parse_usage_headers(headers)
+        state.usage = usage
+        outcome = classify_error(error)
+
+        if outcome == AUTH_ERROR:
+            state.quarantined_until = now + TOKEN_QUARANTINE_SECONDS
+            state.last_error = str((error or {}).get("message") or "auth error")[:200]
+            print(f"[meta_service] Access token {state.token_id} quarantined: {state.last_error}")
+        elif outcome == THROTTLED or usage >= TOKEN_USAGE_HIGH:
+            state.throttles += 1
+            state.strikes += 1
+            backoff = min(TOKEN_BACKOFF_SECONDS * 2 ** (state.strikes - 1), TOKEN_BACKOFF_MAX)
+            state.cooldown_until = now + max(regain, backoff)
+            if error:
+                state.last_error = str(error.get("message") or "throttled")[:200]
+            print(f"[meta_service] Access token {state.token_id} cooling down for "
+                  f"{state.cooldown_until - now:.0f}s (usage={usage:.0f}%)")
+        else:
+            state.strikes = 0
+        return outcome
+
+    # --- queries ---
+
+    def stats(self) -> dict:
+        now = time.time()
+        return {
+            "tokens": len(self._tokens),
+            "available": sum(1 for s in self._tokens.values() if s.usable_at() <= now),
+            "waits": self._waits,
+            "last_refresh": self._last_refresh,
+            "per_token": [
+                {
+                    "id": s.token_id,
+                    "in_flight": s.in_flight,
+                    "requests": s.requests,
+                    "throttles": s.throttles,
+                    "usage": s.usage,
+                    "cooldown_seconds": round(max(s.cooldown_until - now, 0), 1),
+                    "quarantined_seconds": round(max(s.quarantined_until - now, 0), 1),
+                    "last_error": s.last_error,
+                }
+                for s in self._tokens.values()
+            ],
+        }